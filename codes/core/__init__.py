@@ -3,7 +3,9 @@
 from .dist_utils import get_dist_info, init_dist
 from .evaluation import mean_class_accuracy, top_k_accuracy
 from .fp16 import auto_fp16
+from .load_telemetry import LoadTelemetryHook
 from .parallel import MMDataParallel, MMDistributedDataParallel
+from .pipeline_profiler import PipelineProfilerHook
 from .test import multi_gpu_test, single_gpu_test
 from .train import set_random_seed, train_network
 
@@ -11,7 +13,8 @@ __all__ = [
     'init_dist', 'get_dist_info',
     'mean_class_accuracy', 'top_k_accuracy',
     'Fp16OptimizerHook', 'auto_fp16', 'force_fp32', 'wrap_fp16_model',
-    'MMDataParallel', 'MMDistributedDataParallel',
+    'MMDataParallel', 'MMDistributedDataParallel', 'PipelineProfilerHook',
+    'LoadTelemetryHook',
     'set_random_seed', 'train_network',
     'single_gpu_test', 'multi_gpu_test'
     ]
@@ -12,15 +12,24 @@ from paddle.io import Dataset
 from .accuracy import top_k_accuracy
 from ..parallel import collate, scatter
 from codes import datasets
+from codes.datasets import CachedDataset
 
 
 class DistEvalHook(Hook):
-    """Distributed evaluation hook based on epochs."""
+    """Distributed evaluation hook based on epochs.
 
-    def __init__(self, dataset, interval=1, distributed=True):
+    With `cache_dir` (on a local disk), the preprocessed clips of the first
+    evaluation are cached and read back by the following ones, see
+    `CachedDataset`.
+    """
+
+    def __init__(self, dataset, interval=1, distributed=True,
+                 cache_dir=None):
+        self.dataset_cfg = None
         if isinstance(dataset, Dataset):
             self.dataset = dataset
         elif isinstance(dataset, dict):
+            self.dataset_cfg = dataset
             self.dataset = obj_from_dict(dataset, datasets,
                                          {'test_mode': True})
         else:
@@ -29,6 +38,17 @@ class DistEvalHook(Hook):
                     type(dataset)))
         self.interval = interval
         self.dist = distributed
+        self.cache_dir = cache_dir
+        self._cached_dataset = None
+
+    def _eval_dataset(self, runner):
+        if self.cache_dir is None:
+            return self.dataset
+        if self._cached_dataset is None:
+            self._cached_dataset = CachedDataset(
+                self.dataset, self.cache_dir, cfg=self.dataset_cfg,
+                rank=runner.rank, world_size=runner.world_size)
+        return self._cached_dataset
 
     def after_train_epoch(self, runner):
         """Called after every training epoch to evaluate the results."""
@@ -36,11 +56,12 @@ class DistEvalHook(Hook):
         if not self.every_n_epochs(runner, self.interval):
             return
         runner.model.eval()
+        dataset = self._eval_dataset(runner)
         results = [None for _ in range(len(self.dataset))]
         if runner.rank == 0:
             prog_bar = mmcv.ProgressBar(len(self.dataset))
         for idx in range(runner.rank, len(self.dataset), runner.world_size):
-            data = self.dataset[idx]
+            data = dataset[idx]
             data_gpu = scatter(
                 collate([data], samples_per_gpu=1),
                 paddle.distributed.get_rank())
@@ -80,8 +101,10 @@ class DistEvalHook(Hook):
 class DistEvalTopKAccuracyHook(DistEvalHook):
     """Distributed TopK evaluation hook """
 
-    def __init__(self, dataset, interval=1, k=(1, ), dist=True):
-        super(DistEvalTopKAccuracyHook, self).__init__(dataset, interval, dist)
+    def __init__(self, dataset, interval=1, k=(1, ), dist=True,
+                 cache_dir=None):
+        super(DistEvalTopKAccuracyHook, self).__init__(dataset, interval, dist,
+                                                       cache_dir)
         self.k = k
 
     def evaluate(self, runner, results):
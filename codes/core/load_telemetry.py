@@ -0,0 +1,91 @@
+"""load telemetry hook
+"""
+import os.path as osp
+
+import numpy as np
+from mmcv.runner.hooks.hook import Hook
+
+from codes.utils import get_root_logger
+
+
+class LoadTelemetryHook(Hook):
+    """Report the per-sample load time of the training dataset every epoch.
+
+    The hook enables the `LoadTelemetry` of the training dataset (or of the
+    dataset it wraps) before the workers of each epoch are started. At the
+    end of the epoch, the load time percentiles, retries and bytes read of
+    the samples and the slowest samples are written to
+    `work_dir/load_telemetry_epoch{N}.txt` (`..._rank{R}.txt` in
+    distributed training, each rank reporting its own workers); rank 0 also
+    logs the summary. The slowest samples are listed as `filename seconds
+    retries bytes idx` lines, the input of
+    `data_process/transcode_videos.py --decode_times`.
+
+    Args:
+        top_k (int): Number of slowest samples reported. Default: 20.
+        capacity (int): Samples kept per worker for the percentiles.
+            Default: 4096.
+        num_slots (int): Max number of workers recorded. Default: 64.
+    """
+
+    def __init__(self, top_k=20, capacity=4096, num_slots=64):
+        self.top_k = top_k
+        self.capacity = capacity
+        self.num_slots = num_slots
+        self.dataset = None
+        self.telemetry = None
+        self.logger = get_root_logger()
+
+    def before_train_epoch(self, runner):
+        dataset = runner.data_loader.dataset
+        # e.g. an EchoDataset
+        while not hasattr(dataset, 'enable_telemetry') and \
+                hasattr(dataset, 'dataset'):
+            dataset = dataset.dataset
+        if not hasattr(dataset, 'enable_telemetry'):
+            self.logger.warning('The training dataset records no load '
+                                'telemetry')
+            return
+        self.dataset = dataset
+        self.telemetry = dataset.enable_telemetry(
+            capacity=self.capacity, top_k=self.top_k,
+            num_slots=self.num_slots)
+        self.telemetry.reset()
+
+    def _format_report(self, epoch, num_samples, records, slowest):
+        lines = ['# epoch {}: {} samples, {} kept for the percentiles'.format(
+            epoch, num_samples, len(records))]
+        if len(records) > 0:
+            seconds, retries, num_bytes = records[:, 1], records[:, 2], \
+                records[:, 3]
+            p50, p95, p99 = np.percentile(seconds, [50, 95, 99])
+            lines.append(
+                '# seconds: p50 {:.4f}, p95 {:.4f}, p99 {:.4f}, '
+                'max {:.4f}'.format(p50, p95, p99, seconds.max()))
+            lines.append('# retries: {} in {} samples'.format(
+                int(retries.sum()), int((retries > 0).sum())))
+            mb_p50, mb_p95 = np.percentile(num_bytes, [50, 95]) / 1024 / 1024
+            lines.append('# MB read: p50 {:.2f}, p95 {:.2f}, total '
+                         '{:.1f}'.format(mb_p50, mb_p95,
+                                         num_bytes.sum() / 1024 / 1024))
+        lines.append('# slowest samples: filename seconds retries bytes idx')
+        for idx, seconds, retries, num_bytes in slowest.tolist():
+            lines.append('{} {:.4f} {} {} {}'.format(
+                self.dataset.video_infos[int(idx)]['filename'], seconds,
+                int(retries), int(num_bytes), int(idx)))
+        return '\n'.join(lines)
+
+    def after_train_epoch(self, runner):
+        if self.telemetry is None:
+            return
+        num_samples, records, slowest = self.telemetry.collect()
+        report = self._format_report(runner.epoch + 1, num_samples, records,
+                                     slowest)
+        filename = 'load_telemetry_epoch{}'.format(runner.epoch + 1)
+        if runner.world_size > 1:
+            filename += '_rank{}'.format(runner.rank)
+        with open(osp.join(runner.work_dir, filename + '.txt'), 'w') as f:
+            f.write(report + '\n')
+        if runner.rank == 0:
+            self.logger.info('load telemetry of epoch {}:\n{}'.format(
+                runner.epoch + 1, report))
@@ -0,0 +1,63 @@
+"""pipeline profiler hook
+"""
+import numpy as np
+from mmcv.runner.hooks.hook import Hook
+
+from codes.datasets.pipelines.compose import PipelineStats
+from codes.utils import get_root_logger
+
+
+class PipelineProfilerHook(Hook):
+    """Report the per-transform stats of the training pipeline.
+
+    The hook enables the profiling of the `Compose` of the training dataset
+    before the workers of each epoch are started. Every `interval`
+    iterations, the ms per call of every transform over the last window is
+    logged through the root logger and pushed to `runner.log_buffer`, where
+    the logger hooks (e.g. TensorBoard) pick it up. The table of the whole
+    epoch is logged at the end of the epoch.
+
+    The stats are those of the workers of the local rank, only rank 0
+    reports them.
+
+    Args:
+        interval (int): Report interval in iterations. Default: 50.
+    """
+
+    def __init__(self, interval=50):
+        self.interval = interval
+        self.stats = None
+        self._last = None
+        self.logger = get_root_logger()
+
+    def before_train_epoch(self, runner):
+        pipeline = getattr(runner.data_loader.dataset, 'pipeline', None)
+        if pipeline is None or not hasattr(pipeline, 'enable_profiling'):
+            self.logger.warning('The training dataset has no Compose '
+                                'pipeline, nothing to profile')
+            return
+        self.stats = pipeline.enable_profiling()
+        self.stats.reset()
+        self._last = self.stats.snapshot()
+
+    def after_train_iter(self, runner):
+        if self.stats is None or runner.rank != 0 or \
+                not self.every_n_iters(runner, self.interval):
+            return
+        counters = self.stats.snapshot()
+        window = counters - self._last
+        self._last = counters
+        ms_per_call = window[:, 1] * 1e3 / np.maximum(window[:, 0], 1)
+        runner.log_buffer.update({
+            'pipeline/{}'.format(name): value
+            for name, value in zip(self.stats.names, ms_per_call)})
+        self.logger.info('pipeline ms/call: ' + ', '.join(
+            '{}: {:.2f}'.format(name, value)
+            for name, value in zip(self.stats.names, ms_per_call)))
+
+    def after_train_epoch(self, runner):
+        if self.stats is None or runner.rank != 0:
+            return
+        self.logger.info('pipeline stats of epoch {}:\n{}'.format(
+            runner.epoch + 1, PipelineStats.format_table(
+                self.stats.names, self.stats.snapshot())))
@@ -17,6 +17,8 @@ from codes.utils import get_root_logger, load_checkpoint
 from codes.core.dist_utils import DistOptimizerHook
 from codes.core.evaluation import DistEvalTopKAccuracyHook
 from codes.core.fp16 import Fp16OptimizerHook
+from codes.core.load_telemetry import LoadTelemetryHook
+from codes.core.pipeline_profiler import PipelineProfilerHook
 from codes.core.parallel import MMDataParallel, MMDistributedDataParallel
 
 # from torch.nn.parallel import DataParallel, DistributedDataParallel
@@ -189,13 +191,22 @@ def _dist_train(model, dataset, cfg, validate=False):
     # register hooks
     runner.register_training_hooks(cfg.lr_config, optimizer_config,
                                    cfg.checkpoint_config, cfg.log_config)
+    # profile the training pipeline, e.g. pipeline_profile=dict(interval=50)
+    if cfg.get('pipeline_profile', None) is not None:
+        runner.register_hook(PipelineProfilerHook(**cfg.pipeline_profile))
+    # report the slowest samples, e.g. load_telemetry=dict(top_k=20)
+    if cfg.get('load_telemetry', None) is not None:
+        runner.register_hook(LoadTelemetryHook(**cfg.load_telemetry))
     runner.register_hook(DistSamplerSeedHook())
     # register eval hooks
     if validate:
         if cfg.data.val.type in ['RawFramesDataset', 'VideoDataset']:
+            # cache the val clips on a local disk, e.g.
+            # eval_cache_dir='/tmp/val_cache'
             runner.register_hook(
                 DistEvalTopKAccuracyHook(
-                    cfg.data.val, interval=cfg.eval_interval, k=(1, 5)))
+                    cfg.data.val, interval=cfg.eval_interval, k=(1, 5),
+                    cache_dir=cfg.get('eval_cache_dir', None)))
 
     # if validate:
     #     if isinstance(model.module, RPN):
@@ -241,13 +252,19 @@ def _non_dist_train(model, dataset, cfg, validate=False):
         optimizer_config = cfg.optimizer_config
     runner.register_training_hooks(cfg.lr_config, optimizer_config,
                                    cfg.checkpoint_config, cfg.log_config)
+    # profile the training pipeline, e.g. pipeline_profile=dict(interval=50)
+    if cfg.get('pipeline_profile', None) is not None:
+        runner.register_hook(PipelineProfilerHook(**cfg.pipeline_profile))
+    # report the slowest samples, e.g. load_telemetry=dict(top_k=20)
+    if cfg.get('load_telemetry', None) is not None:
+        runner.register_hook(LoadTelemetryHook(**cfg.load_telemetry))
 
     if validate:
         if cfg.data.val.type in ['RawFramesDataset', 'VideoDataset']:
             runner.register_hook(
                 DistEvalTopKAccuracyHook(
                     cfg.data.val, interval=cfg.eval_interval, k=(1, 5),
-                    dist=False))
+                    dist=False, cache_dir=cfg.get('eval_cache_dir', None)))
 
     if cfg.resume_from:
         runner.resume(cfg.resume_from)
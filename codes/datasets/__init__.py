@@ -1,12 +1,17 @@
 """init dataset loader"""
 from .builder import build_dataset
+from .eval_cache import CachedDataset
+from .load_telemetry import LoadTelemetry
 from .loader import build_dataloader
 from .rawframes_dataset import RawFramesDataset
 from .video_dataset import VideoDataset
 from .pkl_dataset import PklDataset
+from .shard_dataset import ShardRawFramesDataset
+from .video_infos import VideoInfos
 
 __all__ = [
     'build_dataset',
     'build_dataloader',
-    'RawFramesDataset', 'VideoDataset', 'PklDataset'
+    'RawFramesDataset', 'VideoDataset', 'PklDataset', 'ShardRawFramesDataset',
+    'VideoInfos', 'CachedDataset', 'LoadTelemetry'
 ]
@@ -1,11 +1,12 @@
 # !/usr/bin/env python3
 """base dataset"""
-import copy
 from abc import ABCMeta, abstractmethod
 
 # from torch.utils.data import Dataset
 from paddle.io import Dataset
+from codes.datasets.load_telemetry import LoadTelemetry
 from codes.datasets.pipelines import Compose
+from codes.datasets.video_infos import VideoInfos
 
 
 class BaseDataset(Dataset, metaclass=ABCMeta):
@@ -16,10 +17,20 @@ class BaseDataset(Dataset, metaclass=ABCMeta):
         Methods:`load_annotations`, supporting to load information
             from an annotation file.
         Methods:`prepare_frames`, providing data.
+    Subclasses adding fields to the input of the pipeline overwrite
+    `prepare_results`.
+
+    The infos returned by `load_annotations` are packed into a `VideoInfos`,
+    whose items are fresh dicts that the pipeline is free to modify.
+
+    With `enable_telemetry()` (before the workers are started), the load
+    time, retries and bytes read of every sample are recorded in a
+    `LoadTelemetry`, see `LoadTelemetryHook`.
 
     Args:
         ann_file (str): Path to the annotation file.
-        pipeline (list[dict | callable]): A sequence of data transforms.
+        pipeline (list[dict | callable] | dict): A sequence of data
+            transforms, or the arguments of `Compose`.
         data_root (str): Path to a directory where videos are held.
     """
 
@@ -30,22 +41,39 @@ class BaseDataset(Dataset, metaclass=ABCMeta):
         self.ann_file = ann_file
         self.data_root = data_root
         self.test_mode = test_mode
-        self.pipeline = Compose(pipeline)
-        self.video_infos = self.load_annotations()
+        if isinstance(pipeline, dict):
+            self.pipeline = Compose(**pipeline)
+        else:
+            self.pipeline = Compose(pipeline)
+        self.video_infos = VideoInfos(self.load_annotations())
         self.modality = modality
+        self.telemetry = None
 
     @abstractmethod
     def load_annotations(self):
         pass
 
-    def prepare_frames(self, idx):
-        results = copy.deepcopy(self.video_infos[idx])
+    def prepare_results(self, idx):
+        """The input dict of the pipeline for the video `idx`."""
+        results = self.video_infos[idx]
         results['modality'] = self.modality
         results['test_mode'] = self.test_mode
-        return self.pipeline(results)
+        return results
+
+    def prepare_frames(self, idx):
+        return self.pipeline(self.prepare_results(idx))
+
+    def enable_telemetry(self, **kwargs):
+        """Start recording the load telemetry, see `LoadTelemetry` for the
+        arguments."""
+        if self.telemetry is None:
+            self.telemetry = LoadTelemetry(**kwargs)
+        return self.telemetry
 
     def __len__(self):
         return len(self.video_infos)
 
     def __getitem__(self, idx):
+        if self.telemetry is not None:
+            return self.telemetry.measure(self.prepare_frames, idx)
         return self.prepare_frames(idx)
@@ -1,4 +1,6 @@
 """build dataset from config dict"""
+from collections import OrderedDict
+
 from codes.utils import Registry, build_from_cfg
 
 DATASETS = Registry('dataset')
@@ -18,6 +20,10 @@ def build_dataset(cfg, default_args=None):
     if cfg['type'] == 'RepeatDataset':
         dataset = RepeatDataset(
             build_dataset(cfg['dataset'], default_args), cfg['times'])
+    elif cfg['type'] == 'EchoDataset':
+        dataset = EchoDataset(
+            build_dataset(cfg['dataset'], default_args), cfg['echo_factor'],
+            cfg.get('buffer_size', 64))
     else:
         dataset = build_from_cfg(cfg, DATASETS, default_args)
     return dataset
@@ -48,3 +54,80 @@ class RepeatDataset(object):
 
     def __len__(self):
         return self.times * self._ori_len
+
+
+@DATASETS.register_module
+class EchoDataset(object):
+    """A wrapper of a dataset reusing each decoded clip for several samples.
+
+    Data echoing: the pipeline of the dataset is split after its last decoder
+    (`Compose.decode_end`). A video is sampled and decoded once, then the
+    decoded results are kept in a buffer of the worker and go through the
+    remaining transforms (crops, flips, color jitter, ...) `echo_factor`
+    times, giving as many independently augmented views of the same frames.
+
+    The item `idx` is the view `idx % echo_factor` of the video
+    `idx // echo_factor`. `build_dataloader` uses an `EchoBatchSampler` for
+    this dataset, which puts the views of a video into different batches
+    loaded by the same worker, so that a decoded clip is reused while it is
+    still in the buffer of that worker. An epoch is `echo_factor` times
+    longer, the schedule of the config should be scaled accordingly.
+
+    Args:
+        dataset (:obj:`Dataset`): The dataset to be echoed, with a `Compose`
+            pipeline containing a decoder.
+        echo_factor (int): Number of views of each decoded clip.
+        buffer_size (int): Max number of decoded clips kept by a worker.
+            Default: 64.
+    """
+
+    def __init__(self, dataset, echo_factor, buffer_size=64):
+        assert echo_factor >= 1
+        self.dataset = dataset
+        self.echo_factor = echo_factor
+        self.buffer_size = buffer_size
+        self.decode_end = dataset.pipeline.decode_end
+        assert self.decode_end > 0, 'The pipeline has no decoder to echo'
+
+        self._ori_len = len(self.dataset)
+        # video index -> [decoded results, number of views left]
+        self._buffer = OrderedDict()
+
+    @property
+    def pipeline(self):
+        return self.dataset.pipeline
+
+    def _decode(self, idx):
+        results = self.dataset.prepare_results(idx)
+        return self.pipeline(results, stop=self.decode_end)
+
+    def __getitem__(self, idx):
+        telemetry = getattr(self.dataset, 'telemetry', None)
+        if telemetry is not None:
+            # recorded under the index of the video
+            return telemetry.measure(self._get_view, idx,
+                                     key=idx // self.echo_factor)
+        return self._get_view(idx)
+
+    def _get_view(self, idx):
+        ori_idx = idx // self.echo_factor
+        entry = self._buffer.get(ori_idx)
+        if entry is None:
+            decoded = self._decode(ori_idx)
+            if decoded is None:
+                # let the dataset retry its own way, e.g. with another video
+                return self.dataset.prepare_frames(ori_idx)
+            entry = [decoded, self.echo_factor]
+            if self.echo_factor > 1:
+                self._buffer[ori_idx] = entry
+                while len(self._buffer) > self.buffer_size:
+                    self._buffer.popitem(last=False)
+        entry[1] -= 1
+        if entry[1] <= 0:
+            self._buffer.pop(ori_idx, None)
+        # the transforms do not modify their input arrays, a shallow copy
+        # of the decoded results is enough
+        return self.pipeline(dict(entry[0]), start=self.decode_end)
+
+    def __len__(self):
+        return self.echo_factor * self._ori_len
@@ -0,0 +1,147 @@
+"""evaluation cache of preprocessed clips"""
+import hashlib
+import json
+import os
+import os.path as osp
+import pickle
+
+import numpy as np
+
+from codes.datasets.pipelines import FormatShape, Normalize
+
+
+class CachedDataset(object):
+    """A wrapper of a test dataset caching its preprocessed clips on disk.
+
+    The test pipeline is split before its `Normalize` (or `FormatShape`
+    without it, e.g. when the model normalizes the clips): the output of the
+    first part, i.e. the decoded, resized and cropped uint8 clip, is written
+    to a file the first time a video is evaluated and read back from the
+    memory-mapped file by the later evaluations, which only run the
+    remaining transforms. The first part of the pipeline must be
+    deterministic (no random sampling or cropping).
+
+    The cache lives in `cache_dir/<key>`, where the key hashes the dataset
+    config (or the pipeline), the content of the annotation file and the
+    partition of the videos. Each rank evaluates the videos
+    `rank::world_size` and writes its own part, so the cache only needs to
+    be on the local disk of the node. A part is published (its index
+    written) once all its videos are cached; an interrupted first pass is
+    started over.
+
+    Args:
+        dataset (:obj:`Dataset`): The test dataset.
+        cache_dir (str): Directory of the cache, on a local disk.
+        cfg (dict): Config of the dataset, hashed into the key. Default:
+            the repr of the pipeline.
+        rank (int): Rank of the current process.
+        world_size (int): Number of processes.
+    """
+
+    def __init__(self, dataset, cache_dir, cfg=None, rank=0, world_size=1):
+        self.dataset = dataset
+        self.rank = rank
+        self.world_size = world_size
+        steps = dataset.pipeline.steps
+        self.split = next(
+            (i for i, t in enumerate(steps) if isinstance(t, Normalize)),
+            None)
+        if self.split is None:
+            self.split = next((i for i, t in enumerate(steps)
+                               if isinstance(t, FormatShape)), None)
+        if self.split is None:
+            raise ValueError(
+                'The clips of {} can not be cached: its pipeline has neither '
+                'Normalize nor FormatShape to split the cached decoding and '
+                'the transforms run at each evaluation'.format(
+                    dataset.ann_file))
+
+        key_src = hashlib.sha1()
+        key_src.update(json.dumps(cfg, sort_keys=True, default=str).encode()
+                       if cfg is not None else
+                       repr(dataset.pipeline).encode())
+        with open(dataset.ann_file, 'rb') as f:
+            key_src.update(f.read())
+        self.cache_path = osp.join(cache_dir, key_src.hexdigest()[:16])
+        os.makedirs(self.cache_path, exist_ok=True)
+        part = osp.join(self.cache_path,
+                        'rank{}of{}'.format(rank, world_size))
+        self.data_file = part + '.bin'
+        self.index_file = part + '.idx'
+        self.num_own = len(range(rank, len(dataset), world_size))
+
+        self._data = None
+        self._writer = None
+        self._offset = 0
+        if osp.exists(self.index_file):
+            with open(self.index_file, 'rb') as f:
+                self._index = pickle.load(f)
+            self._data = np.memmap(self.data_file, dtype=np.uint8, mode='r')
+        else:
+            self._index = dict()
+
+    @property
+    def complete(self):
+        """Whether all the videos of this rank are cached."""
+        return self._data is not None
+
+    @property
+    def video_infos(self):
+        return self.dataset.video_infos
+
+    @property
+    def pipeline(self):
+        return self.dataset.pipeline
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def _write(self, idx, img_group, meta):
+        """Cache a clip, None for a video the pipeline failed to load."""
+        if self._writer is None:
+            # restart an interrupted first pass
+            self._writer = open(self.data_file, 'wb')
+        if img_group is None:
+            self._index[idx] = None
+        else:
+            self._writer.write(img_group.tobytes())
+            self._index[idx] = (self._offset, img_group.shape,
+                                img_group.dtype.str, meta)
+            self._offset += img_group.nbytes
+        if len(self._index) == self.num_own:
+            self._writer.close()
+            self._writer = None
+            tmp_file = self.index_file + '.tmp'
+            with open(tmp_file, 'wb') as f:
+                pickle.dump(self._index, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, self.index_file)
+            self._data = np.memmap(self.data_file, dtype=np.uint8, mode='r')
+
+    def _read(self, idx):
+        offset, shape, dtype, meta = self._index[idx]
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        results = dict(meta)
+        results['img_group'] = self._data[offset:offset + nbytes].view(
+            dtype).reshape(shape)
+        return results
+
+    def __getitem__(self, idx):
+        if self.complete and idx in self._index:
+            if self._index[idx] is None:
+                return self.dataset[idx]
+            return self.pipeline(self._read(idx), start=self.split)
+        to_cache = not self.complete and \
+            idx % self.world_size == self.rank and idx not in self._index
+        results = self.pipeline(self.dataset.prepare_results(idx),
+                                stop=self.split)
+        if results is None:
+            if to_cache:
+                self._write(idx, None, None)
+            return self.dataset[idx]
+        img_group = np.ascontiguousarray(np.asarray(results['img_group']))
+        if to_cache:
+            meta = {k: v for k, v in results.items() if k != 'img_group'}
+            self._write(idx, img_group, meta)
+        results['img_group'] = img_group
+        return self.pipeline(results, start=self.split)
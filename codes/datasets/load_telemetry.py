@@ -0,0 +1,144 @@
+"""per-sample load telemetry"""
+import ctypes
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+
+def _read_bytes():
+    """Bytes read by this process (`rchar` of /proc/self/io), None if
+    unknown."""
+    try:
+        with open('/proc/self/io', 'rb') as f:
+            for line in f:
+                if line.startswith(b'rchar:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+class LoadTelemetry(object):
+    """Load time, retries and bytes read of every sample, recorded by the
+    dataloader workers.
+
+    Every process loading samples claims a slot and writes its records to
+    the ring buffer of the slot (the last `capacity` samples) and to the
+    table of its `top_k` slowest samples. The buffers live in shared memory
+    created in the main process, so the workers forked afterwards write to
+    them and the main process aggregates them (see `LoadTelemetryHook`).
+    A slot has a single writer, no lock is taken per sample. The records of
+    the processes beyond `num_slots` are dropped.
+
+    The bytes read are the bytes read by the process (/proc/self/io) while
+    the sample was loaded, the reads of memory-mapped files are not counted.
+
+    Attributes:
+        capacity (int): Records kept per slot. Default: 4096.
+        top_k (int): Slowest samples kept per slot. Default: 20.
+        num_slots (int): Max number of loading processes. Default: 64.
+    """
+
+    FIELDS = ('idx', 'seconds', 'retries', 'bytes')
+
+    def __init__(self, capacity=4096, top_k=20, num_slots=64):
+        self.capacity = capacity
+        self.top_k = top_k
+        self.num_slots = num_slots
+        num_fields = len(self.FIELDS)
+        self._records = multiprocessing.RawArray(
+            ctypes.c_double, num_slots * capacity * num_fields)
+        self._top = multiprocessing.RawArray(
+            ctypes.c_double, num_slots * top_k * num_fields)
+        self._counts = multiprocessing.RawArray(ctypes.c_int64, num_slots)
+        self._next_slot = multiprocessing.Value(ctypes.c_int, 0)
+        # incremented by reset(), the slots are claimed again afterwards
+        self._generation = multiprocessing.RawValue(ctypes.c_int, 0)
+        self._slot = None
+        self._claimed = None
+        self._retries = 0
+        self.reset()
+
+    def _views(self):
+        num_fields = len(self.FIELDS)
+        records = np.frombuffer(self._records).reshape(
+            self.num_slots, self.capacity, num_fields)
+        top = np.frombuffer(self._top).reshape(
+            self.num_slots, self.top_k, num_fields)
+        counts = np.frombuffer(self._counts, dtype=np.int64)
+        return records, top, counts
+
+    def reset(self):
+        """Drop the records, before the workers of an epoch are started."""
+        records, top, counts = self._views()
+        records[:] = 0
+        top[:] = 0
+        top[:, :, 1] = -1
+        counts[:] = 0
+        with self._next_slot.get_lock():
+            self._next_slot.value = 0
+            self._generation.value += 1
+
+    def _claim(self):
+        claimed = (os.getpid(), self._generation.value)
+        if self._claimed != claimed:
+            self._claimed = claimed
+            with self._next_slot.get_lock():
+                slot = self._next_slot.value
+                self._next_slot.value += 1
+            self._slot = slot if slot < self.num_slots else None
+        return self._slot
+
+    def retry(self):
+        """Count a retry of the sample being loaded."""
+        self._retries += 1
+
+    def measure(self, load_fn, idx, key=None):
+        """Return `load_fn(idx)`, recording its load time, retries and
+        bytes read (also if it fails) under the video index `key` (default:
+        `idx`)."""
+        slot = self._claim()
+        if slot is None:
+            return load_fn(idx)
+        self._retries = 0
+        read_start = _read_bytes()
+        start = time.perf_counter()
+        try:
+            return load_fn(idx)
+        finally:
+            seconds = time.perf_counter() - start
+            read_end = _read_bytes()
+            num_bytes = read_end - read_start \
+                if read_start is not None and read_end is not None else 0
+            self._add(slot, (idx if key is None else key, seconds,
+                             self._retries, num_bytes))
+
+    def _add(self, slot, record):
+        records, top, counts = self._views()
+        records[slot, counts[slot] % self.capacity] = record
+        counts[slot] += 1
+        if self.top_k > 0:
+            fastest = top[slot, :, 1].argmin()
+            if record[1] > top[slot, fastest, 1]:
+                top[slot, fastest] = record
+
+    def collect(self):
+        """Aggregate the slots.
+
+        Returns:
+            tuple: The number of samples loaded, the records of the ring
+                buffers (num_records, 4) and the `top_k` slowest samples,
+                slowest first.
+        """
+        records, top, counts = self._views()
+        counts = counts.copy()
+        kept = [records[slot, :min(count, self.capacity)]
+                for slot, count in enumerate(counts)]
+        kept = np.concatenate(kept) if kept else np.zeros(
+            (0, len(self.FIELDS)))
+        slowest = top.reshape(-1, len(self.FIELDS))
+        slowest = slowest[slowest[:, 1] >= 0]
+        slowest = slowest[np.argsort(-slowest[:, 1], kind='stable')]
+        return int(counts.sum()), kept, slowest[:self.top_k]
@@ -8,7 +8,8 @@ import resource
 from paddle.io import DataLoader
 from paddle.distributed import get_rank,get_world_size
 
-from codes.datasets.loader.sampler import DistributedSampler
+from codes.datasets.builder import EchoDataset
+from codes.datasets.loader.sampler import DistributedSampler, EchoBatchSampler
 
 # from functools import partial
 
@@ -24,7 +25,13 @@ def build_dataloader(dataset,
                      shuffle=True,
                      pin_memory=True,
                      **kwargs):
-    """build dataloader"""
+    """build dataloader
+
+    An `EchoDataset` is always sampled by an `EchoBatchSampler`, with
+    `shuffle` and the rank of the process.
+    """
+    # the DataLoader does not shuffle when a sampler is given
+    shuffle_videos = shuffle
     if dist:
         rank = get_rank()
         world_size = get_world_size()
@@ -42,6 +49,16 @@ def build_dataloader(dataset,
         batch_size = num_gpus * videos_per_gpu
         num_workers = num_gpus * workers_per_gpu
 
+    if isinstance(dataset, EchoDataset):
+        # a worker holds the clips of its batch until their views are done
+        dataset.buffer_size = max(dataset.buffer_size, batch_size)
+        sampler = EchoBatchSampler(
+            dataset, batch_size, num_workers,
+            num_replicas=get_world_size() if dist else 1,
+            rank=get_rank() if dist else 0, shuffle=shuffle_videos)
+        batch_size = 1
+        shuffle = False
+
     data_loader = DataLoader(
         dataset,
         batch_size=batch_size,
@@ -163,3 +163,74 @@ class DistributedGroupSampler(Sampler):
     def set_epoch(self, epoch):
         """set epoch"""
         self.epoch = epoch
+
+
+class EchoBatchSampler(Sampler):
+    """Batch sampler of an `EchoDataset`.
+
+    The dataloader hands out the batches to its workers round-robin, the
+    batch `i` is loaded by the worker `i % num_workers`. The videos are
+    shuffled and split into rounds of one batch of videos per worker. Within
+    a round, the view `j` of the videos of the worker `w` is the batch
+    `j * num_workers + w`: the `echo_factor` views of a video are in
+    different batches, all loaded by the worker which decoded the video, one
+    after the other. A worker thus buffers at most `batch_size` decoded
+    clips at once.
+
+    The permutation depends on `seed` and on the epoch, so that all the
+    replicas agree on it. The epoch is advanced at every iteration over the
+    sampler.
+
+    Args:
+        dataset (:obj:`EchoDataset`): The echoed dataset.
+        batch_size (int): Number of samples per batch.
+        num_workers (int): Number of workers of the dataloader.
+        num_replicas (int): Number of processes of distributed training.
+        rank (int): Rank of the current process.
+        shuffle (bool): Whether to shuffle the videos.
+        seed (int): Random seed of the permutation.
+    """
+
+    def __init__(self, dataset, batch_size, num_workers=0,
+                 num_replicas=1, rank=0, shuffle=True, seed=0):
+        self.dataset = dataset
+        self.echo_factor = dataset.echo_factor
+        self.batch_size = batch_size
+        # the main process loads every batch without workers
+        self.num_workers = max(num_workers, 1)
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+
+        self.num_videos = len(dataset.dataset)
+        round_size = batch_size * self.num_workers
+        self.num_rounds = int(math.ceil(
+            self.num_videos / (round_size * num_replicas)))
+        self.total_size = self.num_rounds * round_size * num_replicas
+
+    def __iter__(self):
+        if self.shuffle:
+            rng = np.random.RandomState(self.seed + self.epoch)
+            indices = rng.permutation(self.num_videos)
+        else:
+            indices = np.arange(self.num_videos)
+        self.epoch += 1
+
+        # add extra videos to make it evenly divisible
+        indices = np.resize(indices, self.total_size)
+        indices = indices[self.rank:self.total_size:self.num_replicas]
+        indices = indices.reshape(
+            self.num_rounds, self.num_workers, self.batch_size)
+        for videos in indices:
+            for view in range(self.echo_factor):
+                for batch in videos:
+                    yield (batch * self.echo_factor + view).tolist()
+
+    def __len__(self):
+        return self.num_rounds * self.num_workers * self.echo_factor
+
+    def set_epoch(self, epoch):
+        """set epoch"""
+        self.epoch = epoch
@@ -1,14 +1,16 @@
 """data pipeline"""
-from .augmentations import (CenterCrop, Flip, MultiScaleCrop, Normalize,
-                            Resize, TenCrop, ThreeCrop)
-from .compose import Compose
+from .augmentations import (CenterCrop, CropResizeFlipNormalize, Flip,
+                            MultiScaleCrop, Normalize, Resize, TenCrop,
+                            ThreeCrop)
+from .compose import Compose, PipelineStats
 from .formating import Collect, FormatShape, ImageToTensor, ToTensor, Transpose
 from .loading import (DecordDecode, FrameSelector, OpenCVDecode, PyAVDecode,
-                      SampleFrames, PklLoader)
+                      SampleFrames, PklLoader, ShardFrameSelector)
 
 __all__ = [
     'SampleFrames', 'PyAVDecode', 'DecordDecode', 'OpenCVDecode', 'PklLoader',
-    'FrameSelector', 'MultiScaleCrop', 'Resize', 'Flip', 'Normalize',
-    'ThreeCrop', 'CenterCrop', 'TenCrop', 'ImageToTensor', 'Transpose',
-    'Collect', 'FormatShape', 'Compose', 'ToTensor'
+    'FrameSelector', 'ShardFrameSelector', 'MultiScaleCrop', 'Resize', 'Flip',
+    'Normalize', 'ThreeCrop', 'CenterCrop', 'TenCrop', 'ImageToTensor', 'Transpose',
+    'Collect', 'FormatShape', 'Compose', 'ToTensor', 'CropResizeFlipNormalize',
+    'PipelineStats'
 ]
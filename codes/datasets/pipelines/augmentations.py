@@ -3,11 +3,128 @@ import math
 import random
 
 import cv2
-# import mmcv
+import mmcv
 import numpy as np
 
 from codes.datasets.builder import PIPELINES
 
+# The transforms take "img_group" as a list of frames or a stacked
+# (T, H, W[, C]) array. Crops and flips return views, resizes write into one
+# preallocated stacked array, and the input frames are never modified.
+
+
+def _crop(img_group, x1, y1, x2, y2):
+    """Crop [x1, x2) x [y1, y2) of every frame as views."""
+    if isinstance(img_group, np.ndarray):
+        return img_group[:, y1:y2, x1:x2]
+    return [img[y1:y2, x1:x2] for img in img_group]
+
+
+def _flip(img_group, direction='horizontal'):
+    """Flip every frame as views."""
+    if isinstance(img_group, np.ndarray):
+        if direction == 'horizontal':
+            return img_group[:, :, ::-1]
+        return img_group[:, ::-1]
+    return [mmcv.imflip(img, direction) for img in img_group]
+
+
+def _invert_flow_x(img_group):
+    """Invert the x flows (even frames)."""
+    if isinstance(img_group, np.ndarray):
+        img_group = img_group.copy()
+        img_group[0::2] = 255 - img_group[0::2]
+        return img_group
+    img_group = list(img_group)
+    for i in range(0, len(img_group), 2):
+        img_group[i] = mmcv.iminvert(img_group[i])
+    return img_group
+
+
+def _resize(img_group, size, interpolation='bilinear'):
+    """Resize every frame to `size` (w, h) into a stacked array."""
+    first = img_group[0]
+    out = np.empty((len(img_group), size[1], size[0]) + first.shape[2:],
+                   dtype=first.dtype)
+    for i, img in enumerate(img_group):
+        mmcv.imresize(img, size, interpolation=interpolation, out=out[i])
+    return out
+
+
+def _concat(groups):
+    """Concatenate the frames of several groups."""
+    if isinstance(groups[0], np.ndarray):
+        return np.concatenate(groups, axis=0)
+    return [img for group in groups for img in group]
+
+
+# Geometric transforms with an `affine(results, img_shape)` method can be
+# merged by `Compose`: the method samples the parameters and updates the
+# metadata of `results` like `__call__`, but returns the 3x3 matrix mapping
+# input to output pixel coordinates and the output shape instead of touching
+# the frames.
+
+
+def _crop_matrix(x1, y1):
+    return np.array([[1, 0, -x1], [0, 1, -y1], [0, 0, 1]], dtype=np.float64)
+
+
+def _resize_matrix(size, new_size):
+    """Same pixel center convention as cv2.resize, sizes are (w, h)."""
+    scale_x = new_size[0] / size[0]
+    scale_y = new_size[1] / size[1]
+    return np.array([[scale_x, 0, 0.5 * scale_x - 0.5],
+                     [0, scale_y, 0.5 * scale_y - 0.5],
+                     [0, 0, 1]], dtype=np.float64)
+
+
+def _flip_matrix(img_shape, direction='horizontal'):
+    img_h, img_w = img_shape[:2]
+    if direction == 'horizontal':
+        return np.array([[-1, 0, img_w - 1], [0, 1, 0], [0, 0, 1]],
+                        dtype=np.float64)
+    return np.array([[1, 0, 0], [0, -1, img_h - 1], [0, 0, 1]],
+                    dtype=np.float64)
+
+
+def warp_clip(img_group, matrix, out_shape, interpolation='bilinear'):
+    """Apply the axis-aligned affine `matrix` to every frame at once.
+
+    The input region of the output is cropped (a view, widened to whole
+    pixels), resized once to the composed scale and the output is sliced
+    out of it (flipped with views if needed). When the region falls on whole
+    pixels, e.g. a crop followed by a resize, this does exactly what the
+    transforms do one by one, otherwise up to a subpixel shift.
+    """
+    img_h, img_w = img_group[0].shape[:2]
+    out_h, out_w = out_shape[:2]
+
+    def _span(scale, offset, out_size, in_size):
+        # input pixel edges of the output edges 0 and out_size
+        lo, hi = sorted(((edge - offset - 0.5 + 0.5 * scale) / scale
+                         for edge in (0, out_size)))
+        start = max(0, int(math.floor(lo + 1e-6)))
+        end = min(in_size, int(math.ceil(hi - 1e-6)))
+        resized = max(out_size, int(round((end - start) * abs(scale))))
+        shift = min(resized - out_size,
+                    max(0, int(round((lo - start) * abs(scale)))))
+        return start, end, resized, shift
+
+    x1, x2, resized_w, shift_x = _span(matrix[0, 0], matrix[0, 2], out_w,
+                                       img_w)
+    y1, y2, resized_h, shift_y = _span(matrix[1, 1], matrix[1, 2], out_h,
+                                       img_h)
+    img_group = _crop(img_group, x1, y1, x2, y2)
+    if (resized_w, resized_h) != (x2 - x1, y2 - y1):
+        img_group = _resize(img_group, (resized_w, resized_h), interpolation)
+    img_group = _crop(img_group, shift_x, shift_y, shift_x + out_w,
+                      shift_y + out_h)
+    if matrix[0, 0] < 0:
+        img_group = _flip(img_group, 'horizontal')
+    if matrix[1, 1] < 0:
+        img_group = _flip(img_group, 'vertical')
+    return img_group
+
 
 @PIPELINES.register_module
 class Resize(object):
@@ -34,30 +151,51 @@ class Resize(object):
         self.keep_ratio = keep_ratio
         self.interpolation = interpolation
 
-    def __call__(self, results):
-        img_group = results['img_group']
+    def min_short_side(self):
+        """Smallest input short side that loses no detail of the output.
+
+        Loaders use it to decode at a reduced resolution. None means the
+        full resolution is needed.
+        """
+        if isinstance(self.scale, (float, int)):
+            # relative scale factor, the output follows the input size
+            return None
         if self.keep_ratio:
-            tuple_list = [
-                mmcv.imrescale(img, self.scale, return_scale=True)
-                for img in img_group
-            ]
-            img_group, scale_factors = list(zip(*tuple_list))
-            self.scale_factor = scale_factors[0]
+            return min(self.scale)
+        return max(self.scale)
+
+    def _new_size(self, img_h, img_w):
+        if self.keep_ratio:
+            new_size, self.scale_factor = mmcv.rescale_size(
+                (img_w, img_h), self.scale, return_scale=True)
         else:
-            tuple_list = [
-                mmcv.imresize(img, self.scale, return_scale=True)
-                for img in img_group
-            ]
-            img_group, w_scales, h_scales = list(zip(*tuple_list))
+            new_size = self.scale
+            w_scale = new_size[0] / img_w
+            h_scale = new_size[1] / img_h
             self.scale_factor = np.array(
-                [w_scales[0], h_scales[0], w_scales[0], h_scales[0]],
-                dtype=np.float32)
+                [w_scale, h_scale, w_scale, h_scale], dtype=np.float32)
+        return new_size
 
-        results['img_group'] = img_group
-        results['img_shape'] = img_group[0].shape
+    def _update_meta(self, results, img_shape):
+        results['img_shape'] = img_shape
         results['keep_ratio'] = self.keep_ratio
         results['scale_fatcor'] = self.scale_factor
 
+    def affine(self, results, img_shape):
+        """See `warp_clip`."""
+        new_size = self._new_size(*img_shape[:2])
+        out_shape = (new_size[1], new_size[0]) + tuple(img_shape[2:])
+        self._update_meta(results, out_shape)
+        return _resize_matrix(img_shape[1::-1], new_size), out_shape
+
+    def __call__(self, results):
+        img_group = results['img_group']
+        new_size = self._new_size(*img_group[0].shape[:2])
+        img_group = _resize(img_group, new_size, self.interpolation)
+
+        results['img_group'] = img_group
+        self._update_meta(results, img_group[0].shape)
+
         return results
 
     def __repr__(self):
@@ -103,6 +241,25 @@ class MultiScaleCrop(object):
         self.more_fix_crop = more_fix_crop
         self.interpolation = 'bilinear'
 
+    def min_short_side(self):
+        """Smallest input short side that loses no detail of the output."""
+        return int(math.ceil(max(self.input_size) / min(self.scales)))
+
+    def affine(self, results, img_shape):
+        """See `warp_clip`."""
+        img_h, img_w = img_shape[:2]
+        (crop_w, crop_h), (offset_w, offset_h) = self._sample_crop_size(
+            (img_w, img_h))
+        results['crop_bbox'] = np.array([offset_w, offset_h, offset_w +
+                                         crop_w - 1, offset_h + crop_h - 1])
+        out_shape = (self.input_size[1], self.input_size[0]) + tuple(
+            img_shape[2:])
+        results['img_shape'] = out_shape
+        results['scales'] = self.scales
+        matrix = _resize_matrix((crop_w, crop_h), self.input_size).dot(
+            _crop_matrix(offset_w, offset_h))
+        return matrix, out_shape
+
     def __call__(self, results):
         img_group = results['img_group']
         img_h, img_w = img_group[0].shape[:2]
@@ -111,11 +268,11 @@ class MultiScaleCrop(object):
             (img_w, img_h))
         box = np.array([offset_w, offset_h, offset_w +
                         crop_w - 1, offset_h + crop_h - 1])
-        crop_img_group = [mmcv.imcrop(img, box) for img in img_group]
-        ret_img_group = [mmcv.imresize(
-            img, (self.input_size[0], self.input_size[1]),
+        crop_img_group = _crop(img_group, offset_w, offset_h,
+                               offset_w + crop_w, offset_h + crop_h)
+        ret_img_group = _resize(
+            crop_img_group, (self.input_size[0], self.input_size[1]),
             interpolation=self.interpolation)
-            for img in crop_img_group]
 
         results['crop_bbox'] = box
 
@@ -201,25 +358,43 @@ class Flip(object):
     Required keys are "img_group", added or modified keys are "img_group"
     and "flip_direction".
 
+    The x flows of a flipped Flow clip are inverted. The x flows of the
+    clips which are not flipped are inverted too unless
+    `invert_unflipped_flow` is False; the flows the models were trained on
+    so far are inverted on every clip.
+
     Attributes:
          direction (str): Flip imgs horizontally or vertically. Options are
             "horiziontal" | "vertival". Default: "horizontal".
+         invert_unflipped_flow (bool): Also invert the x flows of the clips
+            which are not flipped. Default: True.
     """
 
-    def __init__(self, flip_ratio=0.5, direction='horizontal'):
+    def __init__(self, flip_ratio=0.5, direction='horizontal',
+                 invert_unflipped_flow=True):
         assert direction in ['horizontal', 'vertical']
         self.flip_ratio = flip_ratio
         self.direction = direction
+        self.invert_unflipped_flow = invert_unflipped_flow
+
+    def affine(self, results, img_shape):
+        """See `warp_clip`, flows can not be inverted by a warp."""
+        assert results['modality'] != 'Flow'
+        flip = True if np.random.rand() < self.flip_ratio else False
+        results['flip'] = flip
+        results['flip_direction'] = self.direction
+        if flip:
+            return _flip_matrix(img_shape, self.direction), img_shape
+        return np.eye(3), img_shape
 
     def __call__(self, results):
         img_group = results['img_group']
         flip = True if np.random.rand() < self.flip_ratio else False
         if flip:
-            img_group = [mmcv.imflip(img, self.direction)
-                         for img in img_group]
-        if results['modality'] == 'Flow':
-            for i in range(0, len(img_group), 2):
-                img_group[i] = mmcv.iminvert(img_group[i])
+            img_group = _flip(img_group, self.direction)
+        if results['modality'] == 'Flow' and (
+                flip or self.invert_unflipped_flow):
+            img_group = _invert_flow_x(img_group)
 
         results['flip'] = flip
         results['flip_direction'] = self.direction
@@ -229,8 +404,10 @@ class Flip(object):
 
     def __repr__(self):
         repr_str = self.__class__.__name__
-        repr_str += '(flip_ratio={}, direction={})'.format(
-            self.flip_ratio, self.direction)
+        repr_str += ('(flip_ratio={}, direction={}, '
+                     'invert_unflipped_flow={})'.format(
+                         self.flip_ratio, self.direction,
+                         self.invert_unflipped_flow))
         return repr_str
 
 
@@ -327,8 +504,8 @@ class ColorJitter(object):
         alpha = np.random.normal(0, self.alphastd, size=(3,))
         rgb = np.array(np.dot(self.eigvec * alpha, self.eigval)
                        ).astype(np.float32)
-        bgr = np.expand_dims(np.expand_dims(rgb[::-1], 0), 0)
-        img_group = [img + bgr for img in img_group]
+        # lighting noise of the whole clip at once
+        img_group = np.asarray(img_group) + rgb[::-1]
         results['img_group'] = img_group
         return results
 
@@ -345,6 +522,8 @@ class Normalize(object):
 
     Required keys are "img_group", added or modified keys are
     "img_group" and "img_norm_cfg".
+    To deliver uint8 clips and normalize on the device instead, leave it out
+    and pass the same arguments as `img_norm_cfg` of the recognizer.
 
     Attributes:
         mean (np.ndarray): Mean values of different channels.
@@ -377,13 +556,23 @@ class Normalize(object):
 
     def __call__(self, results):
         img_group = results['img_group']
+        mean = np.float64(self.mean.reshape(1, -1))
+        stdinv = 1 / np.float64(self.std.reshape(1, -1))
         if self.div_255:
-            img_group = [np.float32(img) / 255 for img in img_group]
-
-        img_group = [self.imnormalize(
-            img, self.mean, self.std, self.to_rgb) for img in img_group]
+            # (img / 255 - mean) / std
+            mean, stdinv = mean * 255, stdinv / 255
 
-        results['img_group'] = img_group
+        # normalize into one stacked float32 array, as FormatShape expects
+        out = np.empty((len(img_group), ) + img_group[0].shape,
+                       dtype=np.float32)
+        for i, img in enumerate(img_group):
+            if self.to_rgb:
+                img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            cv2.subtract(img, mean, out[i], dtype=cv2.CV_32F)
+        flat = out.reshape((-1, ) + out.shape[2:])
+        cv2.multiply(flat, stdinv, flat)
+
+        results['img_group'] = out
         results['img_norm_cfg'] = dict(
             mean=self.mean, std=self.std,
             div_255=self.div_255, to_rgb=self.to_rgb)
@@ -442,6 +631,22 @@ class CenterCrop(object):
             self.crop_size = crop_size
         assert mmcv.is_tuple_of(self.crop_size, int)
 
+    def min_short_side(self):
+        """Cropping at a fixed size needs the full resolution."""
+        return None
+
+    def affine(self, results, img_shape):
+        """See `warp_clip`."""
+        img_h, img_w = img_shape[:2]
+        crop_w, crop_h = self.crop_size
+        x1 = (img_w - crop_w) // 2
+        y1 = (img_h - crop_h) // 2
+        results['crop_bbox'] = np.array(
+            [x1, y1, x1 + crop_w - 1, y1 + crop_h - 1])
+        out_shape = (crop_h, crop_w) + tuple(img_shape[2:])
+        results['img_shape'] = out_shape
+        return _crop_matrix(x1, y1), out_shape
+
     def __call__(self, results):
         img_group = results['img_group']
 
@@ -450,7 +655,8 @@ class CenterCrop(object):
         x1 = (img_w - crop_w) // 2
         y1 = (img_h - crop_h) // 2
         box = np.array([x1, y1, x1 + crop_w - 1, y1 + crop_h - 1])
-        results['img_group'] = [mmcv.imcrop(img, box) for img in img_group]
+        results['img_group'] = _crop(img_group, x1, y1, x1 + crop_w,
+                                     y1 + crop_h)
         results['crop_bbox'] = box
         results['img_shape'] = results['img_group'][0].shape
 
@@ -482,6 +688,10 @@ class ThreeCrop(object):
             self.crop_size = crop_size
         assert mmcv.is_tuple_of(self.crop_size, int)
 
+    def min_short_side(self):
+        """Cropping at a fixed size needs the full resolution."""
+        return None
+
     def __call__(self, results):
         img_group = results['img_group']
         img_h, img_w = img_group[0].shape[:2]
@@ -509,24 +719,11 @@ class ThreeCrop(object):
             offsets = list()
             offsets.append((0 * w_step, 2 * h_step))  # left
             offsets.append((4 * w_step, 2 * h_step))  # right
-            offsets.append((2 * w_step, 2 * h_step))  # center            
+            offsets.append((2 * w_step, 2 * h_step))  # center
 
-        oversample_group = list()
-        for o_w, o_h in offsets:
-            normal_group = list()
-            flip_group = list()
-            for i, img in enumerate(img_group):
-                crop = mmcv.imcrop(img, np.array(
-                    [o_w, o_h, o_w + crop_w - 1, o_h + crop_h - 1]))
-                normal_group.append(crop)
-                flip_crop = mmcv.imflip(crop)
-
-                if results['modality'] == 'Flow' and i % 2 == 0:
-                    flip_group.append(mmcv.iminvert(flip_crop))
-                else:
-                    flip_group.append(flip_crop)
-
-            oversample_group.extend(normal_group)
+        oversample_group = _concat([
+            _crop(img_group, o_w, o_h, o_w + crop_w, o_h + crop_h)
+            for o_w, o_h in offsets])
 
         results['img_group'] = oversample_group
         results['crop_bbox'] = None
@@ -560,6 +757,10 @@ class TenCrop(object):
             self.crop_size = crop_size
         assert mmcv.is_tuple_of(self.crop_size, int)
 
+    def min_short_side(self):
+        """Cropping at a fixed size needs the full resolution."""
+        return None
+
     def __call__(self, results):
         img_group = results['img_group']
         img_h, img_w = img_group[0].shape[:2]
@@ -567,24 +768,15 @@ class TenCrop(object):
 
         offsets = MultiScaleCrop.fill_fix_offset(
             False, img_w, img_h, crop_w, crop_h)
-        oversample_group = list()
+        groups = list()
         for o_w, o_h in offsets:
-            normal_group = list()
-            flip_group = list()
-            for i, img in enumerate(img_group):
-                crop = mmcv.imcrop(img, np.array(
-                    [o_w, o_h, o_w + crop_w - 1, o_h + crop_h - 1]))
-                normal_group.append(crop)
-                flip_crop = mmcv.imflip(crop)
-
-                if results['modality'] == 'Flow' and i % 2 == 0:
-                    flip_group.append(mmcv.iminvert(flip_crop))
-                else:
-                    flip_group.append(flip_crop)
-
-            oversample_group.extend(normal_group)
-            oversample_group.extend(flip_group)
-        results['img_group'] = oversample_group
+            normal_group = _crop(img_group, o_w, o_h,
+                                 o_w + crop_w, o_h + crop_h)
+            flip_group = _flip(normal_group)
+            if results['modality'] == 'Flow':
+                flip_group = _invert_flow_x(flip_group)
+            groups.extend([normal_group, flip_group])
+        results['img_group'] = _concat(groups)
         results['crop_bbox'] = None
         results['img_shape'] = results['img_group'][0].shape
 
@@ -609,6 +801,16 @@ class RandomResizedCrop(object):
         self.scale = scale
         self.ratio = ratio
 
+    def min_short_side(self):
+        """Smallest input short side that loses no detail of the output.
+
+        The short side of the smallest crop is at least
+        sqrt(min_scale / max_ratio) of the short side of the input.
+        """
+        max_ratio = max(self.ratio[1], 1. / self.ratio[0])
+        return int(math.ceil(max(self.input_size) /
+                             math.sqrt(self.scale[0] / max_ratio)))
+
     @staticmethod
     def get_params(img, scale, ratio):
         """Get parameters for ``crop`` for a random sized crop.
@@ -643,6 +845,24 @@ class RandomResizedCrop(object):
         j = (img.shape[0] - w) // 2
         return (i, j), (w, w)
 
+    def affine(self, results, img_shape):
+        """See `warp_clip`."""
+        img_h, img_w = img_shape[:2]
+        # get_params only looks at the shape
+        (x1, y1), (crop_h, crop_w) = self.get_params(
+            np.broadcast_to(0, (img_h, img_w)), self.scale, self.ratio)
+        results['crop_bbox'] = np.array(
+            [x1, y1, x1 + crop_w - 1, y1 + crop_h - 1], dtype=np.float32)
+        out_shape = (self.input_size[1], self.input_size[0]) + tuple(
+            img_shape[2:])
+        results['img_shape'] = out_shape
+        # the crop is clipped to the frame like slicing does
+        crop_size = (min(x1 + crop_w, img_w) - x1,
+                     min(y1 + crop_h, img_h) - y1)
+        matrix = _resize_matrix(crop_size, self.input_size).dot(
+            _crop_matrix(x1, y1))
+        return matrix, out_shape
+
     def __call__(self, results):
         """
         Args:
@@ -656,8 +876,9 @@ class RandomResizedCrop(object):
             img_group[0], self.scale, self.ratio)
         box = np.array([x1, y1, x1 + crop_w - 1, y1 + crop_h - 1], dtype=np.float32)
 
-        results['img_group'] = [mmcv.imresize(mmcv.imcrop(
-            img, box), self.input_size) for img in img_group]
+        results['img_group'] = _resize(
+            _crop(img_group, x1, y1, x1 + crop_w, y1 + crop_h),
+            self.input_size)
         results['crop_bbox'] = box
         results['img_shape'] = results['img_group'][0].shape
         return results
@@ -679,13 +900,17 @@ class RandomRescaledCrop(object):
         assert mmcv.is_tuple_of(self.input_size, int)
         self.scale = scale
 
+    def min_short_side(self):
+        """Smallest input short side that loses no detail of the output."""
+        return max(self.scale)
+
     def __call__(self, results):
         img_group = results['img_group']
         shortedge = float(random.randint(*self.scale))
 
         w, h, _ = img_group[0].shape
         scale = max(shortedge / w, shortedge / h)
-        img_group = [mmcv.imrescale(img, scale) for img in img_group]
+        img_group = _resize(img_group, mmcv.rescale_size((h, w), scale))
         w, h, _ = img_group[0].shape
         w_offset = random.randint(0, w - self.input_size[0])
         h_offset = random.randint(0, h - self.input_size[1])
@@ -694,9 +919,9 @@ class RandomRescaledCrop(object):
                         w_offset + self.input_size[0] - 1,
                         h_offset + self.input_size[1] - 1],
                        dtype=np.float32)
-        results['img_group'] = [
-            img[w_offset: w_offset + self.input_size[0],
-                h_offset: h_offset + self.input_size[1]] for img in img_group]
+        results['img_group'] = img_group[
+            :, w_offset: w_offset + self.input_size[0],
+            h_offset: h_offset + self.input_size[1]]
         results['crop_bbox'] = box
         results['img_shape'] = results['img_group'][0].shape
         return results
@@ -705,3 +930,137 @@ class RandomRescaledCrop(object):
         repr_str = self.__class__.__name__
         repr_str += '(input_size={})'.format(self.input_size)
         return repr_str
+
+
+@PIPELINES.register_module
+class CropResizeFlipNormalize(object):
+    """Fused crop -> resize -> flip -> normalize of a clip.
+
+    Equivalent to `RandomResizedCrop` (crop='random') or
+    `Resize(scale=(np.Inf, short_side))` + `CenterCrop` (crop='center'),
+    followed by `Flip` and `Normalize`, up to interpolation. The crop and the
+    flip are views, every frame is resized into one reused buffer and
+    normalized straight into a preallocated float32 array laid out as
+    (T, C, H, W), which `FormatShape` takes without another copy.
+    Only RGB frames are supported.
+
+    Required keys are "img_group", added or modified keys are "img_group",
+    "img_layout", "crop_bbox", "img_shape", "flip", "flip_direction" and
+    "img_norm_cfg".
+
+    Attributes:
+        input_size (int | tuple[int]): (w, h) of network input.
+        crop (str): "random" | "center". Default: "random".
+        scale (tuple[float]): Range of the area of random crops.
+        ratio (tuple[float]): Range of the aspect ratio of random crops.
+        short_side (int): Short side the frames are resized to before the
+            center crop. Default: 256.
+        flip_ratio (float): Probability of a horizontal flip. Default: 0.5.
+        mean (Sequence[float]): Mean values of different channels.
+        std (Sequence[float]): Std values of different channels.
+        div_255 (bool): Whether to divide the frames by 255 first.
+        to_rgb (bool): Whether to convert channels from BGR to RGB.
+        interpolation (str): Interpolation of the resize.
+            Default: "bilinear".
+    """
+
+    def __init__(self,
+                 input_size,
+                 crop='random',
+                 scale=(0.08, 1.0),
+                 ratio=(3. / 4., 4. / 3.),
+                 short_side=256,
+                 flip_ratio=0.5,
+                 mean=(0., 0., 0.),
+                 std=(1., 1., 1.),
+                 div_255=False,
+                 to_rgb=False,
+                 interpolation='bilinear'):
+        assert crop in ['random', 'center']
+        if isinstance(input_size, int):
+            self.input_size = (input_size, input_size)
+        else:
+            self.input_size = input_size
+        assert mmcv.is_tuple_of(self.input_size, int)
+        self.crop = crop
+        self.scale = scale
+        self.ratio = ratio
+        self.short_side = short_side
+        self.flip_ratio = flip_ratio
+        self.mean = np.array(mean, dtype=np.float32)
+        self.std = np.array(std, dtype=np.float32)
+        self.div_255 = div_255
+        self.to_rgb = to_rgb
+        self.interpolation = interpolation
+
+    def min_short_side(self):
+        """Smallest input short side that loses no detail of the output."""
+        if self.crop == 'center':
+            return self.short_side
+        max_ratio = max(self.ratio[1], 1. / self.ratio[0])
+        return int(math.ceil(max(self.input_size) /
+                             math.sqrt(self.scale[0] / max_ratio)))
+
+    def _crop_box(self, img):
+        img_h, img_w = img.shape[:2]
+        if self.crop == 'random':
+            (x1, y1), (crop_h, crop_w) = RandomResizedCrop.get_params(
+                img, self.scale, self.ratio)
+        else:
+            # the center crop of the frame resized to short_side
+            scale_factor = self.short_side / min(img_h, img_w)
+            crop_w = min(img_w, int(round(self.input_size[0] / scale_factor)))
+            crop_h = min(img_h, int(round(self.input_size[1] / scale_factor)))
+            x1 = (img_w - crop_w) // 2
+            y1 = (img_h - crop_h) // 2
+        return x1, y1, min(x1 + crop_w, img_w), min(y1 + crop_h, img_h)
+
+    def __call__(self, results):
+        assert results['modality'] != 'Flow', \
+            'CropResizeFlipNormalize only supports RGB frames'
+        img_group = results['img_group']
+        first = img_group[0]
+        x1, y1, x2, y2 = self._crop_box(first)
+        flip = True if np.random.rand() < self.flip_ratio else False
+
+        mean, std = self.mean, self.std
+        if self.div_255:
+            mean, std = mean * 255, std * 255
+        stdinv = np.float32(1) / std
+        num_channels = first.shape[2]
+        channels = list(range(num_channels))
+        if self.to_rgb:
+            channels = channels[::-1]
+
+        out_w, out_h = self.input_size
+        out = np.empty((len(img_group), num_channels, out_h, out_w),
+                       dtype=np.float32)
+        buf = np.empty((out_h, out_w, num_channels), dtype=first.dtype)
+        for i, img in enumerate(img_group):
+            resized = mmcv.imresize(img[y1:y2, x1:x2], (out_w, out_h),
+                                    interpolation=self.interpolation,
+                                    out=buf)
+            if flip:
+                resized = resized[:, ::-1]
+            for c, src_c in enumerate(channels):
+                np.subtract(resized[..., src_c], mean[c], out=out[i, c])
+                np.multiply(out[i, c], stdinv[c], out=out[i, c])
+
+        results['img_group'] = out
+        results['img_layout'] = 'TCHW'
+        results['crop_bbox'] = np.array([x1, y1, x2 - 1, y2 - 1])
+        results['img_shape'] = (out_h, out_w, num_channels)
+        results['flip'] = flip
+        results['flip_direction'] = 'horizontal'
+        results['img_norm_cfg'] = dict(
+            mean=self.mean, std=self.std,
+            div_255=self.div_255, to_rgb=self.to_rgb)
+        return results
+
+    def __repr__(self):
+        repr_str = self.__class__.__name__
+        repr_str += ('(input_size={}, crop={}, flip_ratio={}, mean={}, '
+                     'std={}, to_rgb={})').format(
+                         self.input_size, self.crop, self.flip_ratio,
+                         self.mean, self.std, self.to_rgb)
+        return repr_str
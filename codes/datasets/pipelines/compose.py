@@ -1,20 +1,222 @@
 """compose"""
+import ctypes
+import multiprocessing
+import time
 from collections.abc import Sequence
 
+import numpy as np
+
 from ...utils import build_from_cfg
 from ..builder import PIPELINES
+from .augmentations import _concat, warp_clip
+from .formating import FormatShape
+from .loading import DECODERS
+
+
+def _nbytes(value):
+    """Bytes held by the arrays, buffers and tensors in `value`."""
+    if isinstance(value, (np.ndarray, memoryview)):
+        return value.nbytes
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_nbytes(v) for v in value)
+    if hasattr(value, 'element_size'):
+        # paddle.Tensor.size is the number of elements, torch has numel()
+        numel = value.size if isinstance(value.size, int) else value.numel()
+        return int(numel) * value.element_size()
+    return 0
+
+
+class PipelineStats(object):
+    """Per-transform counters of a pipeline shared by the dataloader workers.
+
+    The counters live in a shared memory array created in the main process,
+    so workers forked afterwards add to the same counters. Every worker
+    accumulates the counters of a sample locally and adds them under the
+    lock once the sample is done.
+
+    Attributes:
+        names (list[str]): Names of the transforms.
+    """
+
+    FIELDS = ('calls', 'seconds', 'bytes', 'failures')
+
+    def __init__(self, names):
+        self.names = list(names)
+        self._array = multiprocessing.Array(
+            ctypes.c_double, len(self.names) * len(self.FIELDS))
+
+    def _view(self):
+        return np.frombuffer(self._array.get_obj()).reshape(
+            len(self.names), len(self.FIELDS))
+
+    def add(self, counters):
+        with self._array.get_lock():
+            self._view()[:] += counters
+
+    def snapshot(self):
+        """Return a copy of the counters, (num_transforms, 4) array."""
+        with self._array.get_lock():
+            return self._view().copy()
+
+    def reset(self):
+        with self._array.get_lock():
+            self._view()[:] = 0
+
+    @classmethod
+    def format_table(cls, names, counters):
+        """Format the counters as a table of per-call averages."""
+        calls = np.maximum(counters[:, 0], 1)
+        total_seconds = max(counters[:, 1].sum(), 1e-12)
+        lines = ['{:<28s} {:>9s} {:>9s} {:>7s} {:>10s} {:>8s}'.format(
+            'transform', 'calls', 'ms/call', 'time%', 'MB/call',
+            'failures')]
+        for name, row, num_calls in zip(names, counters, calls):
+            lines.append(
+                '{:<28s} {:>9d} {:>9.3f} {:>7.1f} {:>10.3f} {:>8d}'.format(
+                    name, int(row[0]), row[1] * 1e3 / num_calls,
+                    row[1] * 100 / total_seconds,
+                    row[2] / num_calls / 1024 / 1024, int(row[3])))
+        return '\n'.join(lines)
+
+
+class GeometricRun(object):
+    """Consecutive geometric transforms applied as one warp.
+
+    The parameters of the transforms (those with an `affine` method) are
+    sampled in order and their matrices composed, then the frames are
+    resampled once by `warp_clip`. The metadata is the same as running the
+    transforms one by one. Flows fall back to the transforms, as flipping
+    them also inverts their values.
+
+    Args:
+        transforms (list[callable]): The geometric transforms.
+    """
+
+    def __init__(self, transforms):
+        self.transforms = transforms
+        self.interpolation = 'bilinear'
+        for t in transforms:
+            self.interpolation = getattr(t, 'interpolation',
+                                         self.interpolation)
+
+    def __call__(self, results):
+        if results.get('modality') == 'Flow':
+            for t in self.transforms:
+                results = t(results)
+            return results
+        img_group = results['img_group']
+        img_shape = img_group[0].shape
+        matrix = np.eye(3)
+        for t in self.transforms:
+            t_matrix, img_shape = t.affine(results, img_shape)
+            matrix = t_matrix.dot(matrix)
+        results['img_group'] = warp_clip(img_group, matrix, img_shape,
+                                         self.interpolation)
+        return results
+
+    def __repr__(self):
+        return self.__class__.__name__ + '({})'.format(
+            '+'.join(t.__class__.__name__ for t in self.transforms))
+
+
+class PerClip(object):
+    """Transforms applied to each clip of a sample on its own.
+
+    In training, the frames of the `num_clips` clips sampled by
+    `SampleFrames` are split by clip and every clip goes through the
+    transforms with its own random parameters (crop, flip, jitter, ...).
+    The frames are then concatenated back in clip order and the metadata is
+    that of the first clip. In testing, or with a single clip, the
+    transforms are applied to all the frames at once.
+
+    Args:
+        transforms (list[callable]): The transforms.
+    """
+
+    def __init__(self, transforms):
+        self.transforms = transforms
+
+    def _apply(self, results):
+        for t in self.transforms:
+            results = t(results)
+            if results is None:
+                return None
+        return results
+
+    def __call__(self, results):
+        num_clips = results['num_clips']
+        if results.get('test_mode') or num_clips == 1:
+            return self._apply(results)
+        img_group = results['img_group']
+        clip_frames = len(img_group) // num_clips
+        clips = []
+        for i in range(num_clips):
+            clip = dict(results)
+            clip['img_group'] = img_group[i * clip_frames:
+                                          (i + 1) * clip_frames]
+            clip = self._apply(clip)
+            if clip is None:
+                return None
+            clips.append(clip)
+        results = clips[0]
+        results['img_group'] = _concat([clip['img_group'] for clip in clips])
+        return results
+
+    def __repr__(self):
+        return self.__class__.__name__ + '({})'.format(
+            ', '.join(repr(t) for t in self.transforms))
 
 
 @PIPELINES.register_module
 class Compose(object):
     """Compose a data pipeline with a sequence of transforms.
 
+    Loaders that can decode at a reduced resolution (those with a
+    `set_min_short_side` method) are told the smallest short side required
+    by the first following geometric transform (those with a
+    `min_short_side` method).
+
+    With profiling enabled (`profile=True` or `enable_profiling()` before
+    the workers are started), the wall time, the bytes of the results and
+    the failures (None returned or exception raised) of every transform are
+    counted in a `PipelineStats` shared by all the workers, see
+    `PipelineProfilerHook`.
+
+    With `fuse_geometric`, runs of two or more consecutive geometric
+    transforms (`MultiScaleCrop`, `RandomResizedCrop`, `Resize`,
+    `CenterCrop`, `Flip`) are merged into a `GeometricRun`, which resamples
+    the frames once instead of once per transform.
+
+    `decode_end` splits the pipeline after the last decoder, so that the
+    decoded frames can be augmented several times (see `EchoDataset`):
+    `pipeline(data, stop=pipeline.decode_end)` decodes and
+    `pipeline(decoded, start=pipeline.decode_end)` augments.
+
+    With `augment_clips`, the steps between the last decoder and
+    `FormatShape` are wrapped in a `PerClip`: a video read once gives
+    `num_clips` clips (see `SampleFrames`), each with its own spatial
+    augmentation, for training with `train_cfg=dict(clips_per_video=...)`.
+    Not for TSN-style sampling, where the clips are segments of one sample.
+
+    Datasets take the arguments as a dict, e.g.
+    `pipeline=dict(transforms=[...], fuse_geometric=True)`.
+
     Args:
         transforms (list[dict | callable]):
             Either config dicts of transforms or transform objects.
+        profile (bool): Whether to profile the transforms. Default: False.
+        fuse_geometric (bool): Whether to merge geometric transforms.
+            Default: False.
+        augment_clips (bool): Whether to augment each clip on its own.
+            Default: False.
     """
 
-    def __init__(self, transforms):
+    def __init__(self, transforms, profile=False, fuse_geometric=False,
+                 augment_clips=False):
         assert isinstance(transforms, Sequence)
         self.transforms = []
         for transform in transforms:
@@ -27,17 +229,107 @@ class Compose(object):
                 raise TypeError(
                     'transform must be callable or a dict, but got {}'.format(
                         type(transform)))
+        self._set_decode_hints()
+        self.steps = self._fuse_geometric() if fuse_geometric \
+            else list(self.transforms)
+        if augment_clips:
+            self._wrap_clips()
+        self.stats = None
+        if profile:
+            self.enable_profiling()
 
-    def __call__(self, data):
-        for t in self.transforms:
+    @property
+    def decode_end(self):
+        """Index of the first step after the last decoder."""
+        decode_end = 0
+        for i, t in enumerate(self.steps):
+            if isinstance(t, DECODERS):
+                decode_end = i + 1
+        return decode_end
+
+    def _wrap_clips(self):
+        start = self.decode_end
+        assert start > 0, 'augment_clips requires a decoder'
+        stop = start
+        while stop < len(self.steps) and \
+                not isinstance(self.steps[stop], FormatShape):
+            stop += 1
+        assert stop < len(self.steps), 'augment_clips requires FormatShape'
+        self.steps[start:stop] = [PerClip(self.steps[start:stop])]
+
+    def _fuse_geometric(self):
+        steps = []
+        run = []
+        for transform in self.transforms + [None]:
+            if transform is not None and hasattr(transform, 'affine'):
+                run.append(transform)
+                continue
+            if len(run) > 1:
+                steps.append(GeometricRun(run))
+            else:
+                steps.extend(run)
+            run = []
+            if transform is not None:
+                steps.append(transform)
+        return steps
+
+    def enable_profiling(self):
+        """Start counting the stats of the transforms."""
+        if self.stats is None:
+            names = ['{}.{}'.format(i, t.__class__.__name__)
+                     for i, t in enumerate(self.steps)]
+            self.stats = PipelineStats(names)
+        return self.stats
+
+    def _set_decode_hints(self):
+        for i, transform in enumerate(self.transforms):
+            if not hasattr(transform, 'set_min_short_side'):
+                continue
+            min_short_side = None
+            for next_transform in self.transforms[i + 1:]:
+                if hasattr(next_transform, 'set_min_short_side'):
+                    break
+                if hasattr(next_transform, 'min_short_side'):
+                    min_short_side = next_transform.min_short_side()
+                    break
+            transform.set_min_short_side(min_short_side)
+
+    def __call__(self, data, start=0, stop=None):
+        """Run the steps [start, stop) of the pipeline on data."""
+        if self.stats is not None:
+            return self._profiled_call(data, start, stop)
+        for t in self.steps[start:stop]:
             data = t(data)
             if data is None:
                 return None
         return data
 
+    def _profiled_call(self, data, start=0, stop=None):
+        counters = np.zeros((len(self.steps), len(PipelineStats.FIELDS)))
+        stop = len(self.steps) if stop is None else stop
+        try:
+            for i in range(start, stop):
+                t = self.steps[i]
+                counters[i, 0] = 1
+                tic = time.perf_counter()
+                try:
+                    data = t(data)
+                finally:
+                    counters[i, 1] = time.perf_counter() - tic
+                if data is None:
+                    counters[i, 3] = 1
+                    return None
+                counters[i, 2] = _nbytes(data)
+        except Exception:
+            counters[i, 3] = 1
+            raise
+        finally:
+            self.stats.add(counters)
+        return data
+
     def __repr__(self):
         format_string = self.__class__.__name__ + '('
-        for t in self.transforms:
+        for t in self.steps:
             format_string += '\n'
             format_string += '    {0}'.format(t)
         format_string += '\n)'
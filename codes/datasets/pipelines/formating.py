@@ -136,6 +136,8 @@ class FormatShape(object):
 
     Required keys are "img_group", "num_clips" and "clip_len",
     added or modified keys are "img_group" and "input_shape".
+    "img_group" is a list of frames or a stacked (T, H, W[, C]) array, or a
+    (T, C, H, W) array if "img_layout" is "TCHW".
 
     Attributes:
         input_format (str): define the final imgs format.
@@ -149,15 +151,27 @@ class FormatShape(object):
 
     def __call__(self, results):
         img_group = results['img_group']
-        # transpose
-        if results['modality'] == 'Flow':
-            assert len(img_group[0].shape) == 2
-            img_group = [np.stack((flow_x, flow_y), axis=2)
-                         for flow_x, flow_y in zip(
-                             img_group[0::2], img_group[1::2])]
-        img_group = [img.transpose(2, 0, 1) for img in img_group]
-        # Stack into numpy.array
-        img_group = np.stack(img_group, axis=0)
+        if results.get('img_layout') == 'TCHW':
+            pass
+        elif isinstance(img_group, np.ndarray):
+            if results['modality'] == 'Flow':
+                assert img_group.ndim == 3
+                # interleaved x/y flows are already [M x 2 x H x W]
+                img_group = img_group.reshape(
+                    (-1, 2) + img_group.shape[1:])
+            else:
+                img_group = img_group.transpose(0, 3, 1, 2)
+            img_group = np.ascontiguousarray(img_group)
+        else:
+            # transpose
+            if results['modality'] == 'Flow':
+                assert len(img_group[0].shape) == 2
+                img_group = [np.stack((flow_x, flow_y), axis=2)
+                             for flow_x, flow_y in zip(
+                                 img_group[0::2], img_group[1::2])]
+            img_group = [img.transpose(2, 0, 1) for img in img_group]
+            # Stack into numpy.array
+            img_group = np.stack(img_group, axis=0)
         # [M x C x H x W]
 
         # M = 1 * N_oversample * N_clips * L
@@ -187,3 +201,4 @@ class FormatShape(object):
     def __repr__(self):
         repr_str = self.__class__.__name__
         repr_str += '(input_format={})'.format(self.input_format)
+        return repr_str
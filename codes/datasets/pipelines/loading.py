@@ -1,13 +1,179 @@
 """loading"""
+import os
 import os.path as osp
-# import mmcv
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import mmcv
 import numpy as np
-from codes.utils import FileClient, get_root_logger
+from codes.utils import (FileClient, FrameShardReader, HandleCache,
+                         SharedFrameCache, get_root_logger)
+from codes.utils.frame_shard import (SINGLE_VIDEO_KEY, convert_pickle_to_shard,
+                                     is_frame_shard)
 from codes.datasets.builder import PIPELINES
 logger = get_root_logger()
-# from io import StringIO, BytesIO
-# import collections
-# from PIL import Image
+
+_JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+_REDUCED_FLAGS = {
+    'color': {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4,
+              8: cv2.IMREAD_REDUCED_COLOR_8},
+    'grayscale': {2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+                  4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+                  8: cv2.IMREAD_REDUCED_GRAYSCALE_8},
+}
+
+
+def _jpeg_size(content):
+    """Parse (h, w) from the SOF segment of a JPEG, None if not a JPEG."""
+    data = memoryview(content)
+    if bytes(data[:2]) != b'\xff\xd8':
+        return None
+    pos = 2
+    while pos + 9 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            # fill byte
+            pos += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            # markers without a payload
+            pos += 2
+            continue
+        if marker in _JPEG_SOF_MARKERS:
+            return ((data[pos + 5] << 8) | data[pos + 6],
+                    (data[pos + 7] << 8) | data[pos + 8])
+        pos += 2 + ((data[pos + 2] << 8) | data[pos + 3])
+    return None
+
+
+def _imfrombytes(content, flag='color', min_short_side=None):
+    """Decode an image, with libjpeg DCT scaling when it is at least 2, 4 or
+    8 times larger than `min_short_side`."""
+    if min_short_side is not None and flag in _REDUCED_FLAGS:
+        size = _jpeg_size(content)
+        if size is not None:
+            for factor in (8, 4, 2):
+                if min(size) >= min_short_side * factor:
+                    img = cv2.imdecode(np.frombuffer(content, np.uint8),
+                                       _REDUCED_FLAGS[flag][factor])
+                    if img is not None:
+                        return img
+                    break
+    return mmcv.imfrombytes(content, flag)
+
+
+def _plan_decode(frame_inds, num_frames=None):
+    """Sort and deduplicate the frame indices of all clips, so that they are
+    decoded in one forward pass.
+
+    Returns:
+        tuple[np.ndarray]: The sorted unique indices and the inverse indices
+            to scatter the decoded frames back into clip order.
+    """
+    frame_inds = np.asarray(frame_inds, dtype=np.int64).reshape(-1)
+    if num_frames:
+        frame_inds = frame_inds % num_frames
+    return np.unique(frame_inds, return_inverse=True)
+
+
+def _stored_inds(results):
+    """Indices of the stored frames holding the sampled frames.
+
+    Frames extracted with a stride (`data_process/video2image.py --stride`)
+    keep the frames 0, stride, 2 * stride, ... of the video, the frame
+    indices sampled on the timeline of the video are mapped to the stored
+    frame at or before them.
+    """
+    stride = results.get('frame_stride', 1)
+    if stride == 1:
+        return results['frame_inds']
+    return np.asarray(results['frame_inds'], dtype=np.int64) // stride
+
+
+def _preceding_keyframes(uniq_inds, key_frame_inds):
+    """Position in `key_frame_inds` of the keyframe preceding each index."""
+    return np.maximum(
+        np.searchsorted(key_frame_inds, uniq_inds, side='right') - 1, 0)
+
+
+def _reduced_size(img_h, img_w, short_side):
+    """(w, h) rescaled to `short_side`, None if it is not a downscale."""
+    if short_side is None or min(img_h, img_w) <= short_side:
+        return None
+    scale = short_side / min(img_h, img_w)
+    return int(round(img_w * scale)), int(round(img_h * scale))
+
+
+def _keyframe_cost(uniq_inds, key_frame_inds, seek_cost):
+    """Decoded frames (plus `seek_cost` per seek) to read the sorted
+    `uniq_inds` by seeking to preceding keyframes, see
+    `PyAVDecode._decode_indexed`."""
+    keys = key_frame_inds[_preceding_keyframes(uniq_inds, key_frame_inds)]
+    cost = 0
+    pos = None
+    for idx, key in zip(uniq_inds.tolist(), keys.tolist()):
+        if pos is None or key > pos:
+            cost += seek_cost + idx - key + 1
+        else:
+            cost += idx - pos + 1
+        pos = idx + 1
+    return cost
+
+
+def _choose_strategy(uniq_inds, key_frame_inds, accurate, seek_cost):
+    """Pick the cheapest way to decode the sorted `uniq_inds`.
+
+    The cost is counted in decoded frames, a seek (flushing the decoder and
+    reading the packets from the keyframe) costing `seek_cost` frames:
+        - "sequential": decode from the first frame to the last index.
+        - "keyframe": seek to the keyframe preceding an index unless it is
+          in the GOP being decoded, only with known keyframes.
+        - "seek": seek to the keyframe of every index and take its first
+          frame, which is not accurate, only if `accurate` is False.
+    Dense clips near the start are read sequentially, sparse clips of long
+    videos by seeking.
+    """
+    costs = dict(sequential=uniq_inds[-1] + 1)
+    if key_frame_inds is not None and len(key_frame_inds) > 0:
+        costs['keyframe'] = _keyframe_cost(uniq_inds, key_frame_inds,
+                                           seek_cost)
+    if not accurate:
+        costs['seek'] = len(uniq_inds) * (1 + seek_cost)
+    return min(costs, key=costs.get)
+
+
+class _ReducedDecodeMixin(object):
+    """Decoding at the resolution needed by the following transform.
+
+    With `reduced_decode`, `Compose` tells the loader the smallest short side
+    the following geometric transform needs (`set_min_short_side`), which
+    is kept as `_decode_short_side`. JPEGs at least 2, 4 or 8 times larger
+    are then decoded at 1/2, 1/4 or 1/8 resolution (`_imfrombytes`) and
+    videos are scaled down to that short side by the decoder.
+    """
+
+    reduced_decode = False
+    _decode_short_side = None
+
+    def set_min_short_side(self, short_side):
+        """Set by `Compose` from the following geometric transform."""
+        if self.reduced_decode:
+            self._decode_short_side = short_side
+
+
+def _scatter(frames, inverse):
+    """Scatter the decoded unique frames back into clip order.
+
+    A frame sampled several times (overlapping clips, indices clamped at the
+    end of a short video) is the same array at each of its positions. The
+    transforms never modify their input frames in place.
+    """
+    return [frames[i] for i in inverse]
+
+
 @PIPELINES.register_module
 class SampleFrames(object):
     """Sample frames from the video.
@@ -114,7 +280,8 @@ class SampleFrames(object):
 
     def __call__(self, results):
         if 'total_frames' not in results:
-            # TODO: find a better way to get the total frames number for video
+            # build the metadata index of VideoDataset to skip this
+            # (data_process/gen_videos_info.py --info meta)
             video_reader = mmcv.VideoReader(results['filename'])
             # import decord
             # video_reader = decord.VideoReader(results['filename'])
@@ -132,32 +299,152 @@ class SampleFrames(object):
 
 
 @PIPELINES.register_module
-class PyAVDecode(object):
+class PyAVDecode(_ReducedDecodeMixin):
     """Using pyav to decode the video.
     PyAV: https://github.com/mikeboers/PyAV
     Required keys are "filename" and "frame_inds",
     added or modified keys are "img_group" and "ori_shape".
+    With the keyframe index of the video ("key_frame_inds" and "key_pts",
+    see `VideoDataset`), the decoder can seek to the keyframe preceding a
+    sampled frame and decode accurately from there.
+    If `adaptive`, the cheapest strategy for the sampled indices is chosen
+    per sample by `_choose_strategy` when the keyframe index is known;
+    without it, the strategy is the one chosen without `adaptive`. The
+    strategy and the decoding time are added to the results as
+    "decode_strategy" and "decode_time".
+    With `short_side` (or `reduced_decode` and a following geometric
+    transform, see `Compose`), larger frames are scaled down to that short
+    side by the swscale conversion to RGB, instead of being converted at
+    full resolution and resized later.
+    With `max_open`, the opened containers are kept in a per-worker
+    `HandleCache`, so that a video sampled again soon is not reopened.
     Attributes:
         multi_thread (bool): If set to True, it will
             apply multi thread processing.
+        accurate (bool): Only use accurate strategies, i.e. decode from
+            the first frame instead of seeking to the nearest keyframe when
+            the keyframes are unknown.
+        adaptive (bool): Choose the strategy per sample. Default: True.
+        seek_cost (float): Cost of a seek in decoded frames. Default: 8.
+        short_side (int): Short side to decode the frames at. Default: None.
+        reduced_decode (bool): Decode at the short side needed by the
+            following geometric transform, see `_ReducedDecodeMixin`.
+            Default: False.
+        max_open (int): Max number of containers kept open in each worker,
+            0 closes them after each sample. Default: 0.
     """
 
-    def __init__(self, multi_thread=True, accurate=False):
+    def __init__(self, multi_thread=True, accurate=False, adaptive=True,
+                 seek_cost=8, short_side=None, reduced_decode=False,
+                 max_open=0):
         self.multi_thread = multi_thread
         self.accurate = accurate
+        self.adaptive = adaptive
+        self.seek_cost = seek_cost
+        self.short_side = short_side
+        self.reduced_decode = reduced_decode
+        self.max_open = max_open
+        self._containers = HandleCache(max_open)
+
+    def _reformat(self, stream):
+        """Arguments of `VideoFrame.to_ndarray` for the frames of stream."""
+        short_side = self.short_side if self.short_side is not None \
+            else self._decode_short_side
+        size = _reduced_size(stream.codec_context.height,
+                             stream.codec_context.width, short_side)
+        if size is None:
+            return dict(format='rgb24')
+        return dict(format='rgb24', width=size[0], height=size[1])
+
+    def _strategy(self, results, uniq_inds):
+        key_frame_inds = results.get('key_frame_inds')
+        if key_frame_inds is None:
+            return 'sequential' if self.accurate else 'seek'
+        if self.adaptive:
+            return _choose_strategy(uniq_inds, key_frame_inds,
+                                    self.accurate, self.seek_cost)
+        return 'keyframe'
+
+    def _open(self, av, filename):
+        """Open the container, the threading of the codec can only be set
+        before its first decode."""
+        container = av.open(filename)
+        if self.multi_thread:
+            container.streams.video[0].thread_type = 'AUTO'
+        return container
 
-    def frame_generator(self, container, stream):
+    def frame_generator(self, container, stream, reformat=None):
         """frame generator
         Args:
             container ([type]): [description]
             stream ([type]): [description]
+            reformat (dict): Arguments of `to_ndarray`, default: RGB.
         Returns:
             [type]: [description]
         """
+        reformat = reformat or dict(format='rgb24')
         for packet in container.demux(stream):
             for frame in packet.decode():
                 if frame:
-                    return frame.to_ndarray(format='rgb24')
+                    return frame.to_ndarray(**reformat)
+
+    @staticmethod
+    def _decode_accurate(container, uniq_inds, reformat=None):
+        """Decode the video from the start in one pass, converting only the
+        frames at the sorted `uniq_inds` and stopping after the last one.
+
+        Returns:
+            tuple: The converted frames and the number of decoded frames.
+        """
+        reformat = reformat or dict(format='rgb24')
+        frames = []
+        num_decoded = 0
+        for frame in container.decode(video=0):
+            # some other formats gray16be, bgr24, rgb24
+            if num_decoded == uniq_inds[len(frames)]:
+                frames.append(frame.to_ndarray(**reformat))
+                if len(frames) == len(uniq_inds):
+                    break
+            num_decoded += 1
+        return frames, num_decoded
+
+    @staticmethod
+    def _decode_indexed(container, stream, uniq_inds, key_frame_inds,
+                        key_pts, reformat=None):
+        """Decode the frames at the sorted `uniq_inds`, seeking to the
+        preceding keyframe unless decoding on from the current position is
+        at most as long.
+        """
+        reformat = reformat or dict(format='rgb24')
+        frames = []
+        keys = _preceding_keyframes(uniq_inds, key_frame_inds)
+        decoder = None
+        pos = 0
+        start_pts = 0
+        for idx, key in zip(uniq_inds.tolist(), keys.tolist()):
+            if decoder is None or key_frame_inds[key] > pos:
+                start_pts = int(key_pts[key])
+                container.seek(start_pts, backward=True, any_frame=False,
+                               stream=stream)
+                decoder = container.decode(stream)
+                pos = int(key_frame_inds[key])
+            frame = None
+            while pos <= idx:
+                frame = next(decoder, None)
+                if frame is None:
+                    break
+                if frame.pts is not None and frame.pts < start_pts:
+                    # leading frames of an open GOP
+                    continue
+                pos += 1
+            if frame is not None:
+                frames.append(frame.to_ndarray(**reformat))
+            elif frames:
+                # the index may count a few more frames than are decodable
+                frames.append(frames[-1])
+            else:
+                raise IOError('Failed to decode frame {}'.format(idx))
+        return frames
 
     def __call__(self, results):
         try:
@@ -169,11 +456,11 @@ class PyAVDecode(object):
         if results['frame_inds'].ndim != 1:
             results['frame_inds'] = np.squeeze(results['frame_inds'])
 
+        filename = results['filename']
         try:
-            container = av.open(results['filename'])
+            container = self._containers.get(
+                filename, lambda: self._open(av, filename))
             stream = container.streams.video[0]
-            if self.multi_thread:
-                stream.thread_type = 'AUTO'
             # check duration
             try:
                 duration = stream.duration * stream.time_base
@@ -184,51 +471,65 @@ class PyAVDecode(object):
                     results['filename']))
 
             frame_count = stream.frames
-            max_inds = max(results['frame_inds'])
-            if max_inds > frame_count:
-                frame_inds = [idx %
-                              frame_count for idx in results['frame_inds']]
-            else:
-                frame_inds = results['frame_inds']
-            img_group = list()
-            if self.accurate:  # for accurate seeking
-                i = 0
-                for frame in container.decode(video=0):
-                    # set max indice to make early stop
-                    if i > max_inds + 1:
-                        break
-                    # some other formats gray16be, bgr24, rgb24
-                    img_group.append(frame.to_ndarray(format='rgb24'))
-                    i += 1
-
-                # the available frame in pyav may be less than its length, which may raise error
-                results['img_group'] = [img_group[i %
-                                                  len(img_group)] for i in results['frame_inds']]
+            uniq_inds, inverse = _plan_decode(results['frame_inds'],
+                                              frame_count)
+            strategy = self._strategy(results, uniq_inds)
+            reformat = self._reformat(stream)
+            start = time.perf_counter()
+            if strategy == 'keyframe':
+                frames = self._decode_indexed(
+                    container, stream, uniq_inds,
+                    results['key_frame_inds'], results['key_pts'],
+                    reformat)
+            elif strategy == 'sequential':  # for accurate seeking
+                if self.max_open > 0:
+                    # a cached container may have been read before
+                    container.seek(0)
+                frames, num_decoded = self._decode_accurate(
+                    container, uniq_inds, reformat)
+                if len(frames) < len(uniq_inds):
+                    # the available frame in pyav may be less than its
+                    # length, wrap the indices around the decoded frames
+                    uniq_inds, inverse = _plan_decode(
+                        results['frame_inds'], num_decoded)
+                    container.seek(0)
+                    frames, _ = self._decode_accurate(
+                        container, uniq_inds, reformat)
             else:   # for fast seeking (not accurate)
-                for idx in frame_inds.tolist():
-                    pts_scale = stream.average_rate * stream.time_base
+                frames = []
+                pts_scale = stream.average_rate * stream.time_base
+                for idx in uniq_inds.tolist():
                     frame_pts = int(idx / pts_scale)
                     container.seek(frame_pts, any_frame=False,
                                    backward=True, stream=stream)
-                    frame = self.frame_generator(container, stream)
+                    frame = self.frame_generator(container, stream,
+                                                 reformat)
                     if frame is not None:
-                        img_group.append(frame)
+                        frames.append(frame)
                     else:
-                        img_group.append(img_group[-1])
-                results['img_group'] = img_group
-            container.close()
+                        frames.append(frames[-1])
+            results['decode_strategy'] = strategy
+            results['decode_time'] = time.perf_counter() - start
+            results['img_group'] = _scatter(frames, inverse)
+            self._containers.release(filename, container)
 
             results['ori_shape'] = results['img_group'][0].shape[:2]
         except Exception as e:
             logger.info("Failed to decode {} with exception: {}".format(
                 results['filename'], e))
+            self._containers.discard(filename)
             return None
 
         return results
 
     def __repr__(self):
         repr_str = self.__class__.__name__
-        repr_str += '(multi_thread={})'.format(self.multi_thread)
+        repr_str += ('(multi_thread={}, accurate={}, adaptive={}, '
+                     'short_side={}, reduced_decode={}, max_open={})'.format(
+                         self.multi_thread, self.accurate, self.adaptive,
+                         self.short_side, self.reduced_decode,
+                         self.max_open))
+        return repr_str
 
 
 @PIPELINES.register_module
@@ -280,19 +581,101 @@ class PIMSDecode(object):
 
 
 @PIPELINES.register_module
-class DecordDecode(object):
+class DecordDecode(_ReducedDecodeMixin):
     """Using decord to decode the video.
     Decord: https://github.com/zhreshold/decord
     Required keys are "filename" and "frame_inds",
     added or modified keys are "img_group" and "ori_shape".
+    With the keyframe index of the video ("key_frame_inds", see
+    `VideoDataset`), the frames are read in one pass: the decoder skips
+    forward within a GOP and only seeks (accurately) to frames of a later
+    GOP. Without it, accurate random access is `get_batch` ("batch").
+    If `adaptive`, the cheapest strategy for the sampled indices is chosen
+    per sample by `_choose_strategy`. Without a keyframe index, the
+    keyframes are estimated from "num_keyframes" of the metadata index and
+    `get_batch`, which seeks to the keyframes by itself, is costed as the
+    "keyframe" strategy; without either, the strategy is the one chosen
+    without `adaptive`. The strategy which ran and the decoding time are
+    added to the results as "decode_strategy" and "decode_time".
+    With `short_side` (or `reduced_decode` and a following geometric
+    transform, see `Compose`), decord scales larger frames down to that
+    short side while decoding. The source resolution is taken from the
+    metadata index ("resolution"), without it the video is decoded at its
+    full resolution.
+    With `max_open`, the readers are kept in a per-worker `HandleCache`, so
+    that a video sampled again soon is not reopened and reindexed.
     Attributes:
         num_threads (int): multi thread processing.
         accurate (bool): random access patterns
+        adaptive (bool): Choose the strategy per sample. Default: True.
+        seek_cost (float): Cost of a seek in decoded frames. Default: 8.
+        short_side (int): Short side to decode the frames at. Default: None.
+        reduced_decode (bool): Decode at the short side needed by the
+            following geometric transform, see `_ReducedDecodeMixin`.
+            Default: False.
+        max_open (int): Max number of readers kept open in each worker,
+            0 drops them after each sample. Default: 0.
     """
 
-    def __init__(self, num_threads=0, accurate=True):
+    def __init__(self, num_threads=0, accurate=True, adaptive=True,
+                 seek_cost=8, short_side=None, reduced_decode=False,
+                 max_open=0):
         self.num_threads = num_threads
         self.accurate = accurate
+        self.adaptive = adaptive
+        self.seek_cost = seek_cost
+        self.short_side = short_side
+        self.reduced_decode = reduced_decode
+        self.max_open = max_open
+        self._readers = HandleCache(max_open)
+
+    def _reader_kwargs(self, results):
+        kwargs = dict(num_threads=self.num_threads)
+        short_side = self.short_side if self.short_side is not None \
+            else self._decode_short_side
+        if 'resolution' in results:
+            size = _reduced_size(*results['resolution'], short_side)
+            if size is not None:
+                kwargs.update(width=size[0], height=size[1])
+        return kwargs
+
+    def _strategy(self, results, uniq_inds, num_frames):
+        key_frame_inds = results.get('key_frame_inds')
+        if key_frame_inds is not None:
+            if not self.adaptive:
+                return 'keyframe'
+            return _choose_strategy(uniq_inds, key_frame_inds,
+                                    self.accurate, self.seek_cost)
+        if not self.adaptive or not results.get('num_keyframes'):
+            return 'batch' if self.accurate else 'seek'
+        num_keyframes = results['num_keyframes']
+        strategy = _choose_strategy(
+            uniq_inds, np.arange(num_keyframes) * num_frames // num_keyframes,
+            self.accurate, self.seek_cost)
+        return 'batch' if strategy == 'keyframe' else strategy
+
+    @staticmethod
+    def _read_forward(container, uniq_inds, key_frame_inds=None):
+        """Read the sorted `uniq_inds` skipping forward, from the first
+        frame, or seeking to the indices of a later GOP if the keyframes
+        are given."""
+        if key_frame_inds is None:
+            container.seek(0)
+            pos = 0
+        else:
+            keys = key_frame_inds[
+                _preceding_keyframes(uniq_inds, key_frame_inds)]
+            pos = None
+        frames = []
+        for i, idx in enumerate(uniq_inds.tolist()):
+            if pos is None or (key_frame_inds is not None and
+                               keys[i] > pos):
+                container.seek_accurate(idx)
+            elif idx > pos:
+                container.skip_frames(idx - pos)
+            frames.append(container.next().asnumpy())
+            pos = idx + 1
+        return frames
 
     def __call__(self, results):
         try:
@@ -303,26 +686,44 @@ class DecordDecode(object):
         decord.logging.set_level(5)
         if results['frame_inds'].ndim != 1:
             results['frame_inds'] = np.squeeze(results['frame_inds'])
+        kwargs = self._reader_kwargs(results)
+        # the same video may be decoded at several sizes
+        key = (results['filename'], kwargs.get('width'), kwargs.get('height'))
         try:
-            container = decord.VideoReader(
-                results['filename'], num_threads=self.num_threads)
+            container = self._readers.get(
+                key, lambda: decord.VideoReader(results['filename'],
+                                                **kwargs))
             num_frames = len(container)  # decord num_frames
-            frame_inds = [idx % num_frames for idx in results['frame_inds']]
-            # Generate frame index mapping in order
-            # frame_dict = {idx: container[idx % num_frames].asnumpy() for idx in np.unique(frame_inds)}
-            # img_group = [frame_dict[idx] for idx in frame_inds]
-
-            if self.accurate:
-                img_group = container.get_batch(frame_inds).asnumpy()
+            uniq_inds, inverse = _plan_decode(results['frame_inds'],
+                                              num_frames)
+            strategy = self._strategy(results, uniq_inds, num_frames)
+            start = time.perf_counter()
+            if strategy == 'keyframe':
+                frames = self._read_forward(container, uniq_inds,
+                                            results['key_frame_inds'])
+                img_group = _scatter(frames, inverse)
+            elif strategy == 'batch':
+                frames = container.get_batch(uniq_inds.tolist()).asnumpy()
+                img_group = frames[inverse]
+            elif strategy == 'sequential':
+                frames = self._read_forward(container, uniq_inds)
+                img_group = _scatter(frames, inverse)
             else:
                 # faster, however always return I-FRAME
                 container.seek(0)
-                img_group = []
-                for idx in frame_inds:
-                    container.seek(idx)
-                    frame = container.next()
-                    img_group.append(frame.asnumpy())
+                frames = []
+                pos = 0
+                for idx in uniq_inds.tolist():
+                    # consecutive frames are read without seeking
+                    if idx != pos:
+                        container.seek(idx)
+                    frames.append(container.next().asnumpy())
+                    pos = idx + 1
+                img_group = _scatter(frames, inverse)
+            results['decode_strategy'] = strategy
+            results['decode_time'] = time.perf_counter() - start
 
+            self._readers.release(key, container)
             del container
             results['img_group'] = img_group
             results['ori_shape'] = img_group[0].shape
@@ -330,6 +731,7 @@ class DecordDecode(object):
         except Exception as e:
             logger.info("Failed to decode {} with exception: {}".format(
                 results['filename'], e))
+            self._readers.discard(key)
             return None
         return results
 
@@ -339,50 +741,119 @@ class OpenCVDecode(object):
     """Using OpenCV to decode the video.
     Required keys are "filename" and "frame_inds",
     added or modified keys are "img_group" and "ori_shape".
+    The requested frames of all clips are decoded in one forward pass:
+    skipped frames are only grabbed and the requested ones retrieved.
+    With `max_open`, the captures are kept in a per-worker `HandleCache`
+    and a cached capture goes on from its position when the first
+    requested frame is not behind it.
+    Attributes:
+        max_open (int): Max number of captures kept open in each worker,
+            0 releases them after each sample. Default: 0.
     """
 
+    def __init__(self, max_open=0):
+        self.max_open = max_open
+        self._captures = HandleCache(max_open)
+
+    @staticmethod
+    def _open(filename):
+        container = cv2.VideoCapture(filename)
+        if not container.isOpened():
+            raise IOError('Failed to open {}'.format(filename))
+        return container
+
+    @staticmethod
+    def _read_back(container, start, stop, default):
+        """Read the last decodable frame from `start` back to (excluded)
+        `stop`, the frame at `stop` is `default`.
+
+        Returns:
+            tuple: The index of the frame read and the frame.
+        """
+        for ind in range(start, stop, -1):
+            container.set(cv2.CAP_PROP_POS_FRAMES, ind)
+            if container.grab():
+                ret, frame = container.retrieve()
+                if ret:
+                    return ind, frame
+        return stop, default
+
     def __call__(self, results):
         if results['frame_inds'].ndim != 1:
             results['frame_inds'] = np.squeeze(results['frame_inds'])
+        filename = results['filename']
         try:
-            container = mmcv.VideoReader(results['filename'])
-            img_group = list()
-            for frame_ind in results['frame_inds']:
-                cur_frame = container[frame_ind]
-                try:
-                    cur_frame = container[frame_ind]
-                except IndexError:
-                    logger.info(results['filename'],
-                                frame_ind, results['total_frames'])
-                # last frame may be None in OpenCV
-                while isinstance(cur_frame, type(None)):
-                    frame_ind -= 1
-                    cur_frame = container[frame_ind]
-                img_group.append(cur_frame)
-            # img_group = np.array(img_group)
-            # The default channel order of OpenCV is BGR, thus we change it to RGB
-            # img_group = img_group[:, :, :, ::-1]
-            # imgs = imgs.transpose([0, 3, 1, 2])
+            uniq_inds, inverse = _plan_decode(results['frame_inds'])
+            container = self._captures.get(
+                filename, lambda: self._open(filename))
+            frames = []
+            # the most recent frame decoded in the scan and its index
+            last_ind, last_frame = -1, None
+            exhausted = False
+            pos = int(container.get(cv2.CAP_PROP_POS_FRAMES))
+            if uniq_inds[0] < pos:
+                container.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                pos = 0
+            for frame_ind in uniq_inds.tolist():
+                cur_frame = None
+                while not exhausted and pos <= frame_ind:
+                    if not container.grab():
+                        exhausted = True
+                        break
+                    pos += 1
+                    if pos - 1 == frame_ind:
+                        ret, frame = container.retrieve()
+                        if ret:
+                            cur_frame = frame
+                            last_ind, last_frame = frame_ind, frame
+                if cur_frame is None:
+                    # last frames may be None in OpenCV, reuse the last
+                    # decodable one before the requested frame
+                    last_ind, last_frame = self._read_back(
+                        container, min(frame_ind, pos) - 1, last_ind,
+                        last_frame)
+                    pos = int(container.get(cv2.CAP_PROP_POS_FRAMES))
+                    if last_frame is None:
+                        raise IOError('Failed to read frame {} of {}'.format(
+                            frame_ind, results['filename']))
+                    cur_frame = last_frame
+                frames.append(cur_frame)
+            self._captures.release(filename, container)
+            # The default channel order of OpenCV is BGR
+            img_group = _scatter(frames, inverse)
             results['img_group'] = img_group
             results['ori_shape'] = img_group[0].shape
         except Exception as e:
             logger.info("Failed to decode {} with exception: {}".format(
                 results['filename'], e))
+            self._captures.discard(filename)
             return None
         return results
 
 
 @PIPELINES.register_module
-class PklLoader(object):
+class PklLoader(_ReducedDecodeMixin):
     """Using pickle to loader pkl file.
     Required keys are "filename" and "frame_inds",
     added or modified keys are "img_group" and "ori_shape".
+    Pkl files in the frame shard format (see `codes/utils/frame_shard.py`)
+    are memory-mapped and only the sampled frames are touched; legacy
+    pickles are loaded entirely.
+    Attributes:
+        convert_legacy (bool): If set to True, legacy pickles are converted
+            to the frame shard format in place the first time they are read.
+        reduced_decode (bool): Decode the JPEGs at a reduced resolution, see
+            `_ReducedDecodeMixin`. Default: False.
     """
 
+    def __init__(self, convert_legacy=False, reduced_decode=False):
+        self.convert_legacy = convert_legacy
+        self.reduced_decode = reduced_decode
+
     def _pil_loader(self, buf, usegray=False):
         # print(type(buf))
-        if isinstance(buf, bytes):
-            img = mmcv.imfrombytes(buf, 'color')
+        if isinstance(buf, (bytes, memoryview)):
+            img = _imfrombytes(buf, 'color', self._decode_short_side)
             # img = Image.open(BytesIO(buf))
             # tempbuff = BytesIO()
             # tempbuff.write(buf)
@@ -395,81 +866,258 @@ class PklLoader(object):
         # return img.convert('L') if usegray else img.convert('RGB')
         return np.array(img)
 
-    def __call__(self, results):
+    def _load_legacy(self, filename):
         try:
             import _pickle as pickle
         except ImportError:
             raise ImportError(
                 'Please run "pip install _pickle" to install _pickle first.')
-        container = pickle.load(open(results['filename'], 'rb'))
-        img_group = list()
+        if self.convert_legacy:
+            return convert_pickle_to_shard(filename)
+        with open(filename, 'rb') as f:
+            return pickle.load(f)
+
+    def __call__(self, results):
         if results['frame_inds'].ndim != 1:
             results['frame_inds'] = np.squeeze(results['frame_inds'])
-        for frame_idx in results['frame_inds']:
-            cur_frame = self._pil_loader(container[frame_idx])
-            img_group.append(cur_frame)
+        uniq_inds, inverse = _plan_decode(results['frame_inds'])
+        if is_frame_shard(results['filename']):
+            with FrameShardReader(results['filename'],
+                                  use_mmap=True) as reader:
+                frames = [self._pil_loader(buf) for buf in
+                          reader.get_frames(SINGLE_VIDEO_KEY, uniq_inds)]
+        else:
+            container = self._load_legacy(results['filename'])
+            frames = [self._pil_loader(container[frame_idx])
+                      for frame_idx in uniq_inds]
             # img_group.append(cur_frame[:, :, ::-1])
+        img_group = _scatter(frames, inverse)
         results['img_group'] = img_group
         results['ori_shape'] = img_group[0].shape
         return results
 
+    def __repr__(self):
+        repr_str = self.__class__.__name__
+        repr_str += '(convert_legacy={}, reduced_decode={})'.format(
+            self.convert_legacy, self.reduced_decode)
+        return repr_str
+
 
 @PIPELINES.register_module
-class FrameSelector(object):
+class FrameSelector(_ReducedDecodeMixin):
     """Select raw frames with given indices
     Required keys are "file_dir", "filename_tmpl" and "frame_inds",
-    added or modified keys are "img_group" and "ori_shape".
+    added or modified keys are "img_group" and "ori_shape". The frame indices
+    of frames extracted with a stride ("frame_stride") are remapped to the
+    stored frames.
     Attributes:
         io_backend (str): io backend where frames are store.
+        cache (dict | None): Config of a `SharedFrameCache` holding decoded
+            frames shared by all workers on the node, e.g.
+            dict(name='k400', capacity_mb=8192). Two extra keys are
+            accepted: "short_side" rescales the frames to the given short
+            side before they are cached (the frames are returned rescaled
+            as well) and "log_interval" is the number of lookups between
+            two hit/miss reports. Default: None.
+        num_decode_threads (int): Number of threads reading and decoding
+            the frames of a clip concurrently in each worker (OpenCV and
+            libjpeg release the GIL). 0 or 1 loads the frames serially.
+            Default: 0.
+        reduced_decode (bool): Decode the JPEGs at a reduced resolution, see
+            `_ReducedDecodeMixin`. Default: False.
     """
 
-    def __init__(self, io_backend='disk', **kwargs):
+    def __init__(self, io_backend='disk', cache=None, num_decode_threads=0,
+                 reduced_decode=False, **kwargs):
+        if num_decode_threads > 1 and io_backend == 'memcached':
+            raise ValueError('The memcached backend is not thread safe, '
+                             'set num_decode_threads to 0')
         self.io_backend = io_backend
         self.file_client = FileClient(self.io_backend, **kwargs)
         self.backup = None
+        self.num_decode_threads = num_decode_threads
+        self._executor = None
+        self._executor_pid = None
+        self.reduced_decode = reduced_decode
+        self.cache_cfg = None
+        self.cache = None
+        if cache is not None:
+            self.cache_cfg = dict(cache)
+            self.cache_short_side = self.cache_cfg.pop('short_side', None)
+            self.cache_log_interval = self.cache_cfg.pop('log_interval', 1000)
+            self._cache_logged = 0
+
+    def __getstate__(self):
+        # thread pools and mapped segments are per process
+        state = self.__dict__.copy()
+        state['_executor'] = None
+        state['cache'] = None
+        return state
+
+    def _get_executor(self):
+        if self.num_decode_threads <= 1:
+            return None
+        # threads do not survive fork, build the pool in the worker
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(self.num_decode_threads)
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    def _get_cache(self):
+        # map the segment lazily, i.e. in the dataloader worker itself
+        if self.cache is None and self.cache_cfg is not None:
+            self.cache = SharedFrameCache(**self.cache_cfg)
+        return self.cache
+
+    def _log_cache_stats(self):
+        lookups = self.cache.hits + self.cache.misses
+        if lookups - self._cache_logged < self.cache_log_interval:
+            return
+        self._cache_logged = lookups
+        stats = self.cache.stats()
+        node_lookups = max(stats['total_hits'] + stats['total_misses'], 1)
+        logger.info(
+            'frame cache {}: worker hits {}, misses {}; node hits {}, '
+            'misses {}, hit rate {:.2%}'.format(
+                self.cache.name, stats['hits'], stats['misses'],
+                stats['total_hits'], stats['total_misses'],
+                stats['total_hits'] / node_lookups))
 
     def _load_image(self, filepath, flag='color'):
+        cache = self._get_cache()
+        if cache is not None:
+            key = '{}:{}:{}:{}'.format(filepath, flag, self.cache_short_side,
+                                       self._decode_short_side)
+            cur_frame = cache.get(key)
+            if cur_frame is not None:
+                return cur_frame
         value_buf = self.file_client.get(filepath)
         try:
-            cur_frame = mmcv.imfrombytes(value_buf, flag)
+            cur_frame = _imfrombytes(value_buf, flag, self._decode_short_side)
         except Exception:
             logger.info('imfrombytes error, reload backup')
-            cur_frame = self.backup
+            return self.backup
         # cur_frame = mmcv.imread(filepath)
+        if cache is not None:
+            if self.cache_short_side is not None:
+                cur_frame = mmcv.imrescale(
+                    cur_frame, (float('inf'), self.cache_short_side))
+            cache.put(key, cur_frame)
         return cur_frame
 
     def __call__(self, results):
         directory = results['filename']
         filename_tmpl = results['filename_tmpl']
-        imgs = list()
         if results['frame_inds'].ndim != 1:
             results['frame_inds'] = np.squeeze(results['frame_inds'])
-        for frame_idx in results['frame_inds']:
+        # load every distinct frame once
+        uniq_inds, inverse = _plan_decode(_stored_inds(results))
+        tasks = list()
+        for frame_idx in uniq_inds:
             if results['modality'] in ['RGB', 'RGBDiff']:
-                filepath = osp.join(
-                    directory, filename_tmpl.format(frame_idx + 1))
-                cur_frame = [self._load_image(filepath)]
+                tasks.append((osp.join(
+                    directory, filename_tmpl.format(frame_idx + 1)), 'color'))
             elif results['modality'] == 'Flow':
-                x_imgs = self._load_image(
-                    osp.join(
-                        directory, filename_tmpl.format(
-                            'x', frame_idx + 1)), flag='grayscale')
-                y_imgs = self._load_image(
-                    osp.join(
-                        directory, filename_tmpl.format(
-                            'y', frame_idx + 1)), flag='grayscale')
-                cur_frame = [x_imgs, y_imgs]
+                tasks.append((osp.join(
+                    directory, filename_tmpl.format(
+                        'x', frame_idx + 1)), 'grayscale'))
+                tasks.append((osp.join(
+                    directory, filename_tmpl.format(
+                        'y', frame_idx + 1)), 'grayscale'))
             else:
                 raise ValueError(
                     'Not implemented yet; modality should be '
                     '["RGB", "RGBDiff", "Flow"]')
-            imgs.extend(cur_frame)
-            if self.backup is None:
-                self.backup = cur_frame
+        executor = self._get_executor()
+        # map the cache before the decode threads share it
+        self._get_cache()
+        if executor is None:
+            imgs = [self._load_image(*task) for task in tasks]
+        else:
+            # map keeps the order of the frames
+            imgs = list(executor.map(lambda task: self._load_image(*task),
+                                     tasks))
+        if results['modality'] == 'Flow':
+            # keep the x and y flows of a frame together
+            imgs = [img for i in inverse for img in imgs[2 * i:2 * i + 2]]
+        else:
+            imgs = _scatter(imgs, inverse)
+        if self.backup is None:
+            self.backup = imgs[0]
         # # [num c h w]
         # imgs = np.array(imgs)
         # imgs = imgs.transpose([0, 3, 1, 2])
+        if self.cache is not None:
+            self._log_cache_stats()
+        results['img_group'] = imgs
+        # [h w c]
+        results['ori_shape'] = imgs[0].shape
+        return results
+
+
+@PIPELINES.register_module
+class ShardFrameSelector(_ReducedDecodeMixin):
+    """Select raw frames with given indices from packed frame shards.
+    Required keys are "filename" (path of the shard), "shard_key" and
+    "frame_inds", added or modified keys are "img_group" and "ori_shape".
+    Flow frames are stored under "{shard_key}/x" and "{shard_key}/y".
+    The frame indices are remapped by "frame_stride" as in `FrameSelector`.
+    Attributes:
+        max_open (int): Max number of shards kept open in each worker (see
+            `HandleCache`).
+        max_gap (int): Gap (in bytes) between two sampled frames below which
+            they are fetched by a single read.
+        reduced_decode (bool): Decode the JPEGs at a reduced resolution, see
+            `_ReducedDecodeMixin`. Default: False.
+    """
+
+    def __init__(self, max_open=64, max_gap=256 * 1024, reduced_decode=False):
+        self.max_open = max_open
+        self.max_gap = max_gap
+        self.reduced_decode = reduced_decode
+        self._readers = HandleCache(max_open)
+
+    def _get_reader(self, filepath):
+        return self._readers.get(
+            filepath, lambda: FrameShardReader(filepath,
+                                               max_gap=self.max_gap))
+
+    def __call__(self, results):
+        reader = self._get_reader(results['filename'])
+        key = results['shard_key']
+        if results['frame_inds'].ndim != 1:
+            results['frame_inds'] = np.squeeze(results['frame_inds'])
+        uniq_inds, inverse = _plan_decode(_stored_inds(results))
+        if results['modality'] in ['RGB', 'RGBDiff']:
+            frames = [_imfrombytes(buf, 'color', self._decode_short_side)
+                      for buf in reader.get_frames(key, uniq_inds)]
+            imgs = _scatter(frames, inverse)
+        elif results['modality'] == 'Flow':
+            x_bufs = reader.get_frames(key + '/x', uniq_inds)
+            y_bufs = reader.get_frames(key + '/y', uniq_inds)
+            frames = [(_imfrombytes(x_buf, 'grayscale',
+                                    self._decode_short_side),
+                       _imfrombytes(y_buf, 'grayscale',
+                                    self._decode_short_side))
+                      for x_buf, y_buf in zip(x_bufs, y_bufs)]
+            imgs = [img for i in inverse for img in frames[i]]
+        else:
+            raise ValueError(
+                'Not implemented yet; modality should be '
+                '["RGB", "RGBDiff", "Flow"]')
+        self._readers.release(results['filename'], reader)
         results['img_group'] = imgs
         # [h w c]
         results['ori_shape'] = imgs[0].shape
         return results
+
+    def __repr__(self):
+        repr_str = self.__class__.__name__
+        repr_str += '(max_open={}, max_gap={}, reduced_decode={})'.format(
+            self.max_open, self.max_gap, self.reduced_decode)
+        return repr_str
+
+
+# transforms reading the frames from the storage, see `Compose.decode_end`
+DECODERS = (PyAVDecode, PIMSDecode, DecordDecode, OpenCVDecode, PklLoader,
+            FrameSelector, ShardFrameSelector)
@@ -1,5 +1,4 @@
 """raw frames dataset"""
-import copy
 import os.path as osp
 
 from codes.datasets.base import BaseDataset
@@ -27,6 +26,17 @@ class RawFramesDataset(BaseDataset):
     some/directory-6 121 3
     ```
 
+    Frames extracted with a stride (`data_process/video2image.py --stride`)
+    have a 4th column, the stride, after the number of stored frames. The
+    total frames of the video is then `stride` times the stored frames, so
+    that the frames are sampled on the timeline of the video and the frame
+    indices are remapped to the stored frames by `FrameSelector`
+    ("frame_stride").
+
+    ```
+    some/directory-1 41 1 4
+    ```
+
     Args:
         ann_file (str): Path to the annotation file.
         pipeline (list[dict | callable]): A sequence of data transforms.
@@ -45,25 +55,31 @@ class RawFramesDataset(BaseDataset):
                                                data_root, test_mode, modality)
         self.filename_tmpl = filename_tmpl
 
+    @staticmethod
+    def frame_info(filename, total_frames, label, stride=1):
+        """Info of a video whose frames are stored with a stride."""
+        info = dict(filename=filename, label=int(label))
+        stride = int(stride)
+        info['total_frames'] = int(total_frames) * stride
+        if stride > 1:
+            info['frame_stride'] = stride
+        return info
+
     def load_annotations(self):
         """load annotations"""
         video_infos = []
         with open(self.ann_file, 'r') as fin:
             for line in fin:
-                frame_dir, total_frames, label = line.split(' ')
+                items = line.split()
+                frame_dir, total_frames, label = items[:3]
                 if self.data_root is not None:
                     frame_dir = osp.join(self.data_root, frame_dir)
-                video_infos.append(
-                    dict(
-                        filename=frame_dir,
-                        total_frames=int(total_frames),
-                        label=int(label)))
+                video_infos.append(self.frame_info(
+                    frame_dir, total_frames, label, *items[3:]))
         return video_infos
 
-    def prepare_frames(self, idx):
-        """prepare_frames"""
-        results = copy.deepcopy(self.video_infos[idx])
+    def prepare_results(self, idx):
+        """prepare_results"""
+        results = super(RawFramesDataset, self).prepare_results(idx)
         results['filename_tmpl'] = self.filename_tmpl
-        results['modality'] = self.modality
-        results['test_mode'] = self.test_mode
-        return self.pipeline(results)
+        return results
@@ -0,0 +1,50 @@
+"""frame shard dataset"""
+import os.path as osp
+
+from codes.datasets.builder import DATASETS
+from codes.datasets.rawframes_dataset import RawFramesDataset
+
+
+@DATASETS.register_module
+class ShardRawFramesDataset(RawFramesDataset):
+    """RawFrames dataset whose frames are packed into frame shards.
+
+    The frames of every video are stored in a shard file (see
+    `data_process/gen_frame_shards.py`), so a clip is read with a single
+    file handle instead of one open per frame. Use it together with the
+    `ShardFrameSelector` loading pipeline.
+
+    The ann_file is a text file with multiple lines, and each line indicates
+    the shard path, the key of the video inside the shard, total frames of
+    the video and the label of a video, which are split with a whitespace.
+    Example of a annotation file:
+
+    ```
+    shard_00000.shard some/directory-1 163 1
+    shard_00000.shard some/directory-2 122 1
+    shard_00001.shard some/directory-3 258 2
+    ```
+
+    Frames extracted with a stride have a 5th column, the stride (see
+    `RawFramesDataset`).
+
+    Args:
+        ann_file (str): Path to the annotation file.
+        pipeline (list[dict | callable]): A sequence of data transforms.
+        data_root (str): Path to a directory where shards are held.
+    """
+
+    def load_annotations(self):
+        """load annotations"""
+        video_infos = []
+        with open(self.ann_file, 'r') as fin:
+            for line in fin:
+                items = line.split()
+                shard_path, key, total_frames, label = items[:4]
+                if self.data_root is not None:
+                    shard_path = osp.join(self.data_root, shard_path)
+                info = self.frame_info(shard_path, total_frames, label,
+                                       *items[4:])
+                info['shard_key'] = key
+                video_infos.append(info)
+        return video_infos
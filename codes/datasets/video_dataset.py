@@ -1,6 +1,8 @@
 """video dataset"""
 import os.path as osp
-import copy
+
+import numpy as np
+
 from codes.datasets.base import BaseDataset
 from codes.datasets.builder import DATASETS
 import random
@@ -21,11 +23,24 @@ class VideoDataset(BaseDataset):
     some/path/004.mp4 3
     some/path/005.mp4 3
     ```
+    If a metadata index of the videos (built by
+    `data_process/gen_videos_info.py --info meta`) is found, the frame
+    count, fps, resolution, duration, keyframe count, codec, GOP size and
+    bit rate of every video are added to its info, so `SampleFrames` never
+    opens a video just to count its frames.
+    If a keyframe index (`--info keyframes`) is found, the frame indices and
+    PTS of the keyframes of the video are passed to the decoder as
+    "key_frame_inds" and "key_pts", so that it seeks to the keyframe
+    preceding each sampled frame and decodes accurately from there.
     Args:
         ann_file (str): Path to the annotation file.
         pipeline (list[dict | callable]): A sequence of data transforms.
         data_root (str): Path to a directory where videos are held.
         num_retries (int): number of retries.
+        meta_file (str): Path to the metadata index. Default:
+            "{ann_file}.meta.npz" if it exists.
+        keyframe_file (str): Path to the keyframe index. Default:
+            "{ann_file}.keyframes.npz" if it exists.
     """
 
     def __init__(self,
@@ -34,13 +49,62 @@ class VideoDataset(BaseDataset):
                  data_root=None,
                  test_mode=False,
                  num_retries=10,
-                 modality=None):
+                 modality=None,
+                 meta_file=None,
+                 keyframe_file=None):
+        self.meta_file = meta_file
+        self.keyframe_file = keyframe_file
+        self._keyframes = None
         super(VideoDataset, self).__init__(ann_file, pipeline,
                                            data_root, test_mode, modality)
         self._num_retries = num_retries
 
+    def load_meta(self):
+        """Load the metadata index as a dict of filename -> meta dict."""
+        meta_file = self.meta_file
+        if meta_file is None:
+            meta_file = self.ann_file + '.meta.npz'
+            if not osp.exists(meta_file):
+                return dict()
+        meta = np.load(meta_file)
+        video_metas = dict()
+        for i, filename in enumerate(meta['filename'].tolist()):
+            if meta['num_frames'][i] <= 0:
+                # failed to probe
+                continue
+            video_metas[filename] = dict(
+                total_frames=int(meta['num_frames'][i]),
+                fps=float(meta['fps'][i]),
+                resolution=(int(meta['height'][i]), int(meta['width'][i])),
+                duration=float(meta['duration'][i]),
+                num_keyframes=int(meta['num_keyframes'][i]))
+            # columns of the newer indexes
+            if 'codec' in meta.files:
+                video_metas[filename].update(
+                    codec=str(meta['codec'][i]),
+                    gop_size=int(meta['gop_size'][i]),
+                    bit_rate=int(meta['bit_rate'][i]))
+        return video_metas
+
+    def load_keyframes(self):
+        """Load the keyframe index as a dict of filename -> row, the arrays
+        of the index are kept by the dataset."""
+        keyframe_file = self.keyframe_file
+        if keyframe_file is None:
+            keyframe_file = self.ann_file + '.keyframes.npz'
+            if not osp.exists(keyframe_file):
+                return dict()
+        index = np.load(keyframe_file)
+        offsets = index['offsets']
+        self._keyframes = (offsets, index['key_frame_inds'],
+                           index['key_pts'])
+        return {filename: i for i, filename in enumerate(
+            index['filename'].tolist()) if offsets[i + 1] > offsets[i]}
+
     def load_annotations(self):
         """load_annotations"""
+        video_metas = self.load_meta()
+        keyframe_rows = self.load_keyframes()
         video_infos = []
         with open(self.ann_file, 'r') as fin:
             for line in fin:
@@ -49,24 +113,39 @@ class VideoDataset(BaseDataset):
                     filename, label = line_split[0], 0
                 else:
                     filename, label = line.strip().split()
+                video_info = dict(video_metas.get(filename, {}))
+                if filename in keyframe_rows:
+                    video_info['keyframe_row'] = keyframe_rows[filename]
                 if self.data_root is not None:
                     filename = osp.join(self.data_root, filename)
-                video_infos.append(dict(filename=filename, label=int(label)))
+                video_info.update(filename=filename, label=int(label))
+                video_infos.append(video_info)
         return video_infos
 
+    def prepare_results(self, idx):
+        """prepare_results"""
+        results = super(VideoDataset, self).prepare_results(idx)
+        results['vid_idx'] = idx
+        row = results.pop('keyframe_row', None)
+        if row is not None:
+            offsets, key_frame_inds, key_pts = self._keyframes
+            results['key_frame_inds'] = \
+                key_frame_inds[offsets[row]:offsets[row + 1]]
+            results['key_pts'] = key_pts[offsets[row]:offsets[row + 1]]
+        return results
+
     def prepare_frames(self, idx):
         """get frames"""
         for i_try in range(self._num_retries):
-            results = copy.deepcopy(self.video_infos[idx])
-            results['modality'] = self.modality
-            results['test_mode'] = self.test_mode
-            results['vid_idx'] = idx
+            results = self.prepare_results(idx)
             data = self.pipeline(results)
             if data is None:
                 print("Failed to decode video idx {} from {}; trial {}".format(
                     idx, results['filename'], i_try)
                 )
                 idx = random.randint(0, len(self.video_infos))
+                if self.telemetry is not None:
+                    self.telemetry.retry()
                 continue
             return data
         raise RuntimeError(
@@ -0,0 +1,138 @@
+"""compact video infos"""
+import numpy as np
+
+
+class VideoInfos(object):
+    """Column store of the video infos of a dataset.
+
+    A list of hundreds of thousands of dicts is slowly copied into every
+    forked dataloader worker, since touching the refcount of an object
+    dirties its page. Here every field is stored as a column in a few numpy
+    arrays instead: strings are packed into one utf-8 byte buffer indexed by
+    an offsets array, integers and floats into int32/int64/float64 arrays and
+    tuples of numbers into 2-D arrays. Indexing returns a fresh dict, so the
+    result can be modified by the pipeline without any copy.
+
+    Fields missing in some of the infos are kept in a mask and left out of
+    the dicts of those videos.
+
+    Example:
+        >>> video_infos = VideoInfos([dict(filename='a', label=1),
+        >>>                           dict(filename='b', label=2)])
+        >>> video_infos[1]
+        {'filename': 'b', 'label': 2}
+
+    Args:
+        infos (iterable[dict]): Infos of the videos.
+    """
+
+    def __init__(self, infos):
+        values = dict()
+        num_videos = 0
+        for i, info in enumerate(infos):
+            for key, value in info.items():
+                if key not in values:
+                    values[key] = [None] * i
+                values[key].append(value)
+            for key in values:
+                if len(values[key]) == i:
+                    values[key].append(None)
+            num_videos = i + 1
+        self._len = num_videos
+        self._columns = dict()
+        for key, column in values.items():
+            self._columns[key] = self._pack(key, column)
+
+    @staticmethod
+    def _kind(key, value):
+        if isinstance(value, str):
+            return 'str'
+        if isinstance(value, (bool, np.bool_)):
+            return 'bool'
+        if isinstance(value, (int, np.integer)):
+            return 'int'
+        if isinstance(value, (float, np.floating)):
+            return 'float'
+        if isinstance(value, tuple):
+            return 'tuple'
+        raise TypeError('Unsupported type {} of field {}'.format(
+            type(value), key))
+
+    @classmethod
+    def _pack(cls, key, column):
+        """Pack a list of values into (kind, data, mask).
+
+        The type of a column is inferred from all its values: booleans,
+        integers and floats are promoted to the widest of them, other mixed
+        types raise a TypeError.
+        """
+        mask = np.array([v is not None for v in column], dtype=bool)
+        present = [v for v in column if v is not None]
+        if mask.all():
+            mask = None
+        kinds = set(cls._kind(key, v) for v in present) or {'int'}
+        if len(kinds) > 1 and not kinds <= {'bool', 'int', 'float'}:
+            raise TypeError('Field {} mixes the types {}'.format(
+                key, ', '.join(sorted(kinds))))
+        if kinds == {'str'}:
+            encoded = [(v or '').encode('utf-8') for v in column]
+            offsets = np.zeros(len(column) + 1, dtype=np.int64)
+            np.cumsum([len(v) for v in encoded], out=offsets[1:])
+            data = (np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets)
+            return 'str', data, mask
+        if kinds == {'tuple'}:
+            lengths = set(len(v) for v in present)
+            if len(lengths) > 1:
+                raise TypeError('Field {} mixes tuples of lengths {}'.format(
+                    key, sorted(lengths)))
+            kind, dtype, fill = 'tuple', None, (0, ) * lengths.pop()
+        elif 'float' in kinds:
+            kind, dtype, fill = 'float', np.float64, 0.
+        elif 'int' in kinds:
+            kind, dtype, fill = 'int', np.int64, 0
+        else:
+            kind, dtype, fill = 'bool', bool, False
+        data = np.array([fill if v is None else v for v in column],
+                        dtype=dtype)
+        if data.dtype.kind == 'i' and (
+                data.size == 0 or (data.min() >= np.iinfo(np.int32).min and
+                                   data.max() <= np.iinfo(np.int32).max)):
+            data = data.astype(np.int32)
+        return kind, data, mask
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += self._len
+        if not 0 <= idx < self._len:
+            raise IndexError('video index {} out of range'.format(idx))
+        info = dict()
+        for key, (kind, data, mask) in self._columns.items():
+            if mask is not None and not mask[idx]:
+                continue
+            if kind == 'str':
+                buf, offsets = data
+                info[key] = buf[offsets[idx]:offsets[idx + 1]].tobytes(
+                    ).decode('utf-8')
+            elif kind == 'tuple':
+                info[key] = tuple(data[idx].tolist())
+            else:
+                info[key] = data[idx].item()
+        return info
+
+    def __iter__(self):
+        for idx in range(self._len):
+            yield self[idx]
+
+    def keys(self):
+        """Names of the fields."""
+        return list(self._columns.keys())
+
+    def column(self, key):
+        """Return the array of a numeric field, e.g. all the labels."""
+        kind, data, _ = self._columns[key]
+        if kind == 'str':
+            raise TypeError('Field {} is a string field'.format(key))
+        return data
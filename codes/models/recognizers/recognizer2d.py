@@ -6,7 +6,12 @@ from .base import BaseRecognizer
 
 @RECOGNIZERS.register_module
 class Recognizer2D(BaseRecognizer):
-    """class for recognizer2d"""
+    """class for recognizer2d
+
+    With `train_cfg=dict(clips_per_video=n)`, a training sample holds the
+    frames of n clips (`Compose(augment_clips=True)`), each clip is
+    classified and counted in the loss on its own.
+    """
     def __init__(self,
                  modality='RGB',
                  backbone='BNInception',
@@ -15,8 +20,9 @@ class Recognizer2D(BaseRecognizer):
                  module_cfg=None,
                  nonlocal_cfg=None,
                  train_cfg=None,
-                 test_cfg=None):
-        super(Recognizer2D, self).__init__(backbone, cls_head)
+                 test_cfg=None,
+                 img_norm_cfg=None):
+        super(Recognizer2D, self).__init__(backbone, cls_head, img_norm_cfg)
         self.fcn_testing = fcn_testing
         self.modality = modality
         self.train_cfg = train_cfg
@@ -133,7 +139,9 @@ class Recognizer2D(BaseRecognizer):
         """train"""
         #  [B S C H W]
         #  [BS C H W]
-        num_batch = imgs.shape[0]
+        imgs = self.normalize(imgs)
+        clips_per_video = (self.train_cfg or {}).get('clips_per_video', 1)
+        num_batch = imgs.shape[0] * clips_per_video
         imgs = imgs.reshape((-1, self.in_channels) + imgs.shape[3:])
         num_seg = imgs.shape[0] // num_batch
 
@@ -142,7 +150,7 @@ class Recognizer2D(BaseRecognizer):
         if self.with_cls_head:
             temporal_pool = imgs.shape[0] // x.shape[0]
             cls_score = self.cls_head(x, num_seg // temporal_pool)
-            gt_label = labels.squeeze()
+            gt_label = self.clip_labels(labels, clips_per_video)
             loss_cls = self.cls_head.loss(cls_score, gt_label)
             losses.update(loss_cls)
 
@@ -152,6 +160,7 @@ class Recognizer2D(BaseRecognizer):
         """test"""
         #  imgs: [B tem*crop*clip C H W]
         #  imgs: [B*tem*crop*clip C H W]
+        imgs = self.normalize(imgs)
         num_batch = imgs.shape[0]
         imgs = imgs.reshape((-1, self.in_channels) + imgs.shape[3:])
         num_frames = imgs.shape[0] // num_batch
@@ -11,8 +11,9 @@ class Recognizer3D(BaseRecognizer):
                  cls_head,
                  fcn_testing=False,
                  train_cfg=None,
-                 test_cfg=None):
-        super(Recognizer3D, self).__init__(backbone, cls_head)
+                 test_cfg=None,
+                 img_norm_cfg=None):
+        super(Recognizer3D, self).__init__(backbone, cls_head, img_norm_cfg)
         self.fcn_testing = fcn_testing
         self.train_cfg = train_cfg
         self.test_cfg = test_cfg
@@ -21,13 +22,15 @@ class Recognizer3D(BaseRecognizer):
         """train"""
         #  imgs: [B clips C T H W]
         #  imgs: [Bxclips C T H W]
+        imgs = self.normalize(imgs)
+        clips_per_video = imgs.shape[1]
         imgs = imgs.reshape((-1, ) + imgs.shape[2:])
 
         x = self.extract_feat(imgs)
         losses = dict()
         if self.with_cls_head:
             cls_score = self.cls_head(x)
-            gt_label = labels.squeeze()
+            gt_label = self.clip_labels(labels, clips_per_video)
             loss_cls = self.cls_head.loss(cls_score, gt_label)
             losses.update(loss_cls)
 
@@ -37,6 +40,7 @@ class Recognizer3D(BaseRecognizer):
         """test"""
         #  imgs: [B Clips C T H W]
         #  imgs: [BxClips C T H W]
+        imgs = self.normalize(imgs)
         imgs = imgs.reshape((-1, ) + imgs.shape[2:])
 
         x = self.extract_feat(imgs)
@@ -1,6 +1,9 @@
 """utils"""
 from .checkpoint import load_checkpoint, save_checkpoint
 from .file_client import BaseStorageBackend, FileClient
+from .frame_cache import SharedFrameCache
+from .frame_shard import FrameShardReader, FrameShardWriter
+from .handle_cache import HandleCache
 from .logger import get_root_logger
 from .misc import get_flop_stats
 from .registry import Registry, build_from_cfg
@@ -8,6 +11,8 @@ from .registry import Registry, build_from_cfg
 __all__ = [
     'build_from_cfg', 'Registry',
     'BaseStorageBackend', 'FileClient',
+    'FrameShardReader', 'FrameShardWriter', 'SharedFrameCache',
+    'HandleCache',
     'get_root_logger',
     'load_checkpoint', 'save_checkpoint',
     'get_flop_stats'
@@ -0,0 +1,189 @@
+"""shared memory frame cache"""
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+_MAGIC = b'MVFCACHE'
+# magic, num_sets, ways, slot_bytes, hits, misses
+_HEADER = struct.Struct('<8sIIQQQ')
+_HEADER_BYTES = 64
+_META_DTYPE = np.dtype([('key', '<u8'), ('tick', '<u8'), ('nbytes', '<u4'),
+                        ('h', '<u2'), ('w', '<u2'), ('c', '<u2'),
+                        ('pad', '<u2', (3, ))])
+
+
+class SharedFrameCache(object):
+    """LRU cache of decoded uint8 frames living in POSIX shared memory.
+
+    The cache is a file under `/dev/shm`, so every process on the node that
+    opens a cache with the same `name` (all dataloader workers of all ranks)
+    shares it. The memory is split into fixed-size slots organised as a
+    set-associative table: a key is hashed to one set of `ways` slots and the
+    least recently used slot of the set is evicted on insertion. Each set is
+    guarded by a byte-range lock, so lookups of different sets never block
+    each other.
+
+    Frames larger than `slot_bytes` are not cached.
+
+    Attributes:
+        name (str): Name of the shared memory segment.
+        capacity_mb (int): Byte budget of the cached frames in MB.
+        slot_bytes (int): Size of a slot, i.e. the largest cacheable frame.
+        ways (int): Number of slots per set.
+        hits (int): Number of hits in this process.
+        misses (int): Number of misses in this process.
+    """
+
+    def __init__(self, name='frames', capacity_mb=4096,
+                 slot_bytes=512 * 1024, ways=8, shm_dir='/dev/shm'):
+        self.name = name
+        self.capacity_mb = capacity_mb
+        self.slot_bytes = slot_bytes
+        self.ways = ways
+        self.num_sets = max(
+            1, capacity_mb * 1024 * 1024 // (slot_bytes * ways))
+        self.filepath = os.path.join(shm_dir, 'mvfnet_cache_' + name)
+        self.hits = 0
+        self.misses = 0
+        self._reported = (0, 0)
+        self._thread_lock = threading.Lock()
+
+        num_slots = self.num_sets * ways
+        self._meta_offset = _HEADER_BYTES
+        self._data_offset = self._meta_offset + \
+            num_slots * _META_DTYPE.itemsize
+        # align slots to pages
+        self._data_offset = (self._data_offset + mmap.PAGESIZE - 1) \
+            // mmap.PAGESIZE * mmap.PAGESIZE
+        total_bytes = self._data_offset + num_slots * slot_bytes
+
+        self._fd = os.open(self.filepath, os.O_RDWR | os.O_CREAT, 0o666)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size == 0:
+                os.ftruncate(self._fd, total_bytes)
+                os.pwrite(self._fd, _HEADER.pack(
+                    _MAGIC, self.num_sets, ways, slot_bytes, 0, 0), 0)
+            magic, num_sets, cur_ways, cur_slot_bytes, _, _ = _HEADER.unpack(
+                os.pread(self._fd, _HEADER.size, 0))
+            if (magic, num_sets, cur_ways, cur_slot_bytes) != (
+                    _MAGIC, self.num_sets, ways, slot_bytes):
+                raise ValueError(
+                    'Shared frame cache {} exists with another layout, '
+                    'remove it or use another name'.format(self.filepath))
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._mmap = mmap.mmap(self._fd, total_bytes)
+        self._meta = np.frombuffer(
+            self._mmap, dtype=_META_DTYPE, count=num_slots,
+            offset=self._meta_offset).reshape(self.num_sets, ways)
+        self._data = np.frombuffer(
+            self._mmap, dtype=np.uint8, count=num_slots * slot_bytes,
+            offset=self._data_offset).reshape(num_slots, slot_bytes)
+
+    @staticmethod
+    def _hash(key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+        # 0 marks an empty slot
+        return int.from_bytes(digest, 'little') or 1
+
+    def _lock_set(self, set_idx, op):
+        fcntl.lockf(self._fd, op, self.ways * _META_DTYPE.itemsize,
+                    self._meta_offset + set_idx * self.ways *
+                    _META_DTYPE.itemsize)
+
+    def get(self, key):
+        """Return a copy of the cached frame of `key`, or None."""
+        hkey = self._hash(key)
+        set_idx = hkey % self.num_sets
+        img = None
+        with self._thread_lock:
+            self._lock_set(set_idx, fcntl.LOCK_EX)
+            try:
+                meta = self._meta[set_idx]
+                ways = np.nonzero((meta['key'] == hkey) &
+                                  (meta['nbytes'] > 0))[0]
+                if len(ways) > 0:
+                    way = ways[0]
+                    entry = meta[way]
+                    shape = (entry['h'], entry['w'], entry['c']) \
+                        if entry['c'] > 0 else (entry['h'], entry['w'])
+                    slot = self._data[set_idx * self.ways + way]
+                    img = slot[:entry['nbytes']].reshape(shape).copy()
+                    meta['tick'][way] = time.monotonic_ns()
+            finally:
+                self._lock_set(set_idx, fcntl.LOCK_UN)
+            if img is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return img
+
+    def put(self, key, img):
+        """Insert the uint8 frame `img`, evicting the LRU slot of its set."""
+        if img.dtype != np.uint8 or img.nbytes > self.slot_bytes or \
+                img.ndim not in (2, 3):
+            return False
+        hkey = self._hash(key)
+        set_idx = hkey % self.num_sets
+        with self._thread_lock:
+            self._lock_set(set_idx, fcntl.LOCK_EX)
+            try:
+                meta = self._meta[set_idx]
+                if np.any((meta['key'] == hkey) & (meta['nbytes'] > 0)):
+                    return True
+                empty = np.nonzero(meta['nbytes'] == 0)[0]
+                way = empty[0] if len(empty) > 0 else np.argmin(meta['tick'])
+                meta['nbytes'][way] = 0
+                slot = self._data[set_idx * self.ways + way]
+                slot[:img.nbytes] = np.ascontiguousarray(img).reshape(-1)
+                meta['key'][way] = hkey
+                meta['tick'][way] = time.monotonic_ns()
+                meta['h'][way] = img.shape[0]
+                meta['w'][way] = img.shape[1]
+                meta['c'][way] = img.shape[2] if img.ndim == 3 else 0
+                meta['nbytes'][way] = img.nbytes
+            finally:
+                self._lock_set(set_idx, fcntl.LOCK_UN)
+        return True
+
+    def stats(self):
+        """Return (hits, misses) of this process and of the whole node.
+
+        The node totals are the sums reported by all processes so far.
+        """
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, _HEADER_BYTES, 0)
+        try:
+            header = _HEADER.unpack(os.pread(self._fd, _HEADER.size, 0))
+            total_hits = header[4] + self.hits - self._reported[0]
+            total_misses = header[5] + self.misses - self._reported[1]
+            os.pwrite(self._fd, _HEADER.pack(
+                *header[:4], total_hits, total_misses), 0)
+            self._reported = (self.hits, self.misses)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, _HEADER_BYTES, 0)
+        return dict(hits=self.hits, misses=self.misses,
+                    total_hits=total_hits, total_misses=total_misses)
+
+    def close(self):
+        """Unmap the segment of this process, it stays on the node."""
+        if self._mmap is not None:
+            # the views of the mapping keep it from closing
+            self._meta = None
+            self._data = None
+            self._mmap.close()
+            self._mmap = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def unlink(self):
+        """Remove the shared memory segment from the node."""
+        if os.path.exists(self.filepath):
+            os.remove(self.filepath)
@@ -0,0 +1,231 @@
+"""frame shard"""
+import mmap
+import os
+import pickle
+import struct
+
+import numpy as np
+
+SHARD_MAGIC = b'MVFS'
+SHARD_VERSION = 1
+# key of the video in single-video containers (e.g. converted pkl files)
+SINGLE_VIDEO_KEY = ''
+# magic, version, reserved, index offset, index size
+_HEADER = struct.Struct('<4sHHQQ')
+_ENTRY = struct.Struct('<HI')
+
+
+def _pack_index(entries):
+    """Serialize [(key, offsets)] into the index blob."""
+    blobs = [struct.pack('<I', len(entries))]
+    for key, offsets in entries:
+        key = key.encode('utf-8')
+        blobs.append(_ENTRY.pack(len(key), len(offsets) - 1))
+        blobs.append(key)
+    for _, offsets in entries:
+        blobs.append(np.asarray(offsets, dtype='<u8').tobytes())
+    return b''.join(blobs)
+
+
+def _unpack_index(buf):
+    """Parse the index blob into an ordered dict of key -> offsets."""
+    num_videos, = struct.unpack_from('<I', buf, 0)
+    pos = 4
+    keys = []
+    for _ in range(num_videos):
+        key_len, num_frames = _ENTRY.unpack_from(buf, pos)
+        pos += _ENTRY.size
+        keys.append((bytes(buf[pos:pos + key_len]).decode('utf-8'),
+                     num_frames))
+        pos += key_len
+    index = dict()
+    for key, num_frames in keys:
+        index[key] = np.frombuffer(
+            buf, dtype='<u8', count=num_frames + 1, offset=pos)
+        pos += (num_frames + 1) * 8
+    return index
+
+
+class FrameShardWriter(object):
+    """Pack encoded frames of one or more videos into a single shard file.
+
+    A shard is laid out as a fixed-size header, the concatenated encoded
+    frames and an index mapping each video key to the byte offsets of its
+    frames. The file is written to a temporary path and moved into place on
+    `close()`, so readers never see a partially written shard.
+
+    Example:
+        >>> with FrameShardWriter('shard_00000.shard') as writer:
+        >>>     writer.add_video('class/video_1', frame_bytes_list)
+
+    Attributes:
+        filepath (str): Destination path of the shard.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self._tmp_path = '{}.{}.tmp'.format(filepath, os.getpid())
+        self._f = open(self._tmp_path, 'wb')
+        self._f.write(_HEADER.pack(SHARD_MAGIC, SHARD_VERSION, 0, 0, 0))
+        self._entries = []
+
+    def add_video(self, key, frames):
+        """Append the encoded frames (iterable of bytes) of one video."""
+        offsets = [self._f.tell()]
+        for buf in frames:
+            self._f.write(buf)
+            offsets.append(self._f.tell())
+        self._entries.append((key, offsets))
+        return len(offsets) - 1
+
+    def close(self):
+        index = _pack_index(self._entries)
+        index_offset = self._f.tell()
+        self._f.write(index)
+        self._f.seek(0)
+        self._f.write(_HEADER.pack(SHARD_MAGIC, SHARD_VERSION, 0,
+                                   index_offset, len(index)))
+        self._f.close()
+        os.replace(self._tmp_path, self.filepath)
+
+    def abort(self):
+        self._f.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class FrameShardReader(object):
+    """Random access reader of a frame shard.
+
+    The index is parsed once when the reader is created. Frames are read
+    with `os.pread` on a single unbuffered file handle; the requested byte
+    ranges are sorted and neighbouring ranges separated by at most `max_gap`
+    bytes are merged, so a clip is usually served by one read. With
+    `use_mmap` the shard is memory-mapped instead and the returned frames
+    are views of the mapping, so only the pages of sampled frames are read.
+
+    Attributes:
+        filepath (str): Path of the shard.
+        max_gap (int): Largest gap (in bytes) between two requested frames
+            that is read through instead of issuing another read.
+        use_mmap (bool): Whether to memory-map the shard.
+    """
+
+    def __init__(self, filepath, max_gap=256 * 1024, use_mmap=False):
+        self.filepath = filepath
+        self.max_gap = max_gap
+        self.use_mmap = use_mmap
+        self._mmap = None
+        self._fd = os.open(filepath, os.O_RDONLY)
+        try:
+            header = os.pread(self._fd, _HEADER.size, 0)
+            magic, version, _, index_offset, index_size = _HEADER.unpack(
+                header)
+            if magic != SHARD_MAGIC:
+                raise IOError('{} is not a frame shard'.format(filepath))
+            if version > SHARD_VERSION:
+                raise IOError(
+                    'Unsupported shard version {} in {}'.format(
+                        version, filepath))
+            if use_mmap:
+                self._mmap = mmap.mmap(self._fd, 0, access=mmap.ACCESS_READ)
+                # a copy, views of the mapping would keep it from closing
+                self.index = _unpack_index(
+                    self._mmap[index_offset:index_offset + index_size])
+            else:
+                self.index = _unpack_index(
+                    os.pread(self._fd, index_size, index_offset))
+        except Exception:
+            self.close()
+            raise
+
+    def keys(self):
+        return list(self.index.keys())
+
+    def num_frames(self, key):
+        return len(self.index[key]) - 1
+
+    def get_frames(self, key, frame_inds):
+        """Read the encoded frames of `key` at `frame_inds` (0-based).
+
+        Returns:
+            list[memoryview]: Encoded frames in the order of `frame_inds`.
+        """
+        offsets = self.index[key]
+        frame_inds = np.asarray(frame_inds, dtype=np.int64)
+        if self._mmap is not None:
+            buf = memoryview(self._mmap)
+            return [buf[offsets[idx]:offsets[idx + 1]] for idx in frame_inds]
+
+        uniq_inds, inverse = np.unique(frame_inds, return_inverse=True)
+        starts = offsets[uniq_inds].astype(np.int64)
+        ends = offsets[uniq_inds + 1].astype(np.int64)
+
+        bufs = [None] * len(uniq_inds)
+        run_start = 0
+        for i in range(1, len(uniq_inds) + 1):
+            if i < len(uniq_inds) and starts[i] - ends[i - 1] <= self.max_gap:
+                continue
+            base = starts[run_start]
+            chunk = memoryview(
+                os.pread(self._fd, int(ends[i - 1] - base), int(base)))
+            for j in range(run_start, i):
+                bufs[j] = chunk[starts[j] - base:ends[j] - base]
+            run_start = i
+        return [bufs[i] for i in inverse]
+
+    def close(self):
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # frames are still referenced, unmapped once collected
+                pass
+            self._mmap = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def is_frame_shard(filepath):
+    """Check whether `filepath` is a frame shard (or a legacy file)."""
+    with open(filepath, 'rb') as f:
+        return f.read(len(SHARD_MAGIC)) == SHARD_MAGIC
+
+
+def convert_pickle_to_shard(pkl_path, out_path=None):
+    """Convert a legacy pkl (a pickled list of encoded frames) to a shard.
+
+    The frames are stored under `SINGLE_VIDEO_KEY`. The conversion is done
+    in place when `out_path` is None; the shard is moved over the pickle
+    atomically, so concurrent readers see either file completely.
+
+    Returns:
+        list[bytes]: The frames of the legacy pickle.
+    """
+    with open(pkl_path, 'rb') as f:
+        frames = pickle.load(f)
+    with FrameShardWriter(out_path or pkl_path) as writer:
+        writer.add_video(SINGLE_VIDEO_KEY, frames)
+    return frames
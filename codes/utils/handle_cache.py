@@ -0,0 +1,121 @@
+"""per-process cache of open handles"""
+import os
+import resource
+from collections import OrderedDict
+
+
+def _num_open_fds():
+    """Number of open file descriptors of this process, None if unknown."""
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return None
+
+
+class HandleCache(object):
+    """LRU cache of open handles (video readers, shard readers) keyed by
+    filename, local to a process.
+
+    A transform holding a cache is copied into every dataloader worker, the
+    handles are only opened in the process using them: after a fork (or
+    unpickling) the cache starts empty, the handles of the parent are left
+    to it.
+
+    At most `max_open` handles are kept. Before a handle is opened, least
+    recently used handles are also closed while the process has more than
+    `max_fds` open file descriptors, so that a cache never exhausts
+    `RLIMIT_NOFILE` (raised in `build_loader.py`). The eviction hooks are
+    called with (key, handle) before a handle is closed.
+
+    Attributes:
+        max_open (int): Max number of open handles, 0 disables the cache.
+        max_fds (int): Max number of file descriptors of the process.
+            Default: half of the soft `RLIMIT_NOFILE`, read in the process.
+        close (callable): Closes a handle. Default: `handle.close()` or
+            `handle.release()` (OpenCV) if it exists, else the handle is
+            left to the garbage collector.
+    """
+
+    def __init__(self, max_open=16, max_fds=None, close=None):
+        self.max_open = max_open
+        self.max_fds = max_fds
+        self.close = close
+        self.evict_hooks = []
+        self._handles = OrderedDict()
+        self._pid = os.getpid()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_handles'] = OrderedDict()
+        return state
+
+    def __len__(self):
+        return len(self._handles)
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            self._handles = OrderedDict()
+            self._pid = os.getpid()
+
+    def add_evict_hook(self, hook):
+        """Call `hook(key, handle)` before a handle is closed."""
+        self.evict_hooks.append(hook)
+
+    def _close(self, handle):
+        if self.close is not None:
+            self.close(handle)
+        elif hasattr(handle, 'close'):
+            handle.close()
+        elif hasattr(handle, 'release'):
+            handle.release()
+
+    def _evict(self, key, handle):
+        for hook in self.evict_hooks:
+            hook(key, handle)
+        self._close(handle)
+
+    def _fd_budget(self):
+        if self.max_fds is None:
+            soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+            self.max_fds = soft // 2 if soft != resource.RLIM_INFINITY \
+                else 65536
+        return self.max_fds
+
+    def get(self, key, open_fn):
+        """Return the handle of `key`, opened by `open_fn()` on a miss.
+
+        Without caching (`max_open` is 0), the caller owns the handle.
+        """
+        if self.max_open <= 0:
+            return open_fn()
+        self._check_pid()
+        handle = self._handles.pop(key, None)
+        if handle is None:
+            while len(self._handles) >= self.max_open:
+                self._evict(*self._handles.popitem(last=False))
+            num_fds = _num_open_fds()
+            while self._handles and num_fds is not None and \
+                    num_fds >= self._fd_budget():
+                self._evict(*self._handles.popitem(last=False))
+                num_fds = _num_open_fds()
+            handle = open_fn()
+        self._handles[key] = handle
+        return handle
+
+    def discard(self, key):
+        """Close the handle of `key`, e.g. after a decoding error."""
+        self._check_pid()
+        handle = self._handles.pop(key, None)
+        if handle is not None:
+            self._evict(key, handle)
+
+    def release(self, key, handle):
+        """Done with `handle`: close it unless it is cached."""
+        if self.max_open <= 0 or self._handles.get(key) is not handle:
+            self._close(handle)
+
+    def clear(self):
+        """Close all the handles."""
+        self._check_pid()
+        while self._handles:
+            self._evict(*self._handles.popitem(last=False))
@@ -0,0 +1,123 @@
+"""Pack extracted frame directories into indexed frame shards
+
+example command line:
+python gen_frame_shards.py ../datalist/kinetics400/train_ffmpeg_fps30.txt \
+    /data/k400_train_rgb_ffmpeg_fps30 /data/k400_train_rgb_shards \
+    --videos_per_shard 64
+"""
+import argparse
+import multiprocessing
+import os
+import os.path as osp
+import sys
+from functools import partial
+
+sys.path.insert(0, osp.join(osp.dirname(osp.abspath(__file__)), '..'))
+from codes.utils.frame_shard import FrameShardWriter  # noqa: E402
+
+n_thread = 50
+
+
+def parse_args():
+    """parse args"""
+    parser = argparse.ArgumentParser(description='Build frame shards')
+    parser.add_argument('ann_file', type=str,
+                        help='rawframes annotation, [dir, #frames, label]')
+    parser.add_argument('frame_path', type=str,
+                        help='root directory for the frames')
+    parser.add_argument('out_path', type=str,
+                        help='root directory for the out shards')
+    parser.add_argument('--out_ann', type=str, default=None,
+                        help='out path for the shard annotation, '
+                        'default: OUT_PATH/<basename of ANN_FILE>')
+    parser.add_argument('--videos_per_shard', type=int, default=1)
+    parser.add_argument('--filename_tmpl', type=str, default='img_{:05}.jpg')
+    parser.add_argument('--modality', type=str, default='RGB',
+                        choices=['RGB', 'Flow'])
+    args = parser.parse_args()
+    return args
+
+
+def read_frames(frame_dir, total_frames, filename_tmpl, flow_axis=None):
+    """Read the encoded frames of a video, missing frames reuse the last."""
+    frames = []
+    for idx in range(1, total_frames + 1):
+        if flow_axis is None:
+            filepath = osp.join(frame_dir, filename_tmpl.format(idx))
+        else:
+            filepath = osp.join(frame_dir,
+                                filename_tmpl.format(flow_axis, idx))
+        try:
+            with open(filepath, 'rb') as f:
+                frames.append(f.read())
+        except IOError:
+            if len(frames) == 0:
+                raise
+            frames.append(frames[-1])
+    return frames
+
+
+def write_shard(tup, frame_path, filename_tmpl, modality='RGB'):
+    """write the videos of one shard"""
+    shard_path, videos = tup
+    if osp.exists(shard_path):
+        print('*** shard has been done: {}'.format(shard_path))
+        return
+    with FrameShardWriter(shard_path) as writer:
+        for frame_dir, total_frames, _, _ in videos:
+            src = osp.join(frame_path, frame_dir)
+            if modality == 'Flow':
+                for axis in ['x', 'y']:
+                    writer.add_video(
+                        frame_dir + '/' + axis,
+                        read_frames(src, total_frames, filename_tmpl, axis))
+            else:
+                writer.add_video(
+                    frame_dir, read_frames(src, total_frames, filename_tmpl))
+
+
+def main():
+    """main"""
+    args = parse_args()
+    if not osp.exists(args.out_path):
+        os.makedirs(args.out_path)
+    out_ann = args.out_ann or osp.join(
+        args.out_path, osp.basename(args.ann_file))
+
+    videos = []
+    with open(args.ann_file) as f:
+        for line in f:
+            # the frame stride, if any, is kept in the shard annotation
+            items = line.split()
+            frame_dir, total_frames, label = items[:3]
+            videos.append((frame_dir, int(total_frames), int(label),
+                           items[3:]))
+
+    shard_list = []
+    for i in range(0, len(videos), args.videos_per_shard):
+        shard_name = 'shard_{:06d}.shard'.format(i // args.videos_per_shard)
+        shard_list.append((osp.join(args.out_path, shard_name),
+                           videos[i:i + args.videos_per_shard]))
+
+    pool = multiprocessing.Pool(n_thread)
+    worker = partial(write_shard, frame_path=args.frame_path,
+                     filename_tmpl=args.filename_tmpl,
+                     modality=args.modality)
+    # 1: Use tqdm for progress bar
+    from tqdm import tqdm
+    for _ in tqdm(pool.imap_unordered(worker, shard_list),
+                  total=len(shard_list)):
+        pass
+    pool.close()
+    pool.join()
+
+    with open(out_ann, 'w') as f:
+        for shard_path, shard_videos in shard_list:
+            for frame_dir, total_frames, label, stride in shard_videos:
+                f.write(' '.join([osp.basename(shard_path), frame_dir,
+                                  str(total_frames), str(label)] + stride)
+                        + '\n')
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,32 @@
-""" 
-example command line: python gen_k400_pkl.py video_dir  out_dir
-pkl will save to afs
+"""Encode the frames of every video into an indexed pkl container
+
+The frames are streamed from ffmpeg as MJPEG (`-f image2pipe`), split in
+memory and written to a frame shard (see `codes/utils/frame_shard.py`) named
+`<video>.pkl`, which is read by `PklLoader`. No frame touches the disk.
+
+example command line: python gen_k400_pkl.py video_dir out_dir
 """
-import sys
-import _pickle as cPickle
 import argparse
 import glob
 import multiprocessing
 import os
 import os.path as osp
 import subprocess
+import sys
 from functools import partial
 
-
+sys.path.insert(0, osp.join(osp.dirname(osp.abspath(__file__)), '..'))
+from codes.utils.frame_shard import (SINGLE_VIDEO_KEY,  # noqa: E402
+                                     FrameShardReader, FrameShardWriter)
 
 n_thread = 50
+# bytes read from the ffmpeg pipe at once
+chunk_size = 1 << 20
 
 
 def parse_args():
     """parse args"""
-    parser = argparse.ArgumentParser(description='Rescale videos')
+    parser = argparse.ArgumentParser(description='Encode videos into pkl')
     parser.add_argument('video_path', type=str,
                         help='root directory for the input videos')
     parser.add_argument('out_path', type=str,
@@ -27,71 +34,125 @@ def parse_args():
     parser.add_argument('--level', type=int, default=2, choices=[1, 2, 3],
                         help='the number of level for folders')
     parser.add_argument('-fps', type=int, default=30)
+    parser.add_argument('-q', '--quality', type=int, default=1,
+                        help='JPEG quality of ffmpeg, 1 (best) to 31')
     args = parser.parse_args()
     return args
 
 
-def vid2pkl(tup, fps=None, prefix='img_%05d.jpg'):
+def _jpeg_end(buf, pos):
+    """End of the JPEG starting at `pos` in `buf`, None if incomplete.
+
+    The marker segments are skipped by their length and the entropy-coded
+    data is scanned for the next marker, so an 0xFFD9 inside a table or a
+    comment does not end the frame.
+    """
+    size = len(buf)
+    i = pos + 2
+    while True:
+        if i + 2 > size:
+            return None
+        if buf[i] != 0xFF:
+            raise IOError('corrupt MJPEG stream at byte {}'.format(i))
+        marker = buf[i + 1]
+        if marker == 0xFF:
+            # fill byte
+            i += 1
+            continue
+        if marker == 0xD9:
+            return i + 2
+        if 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            i += 2
+            continue
+        if i + 4 > size:
+            return None
+        i += 2 + ((buf[i + 2] << 8) | buf[i + 3])
+        if marker != 0xDA:
+            continue
+        # start of scan, skip stuffed bytes and restart markers
+        while True:
+            j = buf.find(b'\xff', i)
+            if j < 0 or j + 1 >= size:
+                return None
+            follow = buf[j + 1]
+            if follow == 0 or 0xD0 <= follow <= 0xD7:
+                i = j + 2
+            elif follow == 0xFF:
+                i = j + 1
+            else:
+                i = j
+                break
+
+
+def split_jpegs(stream):
+    """Split a concatenated MJPEG stream (file object) into JPEG frames."""
+    buf = bytearray()
+    while True:
+        chunk = stream.read(chunk_size)
+        if chunk:
+            buf += chunk
+        pos = 0
+        while len(buf) - pos >= 2:
+            if buf[pos] != 0xFF or buf[pos + 1] != 0xD8:
+                raise IOError('corrupt MJPEG stream, no start of image')
+            end = _jpeg_end(buf, pos)
+            if end is None:
+                break
+            yield bytes(buf[pos:end])
+            pos = end
+        del buf[:pos]
+        if not chunk:
+            if buf:
+                raise IOError('truncated MJPEG stream')
+            return
+
+
+def is_complete(output):
+    """Whether `output` is a frame shard with a valid index and frames."""
+    try:
+        with FrameShardReader(output) as reader:
+            return reader.num_frames(SINGLE_VIDEO_KEY) > 0
+    except Exception:
+        return False
+
+
+def vid2pkl(tup, fps=None, quality=1):
     """video2pkl"""
     src, dest = tup
     folder, vid_name = osp.split(dest)
     video_name = vid_name.split('.')[0]
-    video_folder = osp.join(folder, video_name)
-
-    output_pkl = video_folder + '.pkl'
+    output_pkl = osp.join(folder, video_name) + '.pkl'
+    if is_complete(output_pkl):
+        return 'skipped'
+    if not osp.exists(folder):
+        os.makedirs(folder, exist_ok=True)
+    # leftovers of killed runs
+    for tmp_file in glob.glob(glob.escape(output_pkl) + '.*.tmp'):
+        os.remove(tmp_file)
+
+    cmd = ['ffmpeg', '-v', 'error', '-i', src, '-threads', '1']
+    if fps is not None:
+        cmd += ['-r', str(fps)]
+    cmd += ['-f', 'image2pipe', '-c:v', 'mjpeg', '-q:v', str(quality), '-']
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL)
+    writer = FrameShardWriter(output_pkl)
     try:
-        if osp.exists(video_folder):
-            if not osp.exists(
-                    osp.join(video_folder, prefix.format(1))):
-                subprocess.call(
-                    'rm -r \"{}\"'.format(video_folder), shell=True)
-                print('remove {}'.format(video_folder))
-                os.system('mkdir -p {}'.format(video_folder))
-            else:
-                print('*** convert has been done: {}'.
-                      format(video_folder))
-                return
-        else:
-            os.system('mkdir -p {}'.format(video_folder))
-    except Exception:
-        print(video_folder)
-        return
-
-    cmd1 = 'ffprobe -v error -select_streams v:0 -show_entries \
-        stream=width,height -of csv=s=x:p=0 \"{}\"'.format(src)
-    try:
-        w, h = subprocess.check_output(
-            cmd1, shell=True).decode('utf-8').split('x')
-    except ValueError:
-        print(video_folder)
-        return
-
-    if fps is None:
-        cmd = './ffmpeg -i \"{}\"  -threads 1 -q:v 1 \
-            \"{}/{}\"'.format(src, video_folder, prefix)
-    else:
-        cmd = './ffmpeg -i \"{}\"  -threads 1 -q:v 1 -r {} \
-            \"{}/{}\"'.format(src, fps, video_folder, prefix)
-
-    # decode image
-    subprocess.call(cmd, shell=True,
-                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-
-    images = sorted(glob.glob(video_folder + '/*.jpg'))
-    # print(images)
-    ims = []
-    for img in images:
-        # note: python3 open with 'rb'
-        with open(img, 'rb') as f:
-            ims.append(f.read())
-    with open(output_pkl, 'wb') as f:
-        cPickle.dump(ims, f, -1)
-    
-
-
-
-    os.system('rm -rf %s' % video_folder)
-    # os.system('rm %s' % output_pkl)
+        num_frames = writer.add_video(SINGLE_VIDEO_KEY,
+                                      split_jpegs(proc.stdout))
+        if proc.wait() != 0 or num_frames == 0:
+            raise IOError('ffmpeg failed ({}) after {} frames'.format(
+                proc.returncode, num_frames))
+    except Exception as e:
+        proc.kill()
+        proc.wait()
+        writer.abort()
+        print('{}: {}'.format(src, e))
+        return 'failed'
+    finally:
+        proc.stdout.close()
+    writer.close()
+    return 'done'
 
 
 def main():
@@ -117,19 +178,24 @@ def main():
             for vid in src_list]
         # ['root/class/sub/xxx.mp4']
 
-    vid_list = list(zip(src_list, dest_list))
+    # largest videos first, so that the pool does not end on a long video
+    vid_list = sorted(zip(src_list, dest_list),
+                      key=lambda tup: osp.getsize(tup[0]), reverse=True)
 
     pool = multiprocessing.Pool(n_thread)
-    worker = partial(vid2pkl, fps=args.fps)
+    worker = partial(vid2pkl, fps=args.fps, quality=args.quality)
+    counts = dict(done=0, skipped=0, failed=0)
     # 1: Use tqdm for progress bar
     from tqdm import tqdm
-    for _ in tqdm(pool.imap_unordered(worker, vid_list),
-                  total=len(vid_list)):
-        pass
+    for status in tqdm(pool.imap_unordered(worker, vid_list),
+                       total=len(vid_list)):
+        counts[status] += 1
 
     pool.close()
     pool.join()
+    print('done: {done}, skipped: {skipped}, failed: {failed}'.format(
+        **counts))
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -24,6 +24,9 @@ def parse_args():
     parser.add_argument('--source', type=str, default='rgb',
                         choices=['rgb', 'flow', 'video'])
     parser.add_argument('--split', type=int, default=1, choices=[1, 2, 3])
+    parser.add_argument('--frame_stride', type=int, default=1,
+                        help='stride of the extracted frames '
+                        '(video2image.py --stride), written as a 4th column')
     args = parser.parse_args()
     return args
 
@@ -55,7 +58,15 @@ def parse_label_file(file):
     return dict_categories
 
 
-def gen_sth_label(data_path, ann_path, out_path, source='rgb'):
+def frame_entry(frame_dir, num_frames, label, frame_stride=1):
+    """annotation line of a frame folder, with the stride if any"""
+    if frame_stride > 1:
+        return '%s %d %d %d' % (frame_dir, num_frames, label, frame_stride)
+    return '%s %d %d' % (frame_dir, num_frames, label)
+
+
+def gen_sth_label(data_path, ann_path, out_path, source='rgb',
+                  frame_stride=1):
     """
     sthv1: csv
     sthv2: json
@@ -120,14 +131,16 @@ def gen_sth_label(data_path, ann_path, out_path, source='rgb'):
                 data_path, curFolder))
             if source == 'flow':
                 dir_files = [x for x in dir_files if 'flow_x' in x]
-            output.append('%s %d %d' % (curFolder, len(dir_files), curIDX))
+            output.append(frame_entry(curFolder, len(dir_files), curIDX,
+                                      frame_stride))
             print('%d/%d' % (i, len(folders)))
         with open(filename_output, 'w') as f:
             f.write('\n'.join(output))
 
 
 def gen_kinetics_label(data_path, ann_path, out_path, level=1,
-                       source='rgb', phase='train', start_end=False):
+                       source='rgb', phase='train', start_end=False,
+                       frame_stride=1):
     """generate kinetics datalist"""
     if '400' in ann_path:
         num_class = 400
@@ -205,7 +218,8 @@ def gen_kinetics_label(data_path, ann_path, out_path, level=1,
                 if source == 'flow':
                     dir_files = [x for x in dir_files if 'flow_x' in x]
 
-                output.append('%s %d %d' % (sub_dir, len(dir_files), curIDX))
+                output.append(frame_entry(sub_dir, len(dir_files), curIDX,
+                                          frame_stride))
 
         print('%d/%d, missing %d' % (i, len(folders), len(missing_folders)))
     with open(os.path.join(out_path, file_out), 'w') as f:
@@ -214,7 +228,8 @@ def gen_kinetics_label(data_path, ann_path, out_path, level=1,
         f.write('\n'.join(missing_folders))
 
 
-def gen_label(data_path, ann_path, out_path, source, split):
+def gen_label(data_path, ann_path, out_path, source, split,
+              frame_stride=1):
     """generate datalist for UCF101 and HMDB51"""
     label_file = osp.join(ann_path, 'category.txt')
     files_input = [osp.join(ann_path, 'trainlist0%d.txt' % split),
@@ -253,8 +268,9 @@ def gen_label(data_path, ann_path, out_path, source, split):
                 dir_files = os.listdir(img_dir)
                 if source == 'flow':
                     dir_files = [x for x in dir_files if 'flow_x' in x]
-                output.append('%s %d %d' % (
-                    osp.join(category, curFolder), len(dir_files), curIDX))
+                output.append(frame_entry(
+                    osp.join(category, curFolder), len(dir_files), curIDX,
+                    frame_stride))
             print('%d/%d' % (i, len(folders)))
         with open(filename_output, 'w') as f:
             f.write('\n'.join(output))
@@ -269,13 +285,15 @@ def main():
     if not osp.exists(out_path):
         os.system('mkdir -p {}'.format(out_path))
     if 'sth' in dataset:
-        gen_sth_label(args.data_path, ann_path, out_path, args.source)
+        gen_sth_label(args.data_path, ann_path, out_path, args.source,
+                      frame_stride=args.frame_stride)
     elif 'kinetics' in dataset:
         gen_kinetics_label(args.data_path, ann_path, out_path,
-                           args.level, args.source, args.phase)
+                           args.level, args.source, args.phase,
+                           frame_stride=args.frame_stride)
     elif dataset in ['ucf101', 'hmdb51']:
         gen_label(args.data_path, ann_path, out_path,
-                  args.source, args.split)
+                  args.source, args.split, frame_stride=args.frame_stride)
 
 
 if __name__ == "__main__":
@@ -1,8 +1,30 @@
-"""generate video info: resolution, duration"""
+"""generate video info: resolution, duration, the metadata index or the
+keyframe index
+
+example command line for the metadata index of a VideoDataset:
+python gen_videos_info.py /data/k400_transcode_video/train_video \
+    --info meta --ann_file ../datalist/kinetics400/video_train.txt
+the index is saved next to the annotation file (video_train.txt.meta.npz)
+and loaded by VideoDataset. `--info keyframes` saves the keyframe index
+(video_train.txt.keyframes.npz) used by PyAVDecode and DecordDecode to seek.
+
+Every video is probed once, by a single ffprobe call or in process with
+PyAV (`--backend pyav`), in a process pool. The results are appended to a
+checkpoint (OUT.progress.jsonl) as they come in, an interrupted scan is
+resumed from it by running the same command again.
+"""
 import argparse
 import glob
+import json
+import multiprocessing
+import os
 import os.path as osp
 import subprocess
+from functools import partial
+
+import numpy as np
+
+n_thread = 50
 
 
 def parse_args():
@@ -10,45 +32,353 @@ def parse_args():
     parser = argparse.ArgumentParser(description='Build file list')
     parser.add_argument('video_path', type=str,
                         help='root directory for the frames')
-    parser.add_argument('--out', type=str, default='video_duration.txt',
-                        help='out path for the list')
+    parser.add_argument('--out', type=str, default=None,
+                        help='out path for the list, default: '
+                        'video_duration.txt, or ANN_FILE.meta.npz for meta, '
+                        'ANN_FILE.keyframes.npz for keyframes')
     parser.add_argument('--info', type=str, default='resolution',
-                        choices=['resolution', 'duration'])
+                        choices=['resolution', 'duration', 'meta',
+                                 'keyframes'])
     parser.add_argument('--level', type=int, default=2, choices=[1, 2, 3])
+    parser.add_argument('--ann_file', type=str, default=None,
+                        help='VideoDataset annotation to index '
+                        '(for meta and keyframes)')
+    parser.add_argument('--backend', type=str, default='ffprobe',
+                        choices=['ffprobe', 'pyav'],
+                        help='probe with an ffprobe subprocess or in process '
+                        'with PyAV')
+    parser.add_argument('--num_workers', type=int, default=n_thread)
     args = parser.parse_args()
     return args
 
 
 def get_duration(vid):
-    """[summary]
+    """Duration of `vid` in seconds from the container header (ffprobe
+    `format=duration`), '' if the video can not be probed."""
+    cmd = ['ffprobe', '-v', 'error', '-show_entries', 'format=duration',
+           '-of', 'csv=p=0', vid]
+    try:
+        return subprocess.check_output(
+            cmd, stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except subprocess.CalledProcessError:
+        return ''
+
+
+def get_resolution(vid):
+    """`WIDTHxHEIGHT` of the first video stream of `vid` from the header,
+    '' if the video can not be probed."""
+    cmd = ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+           '-show_entries', 'stream=width,height', '-of', 'csv=s=x:p=0', vid]
+    try:
+        return subprocess.check_output(
+            cmd, stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except subprocess.CalledProcessError:
+        return ''
+
+
+def get_duration_pyav(vid):
+    """`get_duration` with an in-process PyAV probe."""
+    import av
+    try:
+        with av.open(vid) as container:
+            return '{:.6f}'.format((container.duration or 0) / av.time_base)
+    except Exception as e:
+        print('{}: {}'.format(vid, e))
+        return ''
+
+
+def get_resolution_pyav(vid):
+    """`get_resolution` with an in-process PyAV probe."""
+    import av
+    try:
+        with av.open(vid) as container:
+            codec_context = container.streams.video[0].codec_context
+            return '{}x{}'.format(codec_context.width, codec_context.height)
+    except Exception as e:
+        print('{}: {}'.format(vid, e))
+        return ''
+
+
+def _parse_rate(rate):
+    num, _, den = rate.partition('/')
+    return float(num) / float(den) if den and float(den) else float(num)
+
 
-    Args:
-        vid ([type]): [description]
+def _gop_size(is_key):
+    """Longest run of frames from a keyframe to the next one."""
+    key_inds = np.flatnonzero(is_key)
+    if len(key_inds) == 0:
+        return 0
+    return int(np.diff(np.append(key_inds, len(is_key))).max())
+
+
+def _bit_rate(*rates):
+    """The first known bit rate, in bits/s."""
+    for rate in rates:
+        try:
+            if rate and int(rate) > 0:
+                return int(rate)
+        except (TypeError, ValueError):
+            pass
+    return 0
+
+
+# meta of a video that can not be probed
+FAILED_META = (-1, 0., 0, 0, 0., 0, '', 0, 0)
+
+
+def get_meta(vid):
+    """Probe the first video stream of `vid` with a single ffprobe call.
+
+    The packets are counted (not decoded), so the frame and keyframe counts
+    are exact even when the container header is wrong.
 
     Returns:
-        [type]: [description]
+        tuple: (num_frames, fps, width, height, duration, num_keyframes,
+            codec, gop_size, bit_rate), num_frames is -1 if the video can
+            not be probed. gop_size is the longest distance between two
+            keyframes, bit_rate is in bits/s.
     """
-    cmd1 = 'ffprobe -i \"{}\"  -show_entries \
-        format=duration -v quiet -of csv="p=0"'.format(vid)
-    duration = subprocess.check_output(cmd1, shell=True).decode('utf-8')
-    return duration
+    cmd = ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+           '-count_packets', '-show_entries',
+           'stream=nb_read_packets,avg_frame_rate,width,height,duration,'
+           'codec_name,bit_rate:format=duration,bit_rate:packet=flags',
+           '-of', 'json', vid]
+    try:
+        info = json.loads(subprocess.check_output(
+            cmd, stderr=subprocess.DEVNULL).decode('utf-8'))
+        stream = info['streams'][0]
+        duration = stream.get('duration', info['format'].get('duration', 0))
+        is_key = ['K' in packet.get('flags', '')
+                  for packet in info['packets']]
+        return (int(stream['nb_read_packets']),
+                _parse_rate(stream['avg_frame_rate']),
+                int(stream['width']), int(stream['height']),
+                float(duration), sum(is_key), stream.get('codec_name', ''),
+                _gop_size(is_key),
+                _bit_rate(stream.get('bit_rate'),
+                          info['format'].get('bit_rate')))
+    except (subprocess.CalledProcessError, ValueError, KeyError,
+            IndexError, ZeroDivisionError):
+        return FAILED_META
 
 
-def get_resolution(vid):
-    """[summary]
+def _demux_pyav(vid):
+    """Demux (without decoding) the first video stream of `vid` with PyAV.
+
+    Returns:
+        tuple: The meta of the stream (fps, width, height, duration, codec,
+            bit_rate) and the pts and keyframe flags of its packets, in
+            decode order.
+    """
+    import av
+    with av.open(vid) as container:
+        stream = container.streams.video[0]
+        if stream.duration:
+            duration = float(stream.duration * stream.time_base)
+        else:
+            duration = (container.duration or 0) / av.time_base
+        stream_meta = (float(stream.average_rate or 0),
+                       int(stream.codec_context.width),
+                       int(stream.codec_context.height), duration,
+                       stream.codec_context.name,
+                       _bit_rate(stream.bit_rate, container.bit_rate))
+        pts, is_key = [], []
+        for packet in container.demux(stream):
+            # the flushing packets are empty
+            if packet.size == 0:
+                continue
+            pts.append(packet.pts)
+            is_key.append(packet.is_keyframe)
+    return stream_meta, pts, is_key
+
+
+def get_meta_pyav(vid):
+    """`get_meta` with an in-process PyAV probe."""
+    try:
+        stream_meta, _, is_key = _demux_pyav(vid)
+    except Exception as e:
+        print('{}: {}'.format(vid, e))
+        return FAILED_META
+    fps, width, height, duration, codec, bit_rate = stream_meta
+    return (len(is_key), fps, width, height, duration, sum(is_key), codec,
+            _gop_size(is_key), bit_rate)
 
-    Args:
-        vid ([type]): [description]
+
+def _keyframe_index(pts, is_key):
+    """Presentation indices and PTS of the keyframes from the packets."""
+    empty = (np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int64))
+    if not any(is_key):
+        return empty
+    pts = np.array(pts, dtype=np.int64)
+    key_pts = pts[np.array(is_key)]
+    # the packets are in decode order, the frames in presentation order
+    key_frame_inds = np.searchsorted(np.sort(pts), key_pts)
+    order = np.argsort(key_frame_inds, kind='stable')
+    return key_frame_inds[order].astype(np.int32), key_pts[order]
+
+
+def get_keyframes(vid):
+    """Find the keyframes of the first video stream of `vid` from its
+    packets, without decoding.
+
+    Returns:
+        tuple[np.ndarray]: The frame indices (in presentation order) and
+            the PTS (in the time base of the stream) of the keyframes,
+            empty if the video can not be probed.
+    """
+    cmd = ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+           '-show_entries', 'packet=pts,flags', '-of', 'csv=p=0', vid]
+    try:
+        lines = subprocess.check_output(
+            cmd, stderr=subprocess.DEVNULL).decode('utf-8').split()
+        pts, is_key = [], []
+        for line in lines:
+            packet_pts, _, flags = line.partition(',')
+            pts.append(int(packet_pts))
+            is_key.append('K' in flags)
+    except (subprocess.CalledProcessError, ValueError):
+        pts, is_key = [], []
+    return _keyframe_index(pts, is_key)
+
+
+def get_keyframes_pyav(vid):
+    """`get_keyframes` with an in-process PyAV probe."""
+    try:
+        _, pts, is_key = _demux_pyav(vid)
+        if None in pts:
+            raise ValueError('packets without pts')
+    except Exception as e:
+        print('{}: {}'.format(vid, e))
+        pts, is_key = [], []
+    return _keyframe_index(pts, is_key)
+
+
+def _read_filenames(ann_file):
+    filenames = []
+    with open(ann_file) as f:
+        for line in f:
+            line_split = line.strip().split()
+            if len(line_split) > 0:
+                filenames.append(line_split[0])
+    return filenames
+
+
+def _probe_one(filename, func, video_path):
+    result = func(osp.join(video_path, filename))
+    if isinstance(result, tuple):
+        # json-serializable for the checkpoint
+        result = [x.tolist() if isinstance(x, np.ndarray) else x
+                  for x in result]
+    return filename, result
+
+
+def _load_checkpoint(checkpoint):
+    done = dict()
+    if not osp.exists(checkpoint):
+        return done
+    with open(checkpoint, 'rb+') as f:
+        content = f.read()
+        # drop the last line of a killed scan
+        f.truncate(content.rfind(b'\n') + 1)
+    for line in content.decode('utf-8').splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        done[record['filename']] = record['result']
+    return done
+
+
+def _probe_all(func, video_path, filenames, checkpoint,
+               num_workers=n_thread):
+    """Probe every video once with `func` in a process pool.
+
+    The results are appended to `checkpoint` (a JSON line per video), the
+    videos already in it are not probed again.
 
     Returns:
-        [type]: [description]
+        list: The results of `func` (lists instead of tuples and arrays) in
+            the order of `filenames`.
     """
-    cmd1 = 'ffprobe -v error -select_streams v:0 \
-        -show_entries stream=width,height -of csv=s=x:p=0 \"{}\"'.format(
-        vid)
-    widthxheight = subprocess.check_output(
-        cmd1, shell=True).decode('utf-8')
-    return widthxheight
+    done = _load_checkpoint(checkpoint)
+    todo = sorted(set(filenames) - set(done))
+    if done:
+        print('resume from {}: {} videos done, {} to probe'.format(
+            checkpoint, len(done), len(todo)))
+    pool = multiprocessing.Pool(num_workers)
+    # 1: Use tqdm for progress bar
+    from tqdm import tqdm
+    with open(checkpoint, 'a') as f:
+        for filename, result in tqdm(pool.imap_unordered(
+                partial(_probe_one, func=func, video_path=video_path),
+                todo, chunksize=16), total=len(todo)):
+            done[filename] = result
+            f.write(json.dumps(dict(filename=filename, result=result)) +
+                    '\n')
+            f.flush()
+    pool.close()
+    pool.join()
+    return [done[x] for x in filenames]
+
+
+def _report(filenames, failed):
+    failed = [x for x, fail in zip(filenames, failed) if fail]
+    print('{} videos indexed, {} failed'.format(
+        len(filenames) - len(failed), len(failed)))
+    for x in failed:
+        print('failed: {}'.format(x))
+
+
+def gen_keyframes(video_path, ann_file, out, backend='ffprobe',
+                  num_workers=n_thread):
+    """Index the keyframes of every video of `ann_file` and save them as
+    one flat array indexed by per-video offsets."""
+    filenames = _read_filenames(ann_file)
+    checkpoint = out + '.progress.jsonl'
+    keyframes = _probe_all(
+        get_keyframes_pyav if backend == 'pyav' else get_keyframes,
+        video_path, filenames, checkpoint, num_workers)
+
+    offsets = np.zeros(len(filenames) + 1, dtype=np.int64)
+    np.cumsum([len(inds) for inds, _ in keyframes], out=offsets[1:])
+    np.savez(out,
+             filename=np.array(filenames),
+             offsets=offsets,
+             key_frame_inds=np.concatenate(
+                 [np.asarray(inds, dtype=np.int32) for inds, _ in keyframes] +
+                 [np.zeros(0, dtype=np.int32)]),
+             key_pts=np.concatenate(
+                 [np.asarray(pts, dtype=np.int64) for _, pts in keyframes] +
+                 [np.zeros(0, dtype=np.int64)]))
+    os.remove(checkpoint)
+    _report(filenames, [len(inds) == 0 for inds, _ in keyframes])
+
+
+def gen_meta(video_path, ann_file, out, backend='ffprobe',
+             num_workers=n_thread):
+    """Probe every video of `ann_file` in parallel and save the index, one
+    array per field."""
+    filenames = _read_filenames(ann_file)
+    checkpoint = out + '.progress.jsonl'
+    metas = _probe_all(get_meta_pyav if backend == 'pyav' else get_meta,
+                       video_path, filenames, checkpoint, num_workers)
+
+    (num_frames, fps, width, height, duration, num_keyframes, codec,
+     gop_size, bit_rate) = zip(*metas) if metas else [()] * 9
+    np.savez(out,
+             filename=np.array(filenames),
+             num_frames=np.array(num_frames, dtype=np.int32),
+             fps=np.array(fps, dtype=np.float32),
+             width=np.array(width, dtype=np.int32),
+             height=np.array(height, dtype=np.int32),
+             duration=np.array(duration, dtype=np.float32),
+             num_keyframes=np.array(num_keyframes, dtype=np.int32),
+             codec=np.array(codec, dtype=str),
+             gop_size=np.array(gop_size, dtype=np.int32),
+             bit_rate=np.array(bit_rate, dtype=np.int64))
+    os.remove(checkpoint)
+    _report(filenames, [meta[0] < 0 for meta in metas])
 
 
 def main():
@@ -56,6 +386,20 @@ def main():
     """
     args = parse_args()
 
+    if args.info == 'meta':
+        assert args.ann_file is not None, '--ann_file is required for meta'
+        out = args.out or args.ann_file + '.meta.npz'
+        gen_meta(args.video_path, args.ann_file, out, args.backend,
+                 args.num_workers)
+        return
+    if args.info == 'keyframes':
+        assert args.ann_file is not None, \
+            '--ann_file is required for keyframes'
+        out = args.out or args.ann_file + '.keyframes.npz'
+        gen_keyframes(args.video_path, args.ann_file, out, args.backend,
+                      args.num_workers)
+        return
+
     if args.level == 1:
         video_list = glob.glob(osp.join(args.video_path, '*'))
         # ['root/xxx.mp4']
@@ -65,17 +409,21 @@ def main():
     elif args.level == 3:
         video_list = glob.glob(osp.join(args.video_path, '*', '*', '*'))
         # ['root/class/sub/xxx.mp4']
-    with open(args.out, 'w+') as f:
-        for i in range(len(video_list)):
-            vid = video_list[i]
+    out = args.out or 'video_duration.txt'
+    checkpoint = out + '.progress.jsonl'
+    # only the header of the videos is read
+    if args.info == 'resolution':
+        func = get_resolution_pyav if args.backend == 'pyav' \
+            else get_resolution
+    elif args.info == 'duration':
+        func = get_duration_pyav if args.backend == 'pyav' else get_duration
+    infos = _probe_all(func, '', video_list, checkpoint, args.num_workers)
+    with open(out, 'w+') as f:
+        for vid, info in zip(video_list, infos):
             name = vid.split('/')[-1].split('.')[0][:11]
-            if i != 0 and i % 500 == 0:
-                print('%d videos have done' % i)
-            if args.info == 'resolution':
-                info = get_resolution(vid)
-            elif args.info == 'duration':
-                info = get_duration(vid)
-            f.write(name + ' ' + str(info))
+            f.write('{} {}\n'.format(name, info))
+    os.remove(checkpoint)
+    _report(video_list, [not info for info in infos])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,329 @@
+"""Re-encode the videos slowest to decode to a short side and a short GOP
+
+The candidates are ranked by the decoding time they are expected to save
+per sample: the frames `DecordDecode` decodes for a clip (seeking to the
+keyframe preceding each sampled frame) times the pixels of a frame, before
+and after the re-encoding, from the metadata index of the annotation
+(`gen_videos_info.py --info meta`). Measured per-sample decode times (a
+text file of `filename seconds` lines, e.g. the slowest samples reported
+during training) replace the modelled cost of the videos they cover.
+
+The selected videos are re-encoded next to the original, checked, timed
+with `DecordDecode` before and after, and moved over the original
+atomically. The metadata and keyframe indexes of the annotation are
+updated in place.
+
+example command line:
+python transcode_videos.py /data/k400/train_video \
+    ../datalist/kinetics400/video_train.txt --top 5000 -se 256 --gop 16
+"""
+import argparse
+import multiprocessing
+import os
+import os.path as osp
+import shutil
+import sys
+import time
+from collections import defaultdict
+from functools import partial
+
+import numpy as np
+
+sys.path.insert(0, osp.join(osp.dirname(osp.abspath(__file__)), '..'))
+from mmcv import convert_video  # noqa: E402
+from codes.datasets.pipelines.loading import (  # noqa: E402
+    DecordDecode, SampleFrames, _keyframe_cost)
+from gen_videos_info import get_keyframes, get_meta  # noqa: E402
+from video_resize import scale_filter  # noqa: E402
+
+n_thread = 8
+# the columns of the metadata index, in the order of `get_meta`
+META_KEYS = ('num_frames', 'fps', 'width', 'height', 'duration',
+             'num_keyframes', 'codec', 'gop_size', 'bit_rate')
+
+
+def parse_args():
+    """parse args"""
+    parser = argparse.ArgumentParser(
+        description='Re-encode the videos slowest to decode')
+    parser.add_argument('video_path', type=str,
+                        help='root directory for the videos')
+    parser.add_argument('ann_file', type=str,
+                        help='VideoDataset annotation of the videos')
+    parser.add_argument('--meta_file', type=str, default=None,
+                        help='metadata index, default: ANN_FILE.meta.npz')
+    parser.add_argument('--decode_times', type=str, nargs='*', default=[],
+                        help='files of measured per-sample decode times, '
+                        '"filename seconds" per line, e.g. the reports '
+                        'of LoadTelemetryHook')
+    parser.add_argument('--top', type=int, default=1000,
+                        help='max number of videos to re-encode')
+    parser.add_argument('--min_speedup', type=float, default=2.,
+                        help='min expected decode speedup of a video')
+    parser.add_argument('-se', '--short_edge', type=int, default=256)
+    parser.add_argument('--gop', type=int, default=16,
+                        help='keyframe interval of the re-encoded videos')
+    parser.add_argument('--crf', type=int, default=18)
+    parser.add_argument('--seek_cost', type=float, default=8,
+                        help='seek cost of DecordDecode, in frames')
+    parser.add_argument('--clip_len', type=int, default=8)
+    parser.add_argument('--frame_interval', type=int, default=8)
+    parser.add_argument('--num_clips', type=int, default=1)
+    parser.add_argument('--repeats', type=int, default=3,
+                        help='samples decoded to time a video')
+    parser.add_argument('--backup_path', type=str, default=None,
+                        help='keep the original videos in this directory')
+    parser.add_argument('--num_workers', type=int, default=n_thread)
+    parser.add_argument('--dry_run', action='store_true',
+                        help='only report the selection')
+    args = parser.parse_args()
+    return args
+
+
+def load_decode_times(files, video_path):
+    """Mean measured decode time of each video, keyed by its filename
+    relative to `video_path`."""
+    times = defaultdict(list)
+    for file in files:
+        with open(file) as f:
+            for line in f:
+                items = line.split()
+                if len(items) < 2 or items[0].startswith('#'):
+                    continue
+                filename = items[0]
+                if filename.startswith(video_path):
+                    filename = osp.relpath(filename, video_path)
+                times[filename].append(float(items[1]))
+    return {k: float(np.mean(v)) for k, v in times.items()}
+
+
+def expected_cost(num_frames, num_keyframes, width, height, sampler,
+                  seek_cost):
+    """Expected decoding cost of a sample (decoded frames times pixels)
+    with the decoding strategy `DecordDecode` picks."""
+    frame_inds = sampler._get_frame_inds(num_frames, dict(test_mode=True))
+    uniq_inds = np.unique(frame_inds)
+    frames = uniq_inds[-1] + 1
+    if num_keyframes > 0:
+        key_frame_inds = np.arange(num_keyframes) * num_frames \
+            // num_keyframes
+        frames = min(frames, _keyframe_cost(uniq_inds, key_frame_inds,
+                                            seek_cost))
+    return frames * width * height
+
+
+def _transcoded_size(width, height, se):
+    if min(width, height) <= se:
+        return width, height
+    scale = se / min(width, height)
+    return int(round(width * scale)), int(round(height * scale))
+
+
+def select_videos(meta, decode_times, sampler, seek_cost, se, gop,
+                  min_speedup, top):
+    """Rank the videos by the decoding time they are expected to save.
+
+    Returns:
+        list[tuple]: (row in the index, expected speedup) of the selected
+            videos.
+    """
+    candidates = []
+    for i, filename in enumerate(meta['filename'].tolist()):
+        num_frames = int(meta['num_frames'][i])
+        if num_frames <= 0:
+            continue
+        width, height = int(meta['width'][i]), int(meta['height'][i])
+        before = expected_cost(num_frames, int(meta['num_keyframes'][i]),
+                               width, height, sampler, seek_cost)
+        after = expected_cost(
+            num_frames, (num_frames + gop - 1) // gop,
+            *_transcoded_size(width, height, se), sampler, seek_cost)
+        speedup = float(before) / max(after, 1)
+        if speedup < min_speedup:
+            continue
+        # measured seconds, or the modelled cost of the unmeasured videos
+        saving = decode_times.get(filename, before) * (1 - 1 / speedup)
+        measured = filename in decode_times
+        candidates.append((measured, saving, i, speedup))
+    # measured videos first, they are the known stragglers
+    candidates.sort(reverse=True)
+    return [(i, speedup) for _, _, i, speedup in candidates[:top]]
+
+
+def time_decode(filename, meta, sampler, seek_cost, repeats):
+    """Mean wall time of `DecordDecode` (opening included) on a sampled
+    clip, seeded so that the same clips are timed before and after."""
+    decoder = DecordDecode(seek_cost=seek_cost)
+    state = np.random.get_state()
+    np.random.seed(0)
+    elapsed = []
+    try:
+        for _ in range(repeats):
+            results = dict(filename=filename, test_mode=False,
+                           modality='RGB', total_frames=meta[0],
+                           num_keyframes=meta[5])
+            results = sampler(results)
+            start = time.perf_counter()
+            if decoder(results) is None:
+                return None
+            elapsed.append(time.perf_counter() - start)
+    finally:
+        np.random.set_state(state)
+    return float(np.mean(elapsed))
+
+
+def transcode(tup, se, gop, crf, sampler, seek_cost, repeats,
+              backup_path=None):
+    """Re-encode a video, check it, time it and move it over the original.
+
+    Returns:
+        tuple: (filename, status, time before, time after, new meta, new
+            keyframes).
+    """
+    filename, src, meta = tup
+    root, ext = osp.splitext(src)
+    tmp_file = '{}.transcode{}'.format(root, ext)
+    codec = 'libvpx-vp9' if ext.lower() == '.webm' else 'libx264'
+    options = {'c:v': codec, 'g': gop, 'keyint_min': gop, 'crf': crf,
+               'c:a': 'copy', 'threads': 1}
+    if codec == 'libx264':
+        # keyframes every `gop` frames exactly
+        options['sc_threshold'] = 0
+    if min(meta[2], meta[3]) > se:
+        options['vf'] = scale_filter(meta[2], meta[3], se)
+    before = time_decode(src, meta, sampler, seek_cost, repeats)
+    convert_video('"{}"'.format(src), '"{}"'.format(tmp_file),
+                  log_level='error', **options)
+    new_meta = get_meta(tmp_file)
+    # the frames must be the same, one frame less or more is tolerated
+    if new_meta[0] <= 0 or abs(new_meta[0] - meta[0]) > 1:
+        if osp.exists(tmp_file):
+            os.remove(tmp_file)
+        return filename, 'failed', before, None, None, None
+    after = time_decode(tmp_file, new_meta, sampler, seek_cost, repeats)
+    keyframes = get_keyframes(tmp_file)
+    if backup_path is not None:
+        backup_file = osp.join(backup_path, filename)
+        os.makedirs(osp.dirname(backup_file), exist_ok=True)
+        shutil.copy2(src, backup_file)
+    os.replace(tmp_file, src)
+    return filename, 'done', before, after, new_meta, keyframes
+
+
+def update_meta(meta_file, meta, updates):
+    """Rewrite the rows of the re-encoded videos of the metadata index."""
+    columns = {k: np.array(meta[k]) for k in meta.files}
+    if 'codec' in columns:
+        # room for longer codec names
+        columns['codec'] = columns['codec'].astype('U16')
+    for i, new_meta in updates.items():
+        for key, value in zip(META_KEYS, new_meta):
+            if key in columns:
+                columns[key][i] = value
+    tmp_file = meta_file + '.tmp.npz'
+    np.savez(tmp_file, **columns)
+    os.replace(tmp_file, meta_file)
+
+
+def update_keyframes(keyframe_file, updates):
+    """Rewrite the keyframes of the re-encoded videos of the keyframe
+    index, keyed by filename."""
+    index = np.load(keyframe_file)
+    filenames = index['filename'].tolist()
+    offsets = index['offsets']
+    key_frame_inds, key_pts = [], []
+    for i, filename in enumerate(filenames):
+        if filename in updates:
+            inds, pts = updates[filename]
+        else:
+            inds = index['key_frame_inds'][offsets[i]:offsets[i + 1]]
+            pts = index['key_pts'][offsets[i]:offsets[i + 1]]
+        key_frame_inds.append(inds)
+        key_pts.append(pts)
+    new_offsets = np.zeros(len(filenames) + 1, dtype=np.int64)
+    np.cumsum([len(inds) for inds in key_frame_inds], out=new_offsets[1:])
+    tmp_file = keyframe_file + '.tmp.npz'
+    np.savez(tmp_file,
+             filename=index['filename'],
+             offsets=new_offsets,
+             key_frame_inds=np.concatenate(
+                 key_frame_inds + [np.zeros(0, dtype=np.int32)]).astype(
+                     np.int32),
+             key_pts=np.concatenate(
+                 key_pts + [np.zeros(0, dtype=np.int64)]).astype(np.int64))
+    os.replace(tmp_file, keyframe_file)
+
+
+def main():
+    """main"""
+    args = parse_args()
+    meta_file = args.meta_file or args.ann_file + '.meta.npz'
+    meta = np.load(meta_file)
+    decode_times = load_decode_times(args.decode_times, args.video_path)
+    sampler = SampleFrames(args.clip_len, args.frame_interval,
+                           args.num_clips)
+
+    selected = select_videos(meta, decode_times, sampler, args.seek_cost,
+                             args.short_edge, args.gop, args.min_speedup,
+                             args.top)
+    filenames = meta['filename'].tolist()
+    expected = dict()
+    for i, speedup in selected:
+        expected[filenames[i]] = speedup
+    print('{} videos selected, expected mean speedup {:.2f}x'.format(
+        len(selected), np.mean([s for _, s in selected]) if selected else 0))
+    if args.dry_run:
+        for i, speedup in selected:
+            print('{} {:.2f}'.format(filenames[i], speedup))
+        return
+
+    tasks = [(filenames[i], osp.join(args.video_path, filenames[i]),
+              tuple(meta[k][i].item() if k in meta.files else 0
+                    for k in META_KEYS))
+             for i, _ in selected]
+    pool = multiprocessing.Pool(args.num_workers)
+    worker = partial(transcode, se=args.short_edge, gop=args.gop,
+                     crf=args.crf, sampler=sampler,
+                     seek_cost=args.seek_cost, repeats=args.repeats,
+                     backup_path=args.backup_path)
+    rows = {x: i for i, x in enumerate(filenames)}
+    meta_updates, keyframe_updates = dict(), dict()
+    before_times, after_times, failed = [], [], []
+    # 1: Use tqdm for progress bar
+    from tqdm import tqdm
+    for filename, status, before, after, new_meta, keyframes in tqdm(
+            pool.imap_unordered(worker, tasks), total=len(tasks)):
+        if status != 'done':
+            failed.append(filename)
+            continue
+        meta_updates[rows[filename]] = new_meta
+        keyframe_updates[filename] = keyframes
+        if before is not None and after is not None:
+            before_times.append(before)
+            after_times.append(after)
+            print('{}: expected {:.2f}x, achieved {:.2f}x '
+                  '({:.1f} -> {:.1f} ms)'.format(
+                      filename, expected[filename], before / after,
+                      before * 1e3, after * 1e3))
+    pool.close()
+    pool.join()
+
+    update_meta(meta_file, meta, meta_updates)
+    keyframe_file = args.ann_file + '.keyframes.npz'
+    if osp.exists(keyframe_file):
+        update_keyframes(keyframe_file, keyframe_updates)
+
+    print('{} videos re-encoded, {} failed'.format(
+        len(meta_updates), len(failed)))
+    for x in failed:
+        print('failed: {}'.format(x))
+    if before_times:
+        print('per-sample decode time of the re-encoded videos: '
+              '{:.1f} -> {:.1f} ms, expected {:.2f}x, achieved {:.2f}x'.format(
+                  np.mean(before_times) * 1e3, np.mean(after_times) * 1e3,
+                  np.mean([expected[x] for x in keyframe_updates]),
+                  np.mean(before_times) / np.mean(after_times)))
+
+
+if __name__ == "__main__":
+    main()
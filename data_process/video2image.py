@@ -8,7 +8,8 @@ import multiprocessing
 import os
 import os.path as osp
 import subprocess
-from functools import partial
+from functools import partial, reduce
+from math import gcd
 
 n_thread = 50
 
@@ -32,11 +33,66 @@ def parse_args():
     parser.add_argument('-se', '--short_edge', type=int, default=None)
     parser.add_argument('-fps', type=int, default=None)
     parser.add_argument('--prefix', type=str, default='img_%05d.jpg')
+    parser.add_argument('--stride', type=int, default=1,
+                        help='keep every stride-th frame of the video')
+    parser.add_argument('--sampling', type=str, nargs='+', default=None,
+                        help='the clip_len x frame_interval (e.g. 8x8 16x4) '
+                        'of the configs trained on the frames, keep the '
+                        'frames they can sample, i.e. sets the stride to '
+                        'the gcd of the frame intervals')
+    parser.add_argument('-q', '--quality', type=int, default=1,
+                        help='JPEG quality of ffmpeg, 1 (best) to 31')
     args = parser.parse_args()
+    if args.sampling is not None:
+        args.stride = sampling_stride(args.sampling)
+        print('frame stride: {}'.format(args.stride))
     return args
 
 
-def vid2jpg(tup, decode_type, se=None, fps=None, prefix='img_%05d.jpg'):
+def sampling_stride(sampling):
+    """The stride keeping the frames sampled by the given configs.
+
+    A clip sampled with `frame_interval` from a start frame that is a
+    multiple of the stride only reads frames that are multiples of the
+    stride when the stride divides the interval.
+
+    Args:
+        sampling (list[str]): clip_len x frame_interval of the configs,
+            e.g. ['8x8', '16x4'].
+    """
+    intervals = [int(cfg.lower().split('x')[1]) for cfg in sampling]
+    return reduce(gcd, intervals)
+
+
+def ffmpeg_cmd(src, video_folder, prefix, width, height, se=None, fps=None,
+               stride=1, quality=1):
+    """Build the ffmpeg command extracting the frames of a video."""
+    filters = []
+    if stride > 1:
+        if fps is not None:
+            # the stride counts the frames at the target fps
+            filters.append('fps={}'.format(fps))
+        # select before scale, the dropped frames are not rescaled
+        filters.append('select=not(mod(n\\,{}))'.format(stride))
+    if se is not None:
+        if width > height:
+            filters.append('scale=-1:{}'.format(se))
+        else:
+            filters.append('scale={}:-1'.format(se))
+    cmd = 'ffmpeg -i \"{}\"  -threads 1'.format(src)
+    if filters:
+        cmd += ' -vf \"{}\"'.format(','.join(filters))
+    if stride > 1:
+        # number the selected frames consecutively
+        cmd += ' -vsync vfr'
+    elif fps is not None:
+        cmd += ' -r {}'.format(fps)
+    cmd += ' -q:v {} \"{}/{}\"'.format(quality, video_folder, prefix)
+    return cmd
+
+
+def vid2jpg(tup, decode_type, se=None, fps=None, prefix='img_%05d.jpg',
+            stride=1, quality=1):
     """[summary]
 
     Args:
@@ -45,6 +101,9 @@ def vid2jpg(tup, decode_type, se=None, fps=None, prefix='img_%05d.jpg'):
         se ([type], optional): [description]. Defaults to None.
         fps ([type], optional): [description]. Defaults to None.
         prefix (str, optional): [description]. Defaults to 'img_%05d.jpg'.
+        stride (int, optional): Keep the frames 0, stride, 2 * stride, ...
+            of the video, numbered consecutively. Defaults to 1.
+        quality (int, optional): JPEG quality of ffmpeg. Defaults to 1.
     """
     src, dest = tup
     folder, name = osp.split(dest)
@@ -76,28 +135,8 @@ def vid2jpg(tup, decode_type, se=None, fps=None, prefix='img_%05d.jpg'):
     width, height = int(w), int(h)
 
     if decode_type == 'ffmpeg':
-        if se is None:
-            if fps is None:
-                cmd = 'ffmpeg -i \"{}\"  -threads 1 -q:v 1 \
-                    \"{}/{}\"'.format(src, video_folder, prefix)
-            else:
-                cmd = 'ffmpeg -i \"{}\"  -threads 1 -q:v 1 -r {} \
-                    \"{}/{}\"'.format(src, fps, video_folder, prefix)
-        else:
-            if width > height:
-                if fps is None:
-                    cmd = 'ffmpeg -i \"{}\"  -threads 1 -vf scale=-1:{} -q:v 1 \
-                        \"{}/{}\"'.format(src, se, video_folder, prefix)
-                else:
-                    cmd = 'ffmpeg -i \"{}\"  -threads 1 -vf scale=-1:{} -q:v 1 -r {} \
-                        \"{}/{}\"'.format(src, se, fps, video_folder, prefix)
-            else:
-                if fps is None:
-                    cmd = 'ffmpeg -i \"{}\"  -threads 1 -vf scale={}:-1 -q:v 1 \
-                        \"{}/{}\"'.format(src, se, video_folder, prefix)
-                else:
-                    cmd = 'ffmpeg -i \"{}\"  -threads 1 -vf scale={}:-1 -q:v 1 -r {} \
-                        \"{}/{}\"'.format(src, se, fps, video_folder, prefix)
+        cmd = ffmpeg_cmd(src, video_folder, prefix, width, height, se=se,
+                         fps=fps, stride=stride, quality=quality)
         # print(cmd)
         subprocess.call(cmd, shell=True,
                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
@@ -107,28 +146,30 @@ def vid2jpg(tup, decode_type, se=None, fps=None, prefix='img_%05d.jpg'):
         cap = cv2.VideoCapture(src)
         ret, frame = cap.read()
         if ret:
+            frame_idx = 0
             while ret:
-                if se is not None:
-                    if width > height:
-                        frame = cv2.resize(frame, (int(height / se * width), se))
-                    else:
-                        frame = cv2.resize(frame, (se, int(width / se * height)))
-                frame_list.append(frame)
+                if frame_idx % stride == 0:
+                    if se is not None:
+                        if width > height:
+                            frame = cv2.resize(
+                                frame, (int(height / se * width), se))
+                        else:
+                            frame = cv2.resize(
+                                frame, (se, int(width / se * height)))
+                    frame_list.append(frame)
+                frame_idx += 1
                 ret, frame = cap.read()
-            for i in range(1, len(frame_list)):
+            # frame i (from 1) is the frame (i - 1) * stride, as with ffmpeg.
+            # Without a stride, the first frame is dropped and frame i is
+            # the frame i, the naming of the existing extractions
+            if stride == 1:
+                frame_list = frame_list[1:]
+            for i, frame in enumerate(frame_list, 1):
                 out_img = '{}/{}'.format(video_folder, prefix % i)
-                cv2.imwrite(out_img, frame_list[i])
+                cv2.imwrite(out_img, frame)
         else:
-            if se is None:
-                cmd = 'ffmpeg -i \"{}\"  -threads 1 -q:v 1 \
-                    \"{}/{}\"'.format(src, video_folder, prefix)
-            else:
-                if width > height:
-                    cmd = 'ffmpeg -i \"{}\"  -threads 1 -vf scale=-1:{} -q:v 1 \
-                        \"{}/{}\"'.format(src, se, video_folder, prefix)
-                else:
-                    cmd = 'ffmpeg -i \"{}\"  -threads 1 -vf scale={}:-1 -q:v 1 \
-                        \"{}/{}\"'.format(src, se, video_folder, prefix)
+            cmd = ffmpeg_cmd(src, video_folder, prefix, width, height,
+                             se=se, stride=stride, quality=quality)
             # print(cmd)
             subprocess.call(cmd, shell=True,
                             stdout=subprocess.DEVNULL,
@@ -163,7 +204,8 @@ def main():
 
     pool = multiprocessing.Pool(n_thread)
     worker = partial(vid2jpg, decode_type=args.lib,
-                     se=args.short_edge, fps=args.fps, prefix=args.prefix)
+                     se=args.short_edge, fps=args.fps, prefix=args.prefix,
+                     stride=args.stride, quality=args.quality)
     # 1: Use tqdm for progress bar
     from tqdm import tqdm
     for _ in tqdm(pool.imap_unordered(worker, vid_list),
@@ -30,6 +30,13 @@ def parse_args():
     return args
 
 
+def scale_filter(width, height, se):
+    """ffmpeg filter scaling the short edge of a video to `se`."""
+    if int(width) > int(height):
+        return 'scale=-2:{}'.format(se)
+    return 'scale={}:-2'.format(se)
+
+
 def vid_resize(tup, se):
     """[summary]
 
@@ -47,12 +54,9 @@ def vid_resize(tup, se):
         stream=width,height -of csv=s=x:p=0 \"{}\"'.format(src)
     width, height = subprocess.check_output(
         cmd1, shell=True).decode('utf-8').split('x')
-    if int(width) > int(height):
-        os.system('ffmpeg -y -loglevel panic -i {} -threads 1 \
-            -filter:v scale=-2:{} -q:v 1 -c:a copy {}'.format(src, se, dest))
-    else:
-        os.system('ffmpeg -y -loglevel panic -i {} -threads 1 \
-            -filter:v scale={}:-2 -q:v 1 -c:a copy {}'.format(src, se, dest))
+    os.system('ffmpeg -y -loglevel panic -i {} -threads 1 \
+        -filter:v {} -q:v 1 -c:a copy {}'.format(
+            src, scale_filter(width, height, se), dest))
 
 
 def main():